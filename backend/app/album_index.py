@@ -0,0 +1,1081 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+from datetime import datetime
+from app.config import INDEX_DB_FILE, STOCK_DIR, PDF_DIR, IMAGE_SUFFIXES, PATH_CACHE_SIZE
+from app.blob_store import blob_store
+
+
+# 专辑列表支持的排序字段
+ALBUM_SORT_KEYS = ("downloaded_at", "album_id")
+
+# 中日韩文字：unicode61分词器把连续的汉字当成一个词，写入和查询前在每个字两侧加空格，按单字分词
+CJK_CHAR = re.compile(r"([\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff])")
+SEARCH_TOKEN = re.compile(r"[^\W_]+")
+# 搜索排序时各字段的权重：album_id（不索引）、ID、标题、文件夹名、作者、标签
+SEARCH_WEIGHTS = (0, 10, 5, 2, 3, 1)
+
+
+def search_text(text: Optional[str]) -> str:
+    """转换为写入搜索索引的文本"""
+    return CJK_CHAR.sub(r" \1 ", text or "")
+
+
+def search_query(query: str) -> Optional[str]:
+    """
+    把用户输入转换为FTS5查询：按空白分成多个词，每个词作为短语前缀匹配（最后一个字可以只输入一部分），
+    所有词都要匹配；不会把用户输入当成FTS5语法解析
+
+    Returns:
+        FTS5查询表达式，没有可搜索的内容时为None
+    """
+    phrases = []
+    for term in query.split():
+        tokens = SEARCH_TOKEN.findall(search_text(term))
+        if tokens:
+            phrases.append('"' + " ".join(tokens) + '"*')
+    return " AND ".join(phrases) or None
+
+
+def compute_digests(path: Path, chunk_size: int = 1024 * 1024) -> Tuple[str, int]:
+    """读取一次文件，同时计算强ETag（SHA-256，也是blob存储的内容地址）和CRC32（打包ZIP时使用）"""
+    digest = hashlib.sha256()
+    crc = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+            crc = zlib.crc32(chunk, crc)
+    return f'"{digest.hexdigest()}"', crc
+
+
+def compute_etag(path: Path) -> str:
+    """按文件内容计算强ETag"""
+    return compute_digests(path)[0]
+
+
+def natural_key(path: str) -> List:
+    """按自然顺序排序的键，章节目录 2 排在 10 之前"""
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", path)]
+
+
+class ImagePathCache:
+    """
+    已解析的图片路径缓存（线程安全）
+
+    album_id + 图片相对路径 → (专辑实际ID, 文件路径)，按最近使用淘汰，
+    专辑重新入库或移除时按专辑实际ID失效。
+    """
+
+    def __init__(self, max_items: int = PATH_CACHE_SIZE):
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[Tuple[str, str], Tuple[str, Path]]" = OrderedDict()
+
+    def get(self, album_id: str, image_path: str) -> Optional[Path]:
+        with self._lock:
+            item = self._items.get((album_id, image_path))
+            if item is None:
+                return None
+            self._items.move_to_end((album_id, image_path))
+            return item[1]
+
+    def put(self, album_id: str, image_path: str, canonical_id: str, path: Path):
+        with self._lock:
+            self._items[(album_id, image_path)] = (canonical_id, path)
+            self._items.move_to_end((album_id, image_path))
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def discard(self, album_id: str, image_path: str):
+        with self._lock:
+            self._items.pop((album_id, image_path), None)
+
+    def invalidate(self, canonical_id: Optional[str] = None):
+        """移除指定专辑的缓存，不指定时清空"""
+        with self._lock:
+            if canonical_id is None:
+                self._items.clear()
+                return
+            stale = [key for key, item in self._items.items() if item[0] == canonical_id]
+            for key in stale:
+                del self._items[key]
+
+
+class AlbumIndex:
+    """
+    专辑索引
+
+    持久化保存 album_id → 文件夹、图片列表、页数、大小、修改时间，
+    下载完成时写入，也可以从磁盘重建，避免每次请求都遍历 stock 目录。
+    """
+
+    def __init__(self, db_file: Path = INDEX_DB_FILE):
+        """初始化索引数据库"""
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(db_file), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._init_schema()
+        self.path_cache = ImagePathCache()
+        # 最近访问时间先记录在内存中，定期批量写入（album_id → 访问时间）
+        self._access: Dict[str, str] = {}
+        self._access_lock = threading.Lock()
+
+    def _init_schema(self):
+        """创建表结构"""
+        with self._lock, self._conn:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS albums (
+                    album_id TEXT PRIMARY KEY,
+                    folder TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    title TEXT,
+                    page_count INTEGER NOT NULL DEFAULT 0,
+                    total_size INTEGER NOT NULL DEFAULT 0,
+                    mtime REAL NOT NULL DEFAULT 0,
+                    downloaded_at TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_albums_folder ON albums(folder);
+                CREATE TABLE IF NOT EXISTS images (
+                    album_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    PRIMARY KEY (album_id, seq)
+                );
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_images_path ON images(album_id, path);
+                CREATE TABLE IF NOT EXISTS file_etags (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    etag TEXT NOT NULL
+                );
+            """)
+            self._ensure_column("albums", "has_pdf", "INTEGER NOT NULL DEFAULT 0")
+            self._ensure_column("file_etags", "crc32", "INTEGER")
+            self._ensure_column("images", "blob", "TEXT")
+            # 下载中的专辑：已写入的页面按顺序登记，complete=0，expected_pages为上游给出的总页数
+            self._ensure_column("albums", "complete", "INTEGER NOT NULL DEFAULT 1")
+            self._ensure_column("albums", "expected_pages", "INTEGER")
+            # 最近一次通过图片/PDF接口访问的时间，磁盘配额按最久未使用清理
+            self._ensure_column("albums", "last_access", "TEXT")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_images_blob ON images(blob)")
+            # 因磁盘配额被清理的专辑，再次请求时重新下载
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS evicted (
+                    album_id TEXT PRIMARY KEY,
+                    evicted_at TEXT NOT NULL
+                )
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_albums_downloaded ON albums(downloaded_at, album_id)"
+            )
+            # 上游元数据中的作者和标签（JSON数组），用于搜索
+            self._ensure_column("albums", "authors", "TEXT")
+            self._ensure_column("albums", "tags", "TEXT")
+            # 搜索索引：album_id原样保存，其余字段保存 search_text 转换后的文本
+            has_search = self._conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'album_search'"
+            ).fetchone() is not None
+            self._conn.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS album_search USING fts5(
+                    album_id UNINDEXED, id_text, title, name, authors, tags,
+                    tokenize = 'unicode61 remove_diacritics 2'
+                )
+            """)
+            if not has_search:
+                self._reindex_search()
+            # 旧目录规则的文件夹以文件夹名作为album_id登记，文件夹名中的专辑ID作为别名，查找时不需要遍历
+            has_aliases = self._conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'album_aliases'"
+            ).fetchone() is not None
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS album_aliases (
+                    alias TEXT PRIMARY KEY,
+                    album_id TEXT NOT NULL
+                )
+            """)
+            if not has_aliases:
+                self._reindex_aliases()
+
+    def _ensure_column(self, table: str, column: str, definition: str):
+        """旧版数据库缺少字段时补上（调用方需持有锁）"""
+        columns = [row["name"] for row in self._conn.execute(f"PRAGMA table_info({table})")]
+        if column not in columns:
+            self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    @staticmethod
+    def _search_row(row) -> Tuple:
+        """专辑记录对应的搜索索引行"""
+        authors = json.loads(row["authors"]) if row["authors"] else []
+        tags = json.loads(row["tags"]) if row["tags"] else []
+        return (
+            row["album_id"],
+            search_text(row["album_id"]),
+            search_text(row["title"]),
+            search_text(row["name"]),
+            search_text(" ".join(authors)),
+            search_text(" ".join(tags))
+        )
+
+    def _reindex_search(self):
+        """按专辑记录重建整个搜索索引（调用方需持有锁）"""
+        self._conn.execute("DELETE FROM album_search")
+        rows = self._conn.execute("SELECT album_id, title, name, authors, tags FROM albums").fetchall()
+        self._conn.executemany(
+            "INSERT INTO album_search (album_id, id_text, title, name, authors, tags) VALUES (?, ?, ?, ?, ?, ?)",
+            [self._search_row(row) for row in rows]
+        )
+
+    @staticmethod
+    def _legacy_aliases(album_ids: Iterable[str]) -> Dict[str, str]:
+        """
+        以文件夹名登记的专辑的别名：文件夹名中的每段数字对应该专辑，重复时album_id较小的优先
+
+        Args:
+            album_ids: 以文件夹名登记的专辑ID（即文件夹名）
+
+        Returns:
+            别名 → album_id
+        """
+        aliases: Dict[str, str] = {}
+        for album_id in sorted(album_ids):
+            for alias in re.findall(r"\d+", album_id):
+                if alias != album_id:
+                    aliases.setdefault(alias, album_id)
+        return aliases
+
+    def _reindex_aliases(self):
+        """按以文件夹名登记的专辑重建别名（调用方需持有锁）"""
+        self._conn.execute("DELETE FROM album_aliases")
+        rows = self._conn.execute("SELECT album_id FROM albums WHERE album_id = name").fetchall()
+        self._conn.executemany(
+            "INSERT INTO album_aliases (alias, album_id) VALUES (?, ?)",
+            self._legacy_aliases(row["album_id"] for row in rows).items()
+        )
+
+    def _resolve_id(self, album_id: str) -> str:
+        """
+        请求中的专辑ID对应的登记ID（调用方需持有锁）
+
+        有图片文件夹的登记优先：旧目录规则的文件夹以文件夹名登记，请求中的ID是它的别名；
+        同一ID只有PDF的登记（旧版按请求中的ID生成的PDF）不会遮住别名指向的文件夹。
+        """
+        row = self._conn.execute("SELECT folder FROM albums WHERE album_id = ?", (album_id,)).fetchone()
+        if row is not None and row["folder"]:
+            return album_id
+        alias = self._conn.execute(
+            """
+            SELECT albums.album_id FROM album_aliases
+            JOIN albums ON albums.album_id = album_aliases.album_id
+            WHERE album_aliases.alias = ?
+            """,
+            (album_id,)
+        ).fetchone()
+        return alias["album_id"] if alias is not None else album_id
+
+    def resolve_id(self, album_id: str) -> str:
+        """请求中的专辑ID对应的登记ID（旧目录规则的文件夹为文件夹名，其余与请求中的ID相同）"""
+        with self._lock:
+            return self._resolve_id(album_id)
+
+    def _sync_search(self, album_id: str):
+        """专辑记录变化后更新它在搜索索引中的行，专辑已移除时删除（调用方需持有锁）"""
+        tokens = SEARCH_TOKEN.findall(search_text(album_id))
+        if tokens:
+            # album_id 不建索引，先按ID分词后的全文匹配缩小范围
+            self._conn.execute(
+                """
+                DELETE FROM album_search WHERE rowid IN (
+                    SELECT rowid FROM album_search WHERE album_search MATCH ? AND album_id = ?
+                )
+                """,
+                ('id_text:"' + " ".join(tokens) + '"', album_id)
+            )
+        else:
+            self._conn.execute("DELETE FROM album_search WHERE album_id = ?", (album_id,))
+        row = self._conn.execute(
+            "SELECT album_id, title, name, authors, tags FROM albums WHERE album_id = ?", (album_id,)
+        ).fetchone()
+        if row is not None:
+            self._conn.execute(
+                "INSERT INTO album_search (album_id, id_text, title, name, authors, tags) VALUES (?, ?, ?, ?, ?, ?)",
+                self._search_row(row)
+            )
+
+    @staticmethod
+    def _scan_folder(folder: Path) -> List[Dict]:
+        """扫描单个专辑文件夹中的图片"""
+        images = []
+        paths = sorted(folder.rglob("*"), key=lambda p: natural_key(p.relative_to(folder).as_posix()))
+        for img_path in paths:
+            if img_path.suffix.lower() not in IMAGE_SUFFIXES or not img_path.is_file():
+                continue
+            # 以.开头的是下载中的临时文件
+            if img_path.name.startswith("."):
+                continue
+            stat = img_path.stat()
+            images.append({
+                "path": img_path.relative_to(folder).as_posix(),
+                "size": stat.st_size,
+                "mtime": stat.st_mtime
+            })
+        return images
+
+    def _write_album(
+        self,
+        album_id: str,
+        folder: Path,
+        images: List[Dict],
+        title: Optional[str] = None,
+        downloaded_at: Optional[str] = None
+    ):
+        """写入一个专辑及其图片（调用方需持有锁）"""
+        mtime = max((img["mtime"] for img in images), default=0)
+        self._conn.execute("DELETE FROM evicted WHERE album_id = ?", (album_id,))
+        self._conn.execute("DELETE FROM images WHERE album_id = ?", (album_id,))
+        self._conn.executemany(
+            "INSERT INTO images (album_id, seq, path, size, mtime, blob) VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (album_id, seq, img["path"], img["size"], img["mtime"], img.get("blob"))
+                for seq, img in enumerate(images)
+            ]
+        )
+        self._conn.execute(
+            """
+            INSERT INTO albums (album_id, folder, name, title, page_count, total_size, mtime, downloaded_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(album_id) DO UPDATE SET
+                folder = excluded.folder,
+                name = excluded.name,
+                title = COALESCE(excluded.title, albums.title),
+                page_count = excluded.page_count,
+                total_size = excluded.total_size,
+                mtime = excluded.mtime,
+                downloaded_at = CASE WHEN albums.complete THEN COALESCE(albums.downloaded_at, excluded.downloaded_at)
+                                     ELSE excluded.downloaded_at END,
+                complete = 1,
+                expected_pages = NULL
+            """,
+            (
+                album_id,
+                str(folder),
+                folder.name,
+                title,
+                len(images),
+                sum(img["size"] for img in images),
+                mtime,
+                downloaded_at or datetime.fromtimestamp(mtime).isoformat()
+            )
+        )
+
+    def add_album(self, album_id: str, folder: Path, title: Optional[str] = None) -> int:
+        """
+        下载完成后登记专辑，图片同时登记到blob存储，与已有内容重复的替换为硬链接
+
+        Args:
+            album_id: 专辑ID
+            folder: 专辑根目录
+            title: 专辑标题
+
+        Returns:
+            int: 登记的图片数量
+        """
+        folder = Path(folder)
+        images = self._scan_folder(folder) if folder.is_dir() else []
+        if not images:
+            return 0
+        # 替换为硬链接后图片的修改时间会变为已有blob的时间，下载时间按替换前计算
+        downloaded_at = datetime.fromtimestamp(max(img["mtime"] for img in images)).isoformat()
+        digests = [self._ingest_image(folder, img)[0] for img in images]
+        with self._lock, self._conn:
+            self._write_album(album_id, folder, images, title, downloaded_at)
+            self._sync_search(album_id)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO file_etags (path, size, mtime, etag, crc32) VALUES (?, ?, ?, ?, ?)",
+                digests
+            )
+        self.path_cache.invalidate(album_id)
+        return len(images)
+
+    def begin_album(self, album_id: str, folder: Path, title: Optional[str], expected_pages: Optional[int]) -> bool:
+        """
+        开始下载专辑：尚未登记的专辑先登记为下载中，之后按顺序登记已写入的页面
+
+        Args:
+            album_id: 专辑ID
+            folder: 专辑根目录
+            title: 专辑标题
+            expected_pages: 上游给出的总页数
+
+        Returns:
+            bool: 是否需要逐页登记（已完整登记过的专辑重新下载时为False，下载完成后整体更新）
+        """
+        folder = Path(folder)
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT complete, page_count FROM albums WHERE album_id = ?", (album_id,)
+            ).fetchone()
+            if row is not None and row["complete"] and row["page_count"]:
+                return False
+            self._conn.execute("DELETE FROM evicted WHERE album_id = ?", (album_id,))
+            self._conn.execute(
+                """
+                INSERT INTO albums (album_id, folder, name, title, downloaded_at, complete, expected_pages)
+                VALUES (?, ?, ?, ?, ?, 0, ?)
+                ON CONFLICT(album_id) DO UPDATE SET
+                    folder = excluded.folder,
+                    name = excluded.name,
+                    title = COALESCE(excluded.title, albums.title),
+                    complete = 0,
+                    expected_pages = excluded.expected_pages
+                """,
+                (album_id, str(folder), folder.name, title, datetime.now().isoformat(), expected_pages or None)
+            )
+            self._sync_search(album_id)
+        return True
+
+    def add_partial_images(self, album_id: str, images: List[Dict]):
+        """
+        登记下载中的专辑已写入的页面（seq与下载完成后的顺序一致，重复登记会覆盖）
+
+        Args:
+            album_id: 专辑ID
+            images: [{"seq", "path", "size", "mtime"}, ...]，path相对专辑根目录
+        """
+        if not images:
+            return
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT complete FROM albums WHERE album_id = ?", (album_id,)
+            ).fetchone()
+            # 已被重建或下载完成的登记覆盖
+            if row is None or row["complete"]:
+                return
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO images (album_id, seq, path, size, mtime) VALUES (?, ?, ?, ?, ?)",
+                [(album_id, img["seq"], img["path"], img["size"], img["mtime"]) for img in images]
+            )
+            self._conn.execute(
+                """
+                UPDATE albums SET
+                    page_count = (SELECT COUNT(*) FROM images WHERE album_id = ?),
+                    total_size = (SELECT COALESCE(SUM(size), 0) FROM images WHERE album_id = ?),
+                    mtime = MAX(mtime, ?)
+                WHERE album_id = ?
+                """,
+                (album_id, album_id, max(img["mtime"] for img in images), album_id)
+            )
+
+    def abort_album(self, album_id: str) -> int:
+        """
+        下载取消或失败后结束下载中的登记（已完整登记的专辑不受影响）
+
+        已写入磁盘的页面按下载完成登记（可以浏览、打包，也会参与磁盘配额清理，再次下载时补全），
+        没有写入任何页面时移除登记。
+
+        Args:
+            album_id: 专辑ID
+
+        Returns:
+            int: 登记的图片数量
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT folder, complete FROM albums WHERE album_id = ?", (album_id,)
+            ).fetchone()
+        if row is None or row["complete"]:
+            return 0
+        image_count = self.add_album(album_id, Path(row["folder"])) if row["folder"] else 0
+        if image_count == 0:
+            self.remove_album(album_id)
+        return image_count
+
+    @staticmethod
+    def _ingest_image(folder: Path, img: Dict) -> Tuple[Tuple, int]:
+        """
+        计算图片的ETag和CRC32（供条件请求和打包下载使用），并登记到blob存储
+
+        登记后更新图片记录的blob和修改时间（替换为硬链接后修改时间会变化）。
+
+        Returns:
+            (file_etags记录, 替换重复文件节省的字节数)
+        """
+        path = folder / img["path"]
+        etag, crc32 = compute_digests(path)
+        digest = etag.strip('"')
+        stored, saved = blob_store.ingest(path, digest)
+        img["blob"] = digest if stored else None
+        if stored:
+            img["mtime"] = path.stat().st_mtime
+        # ETag记录在实际读取的路径上，内容相同的图片共用一条
+        src = blob_store.resolve(path, img["blob"])
+        return (str(src), img["size"], img["mtime"], etag, crc32), saved
+
+    def dedupe(self) -> Dict:
+        """
+        把尚未登记到blob存储的图片（如启用去重前下载的专辑）去重，并清理不再被引用的blob
+
+        Returns:
+            dict: 处理的图片数、替换为硬链接的图片数、节省的字节数、清理的blob数
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT images.album_id, images.path, images.size, albums.folder FROM images
+                JOIN albums ON albums.album_id = images.album_id
+                WHERE images.blob IS NULL AND albums.folder != ''
+                ORDER BY images.album_id
+                """
+            ).fetchall()
+        result = {"images": 0, "linked": 0, "saved_bytes": 0}
+        pending: Dict[str, List[Dict]] = {}
+        for row in rows:
+            pending.setdefault(row["album_id"], []).append(dict(row))
+
+        for album_id, images in pending.items():
+            if not blob_store.enabled:
+                break
+            updates, digests = [], []
+            for img in images:
+                try:
+                    digest_row, saved = self._ingest_image(Path(img["folder"]), img)
+                except OSError:
+                    continue
+                result["images"] += 1
+                if saved:
+                    result["linked"] += 1
+                    result["saved_bytes"] += saved
+                if img["blob"]:
+                    updates.append((img["blob"], img["mtime"], album_id, img["path"]))
+                    digests.append(digest_row)
+            with self._lock, self._conn:
+                self._conn.executemany(
+                    "UPDATE images SET blob = ?, mtime = ? WHERE album_id = ? AND path = ?", updates
+                )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO file_etags (path, size, mtime, etag, crc32) VALUES (?, ?, ?, ?, ?)",
+                    digests
+                )
+            self.path_cache.invalidate(album_id)
+        result["pruned_blobs"] = blob_store.prune()
+        return result
+
+    def remove_album(self, album_id: str):
+        """从索引中移除专辑的图片，仍有PDF时保留专辑记录"""
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT folder, has_pdf FROM albums WHERE album_id = ?", (album_id,)
+            ).fetchone()
+            if row is None:
+                return
+            if row["folder"]:
+                self._conn.execute(
+                    "DELETE FROM file_etags WHERE substr(path, 1, ?) = ?",
+                    (len(row["folder"]) + 1, row["folder"] + "/")
+                )
+            self._conn.execute("DELETE FROM images WHERE album_id = ?", (album_id,))
+            if row["has_pdf"]:
+                self._conn.execute(
+                    "UPDATE albums SET folder = '', name = '', page_count = 0, total_size = 0 WHERE album_id = ?",
+                    (album_id,)
+                )
+            else:
+                self._conn.execute("DELETE FROM albums WHERE album_id = ?", (album_id,))
+                self._conn.execute("DELETE FROM album_aliases WHERE album_id = ?", (album_id,))
+            self._sync_search(album_id)
+        self.path_cache.invalidate(album_id)
+
+    def _write_pdf(self, album_id: str, pdf_path: Path) -> str:
+        """
+        登记专辑的PDF，记在别名指向的登记上（调用方需持有锁）
+
+        Returns:
+            str: 登记PDF的专辑ID
+        """
+        album_id = self._resolve_id(album_id)
+        downloaded_at = datetime.fromtimestamp(pdf_path.stat().st_mtime).isoformat()
+        self._conn.execute(
+            """
+            INSERT INTO albums (album_id, folder, name, downloaded_at, has_pdf)
+            VALUES (?, '', '', ?, 1)
+            ON CONFLICT(album_id) DO UPDATE SET has_pdf = 1
+            """,
+            (album_id, downloaded_at)
+        )
+        return album_id
+
+    def set_pdf(self, album_id: str, pdf_path: Optional[Path]):
+        """
+        更新专辑的PDF状态
+
+        Args:
+            album_id: 专辑ID
+            pdf_path: PDF文件路径，None表示PDF已不存在
+        """
+        with self._lock, self._conn:
+            album_id = self._resolve_id(album_id)
+            if pdf_path is not None:
+                self._write_pdf(album_id, pdf_path)
+            else:
+                self._conn.execute("UPDATE albums SET has_pdf = 0 WHERE album_id = ?", (album_id,))
+                self._conn.execute(
+                    "DELETE FROM albums WHERE album_id = ? AND page_count = 0 AND complete = 1", (album_id,)
+                )
+            self._sync_search(album_id)
+
+    def rebuild(self) -> int:
+        """
+        从磁盘重建索引
+
+        已登记的文件夹沿用原有album_id，未登记的文件夹以文件夹名作为album_id。
+        下载中的专辑保留原有登记（已按顺序登记的页面和总页数），不按磁盘上的部分图片登记为下载完成。
+
+        Returns:
+            int: 重建后的专辑数量（包括只有PDF的专辑）
+        """
+        with self._lock:
+            known = {
+                row["folder"]: dict(row)
+                for row in self._conn.execute("SELECT album_id, folder, title, downloaded_at, last_access, authors, tags FROM albums")
+            }
+            # 大小和修改时间未变化的图片沿用已登记的blob
+            blobs = {
+                (row["folder"], row["path"]): (row["size"], row["mtime"], row["blob"])
+                for row in self._conn.execute(
+                    """
+                    SELECT albums.folder, images.path, images.size, images.mtime, images.blob FROM images
+                    JOIN albums ON albums.album_id = images.album_id
+                    WHERE images.blob IS NOT NULL
+                    """
+                )
+            }
+
+        scanned = []
+        if STOCK_DIR.exists():
+            for item in sorted(STOCK_DIR.iterdir()):
+                if not item.is_dir():
+                    continue
+                images = self._scan_folder(item)
+                for img in images:
+                    old_blob = blobs.get((str(item), img["path"]))
+                    if old_blob is not None and old_blob[:2] == (img["size"], img["mtime"]):
+                        img["blob"] = old_blob[2]
+                if images:
+                    old = known.get(str(item), {})
+                    scanned.append((old.get("album_id", item.name), item, images, old))
+
+        # 旧版按请求中的ID命名的PDF（旧目录规则的文件夹），改为按登记的专辑ID命名（与PDF生成器一致）
+        folder_ids = {album_id for album_id, _, _, _ in scanned}
+        aliases = self._legacy_aliases(album_id for album_id, folder, _, _ in scanned if album_id == folder.name)
+        pdf_files = []
+        for pdf_path in sorted(PDF_DIR.glob("*.pdf")) if PDF_DIR.exists() else []:
+            target = aliases.get(pdf_path.stem)
+            if target is not None and pdf_path.stem not in folder_ids:
+                canonical = pdf_path.with_name(f"{target}.pdf")
+                if canonical.exists():
+                    # 已有按专辑ID生成的PDF，旧的是重复的
+                    pdf_path.unlink()
+                    continue
+                os.replace(pdf_path, canonical)
+                pdf_path = canonical
+            pdf_files.append(pdf_path)
+
+        with self._lock, self._conn:
+            # 扫描期间可能有专辑开始或完成下载，以写入时的状态为准
+            downloading = {
+                (row["album_id"], row["folder"])
+                for row in self._conn.execute("SELECT album_id, folder FROM albums WHERE complete = 0")
+            }
+            downloading_ids = {album_id for album_id, _ in downloading}
+            downloading_folders = {folder for _, folder in downloading}
+            self._conn.execute(
+                "DELETE FROM images WHERE album_id NOT IN (SELECT album_id FROM albums WHERE complete = 0)"
+            )
+            self._conn.execute("DELETE FROM albums WHERE complete = 1")
+            for album_id, folder, images, old in scanned:
+                if album_id in downloading_ids or str(folder) in downloading_folders:
+                    continue
+                self._write_album(album_id, folder, images, old.get("title"), old.get("downloaded_at"))
+                if old:
+                    self._conn.execute(
+                        "UPDATE albums SET last_access = ?, authors = ?, tags = ? WHERE album_id = ?",
+                        (old["last_access"], old["authors"], old["tags"], album_id)
+                    )
+            # 先建立别名，PDF登记到别名指向的文件夹上
+            self._reindex_aliases()
+            for pdf_path in pdf_files:
+                self._write_pdf(pdf_path.stem, pdf_path)
+            self._reindex_search()
+            total = self._conn.execute("SELECT COUNT(*) FROM albums").fetchone()[0]
+        self.path_cache.invalidate()
+        blob_store.prune()
+        return total
+
+    def touch(self, album_id: str):
+        """记录专辑被访问（只写内存，由 flush_access 批量写入）"""
+        with self._access_lock:
+            self._access[album_id] = datetime.now().isoformat()
+
+    def flush_access(self):
+        """
+        把内存中记录的访问时间写入数据库
+
+        记录的是请求中的ID，写入时换成登记ID，旧目录规则的文件夹按别名访问时也能更新访问时间。
+        """
+        with self._access_lock:
+            access, self._access = self._access, {}
+        if not access:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                """
+                UPDATE albums SET last_access = ?
+                WHERE album_id = ? AND (last_access IS NULL OR last_access < ?)
+                """,
+                [(at, self._resolve_id(album_id), at) for album_id, at in access.items()]
+            )
+
+    def stock_usage(self) -> int:
+        """已登记图片占用的字节数（去重后内容相同的图片只计一次）"""
+        with self._lock:
+            return self._conn.execute(
+                """
+                SELECT COALESCE(SUM(size), 0) FROM (
+                    SELECT MAX(size) AS size FROM images GROUP BY COALESCE(blob, album_id || '/' || path)
+                )
+                """
+            ).fetchone()[0]
+
+    def lru_albums(self, limit: int = 100, with_pdf: bool = False) -> List[Dict]:
+        """
+        按最近使用时间（访问时间，未访问过时为下载时间）从旧到新列出专辑
+
+        Args:
+            limit: 最多返回的数量
+            with_pdf: True时列出有PDF的专辑，否则列出有图片且已下载完成的专辑
+
+        Returns:
+            [{"album_id", "folder", "last_used"}, ...]
+        """
+        where = "has_pdf = 1" if with_pdf else "folder != '' AND complete = 1"
+        with self._lock:
+            rows = self._conn.execute(
+                f"""
+                SELECT album_id, folder, COALESCE(last_access, downloaded_at, '') AS last_used
+                FROM albums WHERE {where}
+                ORDER BY last_used, album_id LIMIT ?
+                """,
+                (limit,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def exclusive_images(self, album_id: str) -> Tuple[int, List[Path]]:
+        """
+        专辑独占的图片：删除专辑后可以释放的字节数，以及只被该专辑引用的blob
+
+        Returns:
+            (可释放的字节数, blob路径列表)
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT path, MAX(size) AS size, blob FROM images AS i
+                WHERE album_id = ? AND (
+                    blob IS NULL
+                    OR NOT EXISTS (SELECT 1 FROM images AS j WHERE j.blob = i.blob AND j.album_id != i.album_id)
+                )
+                GROUP BY COALESCE(blob, path)
+                """,
+                (album_id,)
+            ).fetchall()
+        blobs = [blob_store.path_for(row["blob"], Path(row["path"]).suffix) for row in rows if row["blob"]]
+        return sum(row["size"] for row in rows), blobs
+
+    def mark_evicted(self, album_id: str):
+        """专辑因磁盘配额被清理：移出索引并记录，再次请求时可以重新下载"""
+        self.remove_album(album_id)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO evicted (album_id, evicted_at) VALUES (?, ?)",
+                (album_id, datetime.now().isoformat())
+            )
+
+    def is_evicted(self, album_id: str) -> bool:
+        """专辑是否因磁盘配额被清理（之后没有重新下载）"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM evicted WHERE album_id = ?", (album_id,)
+            ).fetchone() is not None
+
+    def get_etag(self, path: Path, size: int, mtime: float) -> Optional[str]:
+        """获取文件的ETag，文件大小或修改时间变化后视为失效"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag FROM file_etags WHERE path = ? AND size = ? AND mtime = ?",
+                (str(path), size, mtime)
+            ).fetchone()
+        return row["etag"] if row is not None else None
+
+    def set_etag(self, path: Path, size: int, mtime: float, etag: str, crc32: Optional[int] = None):
+        """记录文件的ETag（以及CRC32）"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO file_etags (path, size, mtime, etag, crc32) VALUES (?, ?, ?, ?, ?)",
+                (str(path), size, mtime, etag, crc32)
+            )
+
+    def get_crc32(self, path: Path, size: int, mtime: float) -> Optional[int]:
+        """获取文件的CRC32，文件大小或修改时间变化后视为失效"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT crc32 FROM file_etags WHERE path = ? AND size = ? AND mtime = ?",
+                (str(path), size, mtime)
+            ).fetchone()
+        return row["crc32"] if row is not None else None
+
+    def is_empty(self) -> bool:
+        """索引是否为空"""
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM albums LIMIT 1").fetchone() is None
+
+    def get_album(self, album_id: str) -> Optional[Dict]:
+        """
+        获取专辑索引记录
+
+        先按album_id精确查找，找不到或只有PDF时按重建索引时记录的别名查找（兼容旧的目录规则，
+        文件夹名中包含专辑ID的文件夹）。都是主键查找，不会遍历专辑。
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM albums WHERE album_id = ?", (album_id,)
+            ).fetchone()
+            if row is None or not row["folder"]:
+                alias = self._conn.execute(
+                    """
+                    SELECT albums.* FROM album_aliases
+                    JOIN albums ON albums.album_id = album_aliases.album_id
+                    WHERE album_aliases.alias = ?
+                    """,
+                    (album_id,)
+                ).fetchone()
+                if alias is not None:
+                    row = alias
+        return dict(row) if row is not None else None
+
+    def get_folder(self, album_id: str) -> Optional[Path]:
+        """获取专辑文件夹路径，文件夹已被删除时同时清理索引"""
+        album = self.get_album(album_id)
+        if album is None or not album["folder"]:
+            return None
+        folder = Path(album["folder"])
+        if not folder.is_dir():
+            self.remove_album(album["album_id"])
+            return None
+        return folder
+
+    def resolve_image(self, album_id: str, image_path: str) -> Optional[Path]:
+        """
+        解析专辑中单张图片的文件路径（结果会被缓存）
+
+        只解析已登记到索引中的图片，不会遍历目录，也不会访问专辑文件夹和blob存储之外的文件。
+
+        Args:
+            album_id: 专辑ID
+            image_path: 图片相对路径
+
+        Returns:
+            Path: 文件路径（已去重的图片为blob路径）；图片不存在时返回None
+        """
+        path = self.path_cache.get(album_id, image_path)
+        if path is not None:
+            return path
+        album = self.get_album(album_id)
+        if album is None or not album["folder"]:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT blob FROM images WHERE album_id = ? AND path = ?",
+                (album["album_id"], image_path)
+            ).fetchone()
+        if row is None:
+            return None
+        path = Path(album["folder"]) / image_path
+        if not path.is_file():
+            return None
+        # 已去重的图片从blob读取，内容相同的图片共享页缓存、ETag和缩略图缓存
+        path = blob_store.resolve(path, row["blob"])
+        self.path_cache.put(album_id, image_path, album["album_id"], path)
+        return path
+
+    def list_images(self, album_id: str) -> List[Dict]:
+        """获取专辑的图片列表（按顺序，blob为去重后的内容地址，未登记为None）"""
+        album = self.get_album(album_id)
+        if album is None:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, size, mtime, blob FROM images WHERE album_id = ? ORDER BY seq",
+                (album["album_id"],)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def list_image_files(self, album_id: str, folder: Path) -> List[Path]:
+        """获取专辑图片的实际读取路径（按顺序，已去重的图片为blob路径）"""
+        return [
+            blob_store.resolve(folder / image["path"], image["blob"])
+            for image in self.list_images(album_id)
+        ]
+
+    def count_albums(self) -> int:
+        """已索引的专辑数量"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM albums").fetchone()[0]
+
+    def list_albums_page(
+        self,
+        sort: str = "downloaded_at",
+        descending: bool = True,
+        limit: int = 50,
+        after: Optional[Tuple[str, str]] = None
+    ) -> Tuple[List[Dict], Optional[Tuple[str, str]]]:
+        """
+        按游标分页获取专辑
+
+        Args:
+            sort: 排序字段，ALBUM_SORT_KEYS之一
+            descending: 是否倒序
+            limit: 每页数量
+            after: 上一页最后一条的(排序值, album_id)
+
+        Returns:
+            (albums, next_key): 本页专辑，以及下一页的游标（没有下一页时为None）
+        """
+        if sort not in ALBUM_SORT_KEYS:
+            raise ValueError(f"不支持的排序字段: {sort}")
+        op, direction = ("<", "DESC") if descending else (">", "ASC")
+        where, params = "", []
+        if after is not None:
+            where = f"WHERE ({sort}, album_id) {op} (?, ?)"
+            params = list(after)
+        with self._lock:
+            rows = self._conn.execute(
+                f"""
+                SELECT * FROM albums {where}
+                ORDER BY {sort} {direction}, album_id {direction}
+                LIMIT ?
+                """,
+                params + [limit + 1]
+            ).fetchall()
+        albums = [dict(row) for row in rows[:limit]]
+        next_key = None
+        if len(rows) > limit:
+            last = albums[-1]
+            next_key = (last[sort], last["album_id"])
+        return albums, next_key
+
+    def set_album_meta(self, album_id: str, title: Optional[str], authors: List[str], tags: List[str]):
+        """
+        记录专辑的上游元数据（标题只在没有时补上），同时更新搜索索引；专辑未登记时忽略
+
+        Args:
+            album_id: 专辑ID
+            title: 专辑标题
+            authors: 作者
+            tags: 标签
+        """
+        with self._lock, self._conn:
+            updated = self._conn.execute(
+                "UPDATE albums SET title = COALESCE(title, ?), authors = ?, tags = ? WHERE album_id = ?",
+                (title, json.dumps(list(authors), ensure_ascii=False), json.dumps(list(tags), ensure_ascii=False),
+                 album_id)
+            ).rowcount
+            if updated:
+                self._sync_search(album_id)
+
+    def albums_without_meta(self) -> List[str]:
+        """还没有记录作者和标签的专辑ID"""
+        with self._lock:
+            return [
+                row["album_id"] for row in self._conn.execute("SELECT album_id FROM albums WHERE authors IS NULL")
+            ]
+
+    def search(self, query: str, limit: int = 50, offset: int = 0) -> Tuple[List[Dict], int]:
+        """
+        按ID、标题、文件夹名、作者和标签搜索专辑
+
+        每个词按前缀匹配（中日韩文字按字匹配，可以搜索标题中的任意一段），所有词都要匹配。
+        ID与输入完全相同的专辑排在最前，其余按相关度（BM25，ID和标题的权重最高）排序。
+
+        Args:
+            query: 搜索内容
+            limit: 每页数量
+            offset: 跳过的结果数
+
+        Returns:
+            (albums, total): 本页专辑，以及匹配的总数
+        """
+        expr = search_query(query)
+        if expr is None:
+            return [], 0
+        weights = ", ".join(str(weight) for weight in SEARCH_WEIGHTS)
+        with self._lock:
+            total = self._conn.execute(
+                "SELECT COUNT(*) FROM album_search WHERE album_search MATCH ?", (expr,)
+            ).fetchone()[0]
+            rows = self._conn.execute(
+                f"""
+                SELECT albums.* FROM album_search
+                JOIN albums ON albums.album_id = album_search.album_id
+                WHERE album_search MATCH ?
+                ORDER BY album_search.album_id = ? DESC, bm25(album_search, {weights}), albums.album_id
+                LIMIT ? OFFSET ?
+                """,
+                (expr, query.strip(), limit, offset)
+            ).fetchall()
+        return [dict(row) for row in rows], total
+
+    def list_images_page(
+        self,
+        album_id: str,
+        after_seq: int = -1,
+        limit: int = 200
+    ) -> Tuple[List[Dict], Optional[int]]:
+        """
+        按游标分页获取专辑图片
+
+        Args:
+            album_id: 专辑ID
+            after_seq: 上一页最后一张图片的序号
+            limit: 每页数量
+
+        Returns:
+            (images, next_seq): 本页图片，以及下一页的游标（没有下一页时为None）
+        """
+        album = self.get_album(album_id)
+        if album is None:
+            return [], None
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT seq, path, size, mtime FROM images
+                WHERE album_id = ? AND seq > ?
+                ORDER BY seq LIMIT ?
+                """,
+                (album["album_id"], after_seq, limit + 1)
+            ).fetchall()
+        images = [dict(row) for row in rows[:limit]]
+        next_seq = images[-1]["seq"] if len(rows) > limit else None
+        return images, next_seq
+
+
+# 全局单例
+album_index = AlbumIndex()
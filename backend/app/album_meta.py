@@ -0,0 +1,227 @@
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import jmcomic
+from app.config import METADATA_DB_FILE, METADATA_TTL, METADATA_WORKERS
+from app.upstream_client import UpstreamClients
+
+
+class AlbumNotFound(Exception):
+    """上游不存在该专辑"""
+
+
+class AlbumMetadataCache:
+    """
+    专辑元数据缓存
+
+    通过jmcomic客户端获取专辑信息（标题、作者、标签、章节列表、页数），可选获取每个章节的页数，
+    保存在本地数据库中，METADATA_TTL 秒内直接使用缓存；过期后重新获取，上游失败时仍返回过期的缓存。
+    支持批量预取（后台线程池，同一专辑同时只获取一次），上游请求使用下载服务共用的上游客户端。
+    """
+
+    def __init__(
+        self,
+        clients: UpstreamClients,
+        db_file: Path = METADATA_DB_FILE,
+        ttl: float = METADATA_TTL,
+        workers: int = METADATA_WORKERS
+    ):
+        """
+        Args:
+            clients: 下载服务共用的上游客户端
+            db_file: 缓存数据库
+            ttl: 缓存有效期（秒）
+            workers: 预取线程数
+        """
+        self.clients = clients
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(db_file), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS album_meta (
+                    album_id TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    fetched_at REAL NOT NULL
+                )
+            """)
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="metadata")
+        # 进行中的获取：(album_id, photos) → Future，同一专辑的并发请求共用一次获取
+        self._inflight: Dict[Tuple[str, bool], Future] = {}
+        self._inflight_lock = threading.Lock()
+        # 元数据写入缓存后的回调，参数为 (album_id, 元数据)
+        self.on_save: Optional[Callable[[str, Dict], None]] = None
+
+    def _get_client(self):
+        """创建（首次使用时）并复用jmcomic客户端"""
+        with self._client_lock:
+            if self._client is None:
+                self._client = self.clients.new_client()
+            return self._client
+
+    def _is_fresh(self, meta: Dict, photos: bool) -> bool:
+        if time.time() - meta["fetched_at"] > self.ttl:
+            return False
+        # 需要章节页数但缓存中只有专辑信息
+        return not photos or all(photo["page_count"] is not None for photo in meta["photos"])
+
+    def get_cached(self, album_id: str) -> Optional[Dict]:
+        """读取缓存（不论是否过期），没有缓存时返回None"""
+        return self.get_cached_many([album_id]).get(album_id)
+
+    def get_cached_many(self, album_ids: Iterable[str]) -> Dict[str, Dict]:
+        """批量读取缓存（不论是否过期）"""
+        album_ids = list(album_ids)
+        if not album_ids:
+            return {}
+        placeholders = ",".join("?" * len(album_ids))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT album_id, data, fetched_at FROM album_meta WHERE album_id IN ({placeholders})",
+                album_ids
+            ).fetchall()
+        result = {}
+        for row in rows:
+            meta = json.loads(row["data"])
+            meta["fetched_at"] = row["fetched_at"]
+            result[row["album_id"]] = meta
+        return result
+
+    def _fetch(self, album_id: str, photos: bool) -> Dict:
+        """从上游获取专辑信息（以及每个章节的页数）并写入缓存"""
+        client = self._get_client()
+        try:
+            album = client.get_album_detail(album_id)
+        except jmcomic.MissingAlbumPhotoException as e:
+            raise AlbumNotFound(str(e)) from e
+
+        photo_list = [
+            {"photo_id": str(photo_id), "index": int(index), "title": name, "page_count": None}
+            for photo_id, index, name in album.episode_list
+        ]
+        if photos:
+            for photo in photo_list:
+                detail = client.get_photo_detail(photo["photo_id"], fetch_album=False, fetch_scramble_id=False)
+                photo["page_count"] = len(detail.page_arr or [])
+        return self._save(album_id, album, photo_list)
+
+    def _save(self, album_id: str, album: jmcomic.JmAlbumDetail, photo_list: List[Dict]) -> Dict:
+        """写入缓存"""
+        total_images = int(album.page_count or 0) or None
+        if total_images is None and photo_list and all(p["page_count"] is not None for p in photo_list):
+            total_images = sum(p["page_count"] for p in photo_list)
+        meta = {
+            "album_id": str(album.album_id),
+            "title": album.name,
+            "authors": list(album.authors or []),
+            "tags": list(album.tags or []),
+            "pub_date": album.pub_date or None,
+            "update_date": album.update_date or None,
+            "total_photos": len(photo_list),
+            "total_images": total_images,
+            "photos": photo_list
+        }
+        fetched_at = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO album_meta (album_id, data, fetched_at) VALUES (?, ?, ?)",
+                (album_id, json.dumps(meta, ensure_ascii=False), fetched_at)
+            )
+        meta["fetched_at"] = fetched_at
+        if self.on_save is not None:
+            try:
+                self.on_save(album_id, meta)
+            except Exception as e:
+                print(f"元数据回调失败: {album_id}, {e}")
+        return meta
+
+    def put_downloaded(self, album_id: str, album: jmcomic.JmAlbumDetail, photo_pages: Dict[str, int]):
+        """
+        下载完成后用下载时获取的信息更新缓存（不需要额外的上游请求）
+
+        Args:
+            album_id: 专辑ID
+            album: 下载时获取的专辑信息
+            photo_pages: 下载时获取的各章节页数，photo_id → 页数
+        """
+        photo_list = [
+            {"photo_id": str(photo_id), "index": int(index), "title": name, "page_count": photo_pages.get(str(photo_id))}
+            for photo_id, index, name in album.episode_list
+        ]
+        self._save(album_id, album, photo_list)
+
+    def _load(self, album_id: str, photos: bool, refresh: bool) -> Dict:
+        """返回有效的缓存，否则从上游获取；获取失败时退回过期的缓存"""
+        cached = self.get_cached(album_id)
+        if cached is not None and not refresh and self._is_fresh(cached, photos):
+            return cached
+        try:
+            return self._fetch(album_id, photos)
+        except AlbumNotFound:
+            raise
+        except Exception as e:
+            if cached is None:
+                raise
+            print(f"获取专辑信息失败，使用过期的缓存 {album_id}: {e}")
+            return cached
+
+    def submit(self, album_id: str, photos: bool = False, refresh: bool = False) -> Future:
+        """
+        在后台获取专辑信息，同一专辑正在获取时返回同一个Future
+
+        Args:
+            album_id: 专辑ID
+            photos: 是否同时获取每个章节的页数（每个章节一次上游请求）
+            refresh: 忽略未过期的缓存，重新获取
+        """
+        key = (album_id, photos)
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future
+            future = self._pool.submit(self._load, album_id, photos, refresh)
+            self._inflight[key] = future
+
+        def done(_):
+            with self._inflight_lock:
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+
+        future.add_done_callback(done)
+        return future
+
+    def prefetch(self, album_ids: Iterable[str], photos: bool = False) -> List[str]:
+        """
+        批量预取：没有缓存或缓存已过期的专辑在后台获取
+
+        Returns:
+            需要获取（已提交到后台）的专辑ID
+        """
+        album_ids = list(dict.fromkeys(album_ids))
+        cached = self.get_cached_many(album_ids)
+        pending = [
+            album_id for album_id in album_ids
+            if album_id not in cached or not self._is_fresh(cached[album_id], photos)
+        ]
+        for album_id in pending:
+            self.submit(album_id, photos)
+        return pending
+
+    @staticmethod
+    def to_response(meta: Dict) -> Dict:
+        """缓存数据转为接口返回的格式"""
+        result = dict(meta)
+        result["fetched_at"] = datetime.fromtimestamp(meta["fetched_at"]).isoformat()
+        return result
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,170 @@
+import hashlib
+import struct
+import time
+from pathlib import Path
+from typing import AsyncIterator, Dict, List
+from app.album_index import album_index, compute_digests
+from app.blob_store import blob_store
+from app.http_cache import iter_file
+
+
+# 支持的打包格式：参数名 → 媒体类型
+ARCHIVE_MEDIA_TYPES = {
+    "zip": "application/zip",
+    "cbz": "application/vnd.comicbook+zip",
+}
+
+# 超过这些值时需要使用ZIP64记录
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+
+LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+ZIP64_EXTRA_HEADER = struct.Struct("<HH")
+ZIP64_END = struct.Struct("<IQHHIIQQQQ")
+ZIP64_LOCATOR = struct.Struct("<IIQI")
+END_RECORD = struct.Struct("<IHHHHIIH")
+
+# 通用标志位第11位：文件名使用UTF-8编码
+FLAG_UTF8 = 0x0800
+
+
+def _dos_datetime(mtime: float):
+    """转换为ZIP使用的DOS日期和时间（最早为1980年）"""
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+
+def file_crc32(path: Path, size: int, mtime: float) -> int:
+    """获取文件的CRC32，优先使用入库时预先计算的值"""
+    crc32 = album_index.get_crc32(path, size, mtime)
+    if crc32 is None:
+        etag, crc32 = compute_digests(path)
+        album_index.set_etag(path, size, mtime, etag, crc32)
+    return crc32
+
+
+class AlbumArchive:
+    """
+    专辑打包（不压缩的ZIP/CBZ）
+
+    图片本身已是压缩格式，按存储方式（不压缩）打包。每个文件的大小和CRC32在开始传输前就已确定，
+    整个ZIP的字节布局是固定的，因此可以边读边发送，不需要临时文件，也能按Range从任意位置续传。
+    """
+
+    def __init__(self, folder: Path, images: List[Dict], flat_names: bool = False):
+        """
+        Args:
+            folder: 专辑文件夹
+            images: 按顺序排列的图片（专辑索引中的记录）
+            flat_names: 是否按页码重新命名（CBZ阅读器按文件名排序，避免章节目录排序错乱）
+        """
+        width = max(3, len(str(len(images))))
+        self._entries: List[Dict] = []
+        for seq, image in enumerate(images):
+            path = folder / image["path"]
+            name = f"{seq + 1:0{width}d}{path.suffix.lower()}" if flat_names else image["path"]
+            self._entries.append({"path": path, "blob": image.get("blob"), "name": name.encode("utf-8")})
+        self._tail = b""
+        self._tail_offset = 0
+        self.size = 0
+        self.etag = ""
+        self.mtime = 0.0
+
+    def prepare(self):
+        """
+        读取文件大小和CRC32，计算每个文件的位置并生成中央目录（在线程池中执行）
+
+        Raises:
+            FileNotFoundError: 图片文件已被删除
+        """
+        digest = hashlib.sha1()
+        offset = 0
+        central = []
+        for entry in self._entries:
+            # 已去重的图片从blob读取
+            entry["path"] = blob_store.resolve(entry["path"], entry["blob"])
+            stat = entry["path"].stat()
+            size, mtime = stat.st_size, stat.st_mtime
+            crc32 = file_crc32(entry["path"], size, mtime)
+            dos_time, dos_date = _dos_datetime(mtime)
+            name = entry["name"]
+            entry["size"] = size
+            entry["offset"] = offset
+            # 超出4GB的大小和位置写入ZIP64扩展字段，原字段填0xFFFFFFFF
+            local_extra = b""
+            if size >= ZIP64_LIMIT:
+                local_extra = ZIP64_EXTRA_HEADER.pack(0x0001, 16) + struct.pack("<QQ", size, size)
+            entry["header"] = LOCAL_HEADER.pack(
+                0x04034B50, 45 if local_extra else 20, FLAG_UTF8, 0, dos_time, dos_date,
+                crc32, min(size, ZIP64_LIMIT), min(size, ZIP64_LIMIT), len(name), len(local_extra)
+            ) + name + local_extra
+            entry["data_offset"] = offset + len(entry["header"])
+
+            zip64_values = [size, size] if size >= ZIP64_LIMIT else []
+            if offset >= ZIP64_LIMIT:
+                zip64_values.append(offset)
+            extra = b""
+            if zip64_values:
+                extra = ZIP64_EXTRA_HEADER.pack(0x0001, 8 * len(zip64_values)) + struct.pack(
+                    f"<{len(zip64_values)}Q", *zip64_values
+                )
+            central.append(CENTRAL_HEADER.pack(
+                0x02014B50, 45 if extra else 20, 45 if extra else 20, FLAG_UTF8, 0, dos_time, dos_date,
+                crc32, min(size, ZIP64_LIMIT), min(size, ZIP64_LIMIT), len(name), len(extra), 0, 0, 0, 0,
+                min(offset, ZIP64_LIMIT)
+            ) + name + extra)
+
+            digest.update(name + b"\0%d:%d:%d\0" % (size, stat.st_mtime_ns, crc32))
+            self.mtime = max(self.mtime, mtime)
+            offset = entry["data_offset"] + size
+
+        central_offset = offset
+        central_data = b"".join(central)
+        count = len(self._entries)
+        tail = [central_data]
+        if count >= ZIP64_COUNT_LIMIT or central_offset >= ZIP64_LIMIT or len(central_data) >= ZIP64_LIMIT:
+            zip64_end_offset = central_offset + len(central_data)
+            tail.append(ZIP64_END.pack(
+                0x06064B50, ZIP64_END.size - 12, 45, 45, 0, 0,
+                count, count, len(central_data), central_offset
+            ))
+            tail.append(ZIP64_LOCATOR.pack(0x07064B50, 0, zip64_end_offset, 1))
+        tail.append(END_RECORD.pack(
+            0x06054B50, 0, 0,
+            min(count, ZIP64_COUNT_LIMIT), min(count, ZIP64_COUNT_LIMIT),
+            min(len(central_data), ZIP64_LIMIT), min(central_offset, ZIP64_LIMIT), 0
+        ))
+        self._tail = b"".join(tail)
+        self._tail_offset = central_offset
+        self.size = central_offset + len(self._tail)
+        self.etag = f'"{digest.hexdigest()}"'
+
+    async def iter_range(self, start: int, length: int) -> AsyncIterator[bytes]:
+        """
+        逐块生成ZIP中指定范围的字节
+
+        Args:
+            start: 起始位置
+            length: 长度
+        """
+        end = start + length
+        for entry in self._entries:
+            data_offset = entry["data_offset"]
+            data_end = data_offset + entry["size"]
+            if data_end <= start:
+                continue
+            if entry["offset"] >= end:
+                return
+            if start < data_offset:
+                yield entry["header"][max(start - entry["offset"], 0):end - entry["offset"]]
+            lo, hi = max(start, data_offset), min(end, data_end)
+            if lo < hi:
+                async for chunk in iter_file(entry["path"], lo - data_offset, hi - lo):
+                    yield chunk
+        if end > self._tail_offset:
+            yield self._tail[max(start - self._tail_offset, 0):end - self._tail_offset]
@@ -0,0 +1,133 @@
+import errno
+import os
+import threading
+import uuid
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+from app.config import BLOB_DIR, DEDUP_STORAGE
+
+
+class BlobStore:
+    """
+    按内容寻址的图片存储
+
+    每份内容在 blobs/ 下保存一个文件（按SHA-256命名），专辑文件夹中内容相同的图片都是它的硬链接，
+    磁盘上只占一份空间；读取时统一经过blob路径，共享页缓存、ETag和缩略图缓存。
+    blob的链接数为1表示已没有专辑引用，可以清理。
+
+    文件系统不支持硬链接（或 blobs/ 与下载目录不在同一文件系统）时保留原文件，不做去重。
+    """
+
+    def __init__(self, root: Path = BLOB_DIR, enabled: bool = DEDUP_STORAGE):
+        """
+        Args:
+            root: blob存储目录，需与下载目录在同一文件系统
+            enabled: 是否启用去重
+        """
+        self.root = root
+        self.enabled = enabled
+        self._lock = threading.Lock()
+
+    def path_for(self, digest: str, suffix: str) -> Path:
+        """内容对应的blob路径（保留图片后缀，按后缀判断媒体类型的地方不受影响）"""
+        return self.root / digest[:2] / f"{digest}{suffix.lower()}"
+
+    def ingest(self, path: Path, digest: str) -> Tuple[bool, int]:
+        """
+        把图片登记到blob存储，内容已存在时把图片替换为指向blob的硬链接
+
+        Args:
+            path: 图片文件
+            digest: 文件内容的SHA-256
+
+        Returns:
+            (是否已由blob存储, 替换重复文件节省的字节数)
+        """
+        if not self.enabled:
+            return False, 0
+        blob = self.path_for(digest, path.suffix)
+        with self._lock:
+            try:
+                stat = path.stat()
+                try:
+                    blob_stat = blob.stat()
+                except FileNotFoundError:
+                    # 第一份：把文件本身登记为blob，不复制数据
+                    blob.parent.mkdir(parents=True, exist_ok=True)
+                    os.link(path, blob)
+                    return True, 0
+                if os.path.samestat(stat, blob_stat):
+                    return True, 0
+                # 内容相同的另一份：先链接到临时文件再原子替换，读取方始终能看到完整的文件
+                tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+                os.link(blob, tmp)
+                try:
+                    os.replace(tmp, path)
+                except OSError:
+                    tmp.unlink(missing_ok=True)
+                    raise
+                return True, stat.st_size
+            except OSError as e:
+                if e.errno in (errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP):
+                    self.enabled = False
+                    print(f"文件系统不支持硬链接，已停用图片去重: {e}")
+                elif not isinstance(e, FileExistsError):
+                    # 其他进程同时登记了同一份内容时跳过，下次去重时再处理
+                    print(f"图片去重失败 {path}: {e}")
+                return False, 0
+
+    def resolve(self, path: Path, digest: Optional[str]) -> Path:
+        """
+        图片的读取路径：已登记的图片从blob读取
+
+        Args:
+            path: 专辑文件夹中的图片路径
+            digest: 登记时的内容SHA-256，未登记为None
+        """
+        if digest:
+            blob = self.path_for(digest, path.suffix)
+            if blob.is_file():
+                return blob
+        return path
+
+    def release(self, blobs: Iterable[Path]) -> int:
+        """
+        删除指定的blob中已没有专辑引用（链接数为1）的部分（删除专辑文件夹后调用，不需要扫描整个存储）
+
+        Returns:
+            int: 删除的blob数量
+        """
+        removed = 0
+        with self._lock:
+            for blob in blobs:
+                try:
+                    if blob.stat().st_nlink == 1:
+                        blob.unlink()
+                        removed += 1
+                except FileNotFoundError:
+                    continue
+        return removed
+
+    def prune(self) -> int:
+        """
+        删除已没有专辑引用（链接数为1）的blob
+
+        Returns:
+            int: 删除的blob数量
+        """
+        if not self.root.is_dir():
+            return 0
+        removed = 0
+        with self._lock:
+            for blob in self.root.glob("*/*"):
+                try:
+                    if blob.stat().st_nlink == 1:
+                        blob.unlink()
+                        removed += 1
+                except FileNotFoundError:
+                    continue
+        return removed
+
+
+# 全局单例
+blob_store = BlobStore()
@@ -10,13 +10,26 @@ BASE_DIR = Path(__file__).parent.parent
 # 配置文件路径
 CONFIG_FILE = BASE_DIR / "config.yml"
 
+# 数据目录：下载的图片、PDF、缓存和数据库都保存在这里（默认为项目根目录）
+DATA_DIR = Path(os.getenv("DATA_DIR", str(BASE_DIR))).resolve()
+DATA_DIR.mkdir(parents=True, exist_ok=True)
+
 # 下载目录
-STOCK_DIR = BASE_DIR / "stock"
-PDF_DIR = BASE_DIR / "pdf"
+STOCK_DIR = DATA_DIR / "stock"
+PDF_DIR = DATA_DIR / "pdf"
+
+# 缓存目录（缩略图等派生文件）
+CACHE_DIR = DATA_DIR / "cache"
+THUMB_CACHE_DIR = CACHE_DIR / "images"
+
+# 按内容寻址的图片存储：内容相同的图片只保存一份，专辑文件夹中是指向它的硬链接
+BLOB_DIR = DATA_DIR / "blobs"
+DEDUP_STORAGE = os.getenv("DEDUP_STORAGE", "true").lower() in ("1", "true", "yes")
 
 # 确保目录存在
 STOCK_DIR.mkdir(exist_ok=True)
 PDF_DIR.mkdir(exist_ok=True)
+THUMB_CACHE_DIR.mkdir(parents=True, exist_ok=True)
 
 # API配置
 API_HOST = os.getenv("API_HOST", "0.0.0.0")
@@ -28,6 +41,91 @@ CORS_ORIGINS = os.getenv(
     "http://localhost:8081,http://localhost:19000,exp://localhost:8081"
 ).split(",")
 
+# 下载调度：同时进行的下载任务数，超出的任务排队等待
+DOWNLOAD_CONCURRENCY = int(os.getenv("DOWNLOAD_CONCURRENCY", "2"))
+
+# 上游请求的自适应并发控制（进程内所有下载任务共用）：请求顺利时逐步提高并发，
+# 失败、被限流（429/503）或耗时超过 UPSTREAM_TARGET_LATENCY 秒时并发减半；
+# UPSTREAM_MAX_RPS 限制每秒请求数（0表示不限制）
+UPSTREAM_INITIAL_CONCURRENCY = int(os.getenv("UPSTREAM_INITIAL_CONCURRENCY", "8"))
+UPSTREAM_MIN_CONCURRENCY = int(os.getenv("UPSTREAM_MIN_CONCURRENCY", "2"))
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", "48"))
+UPSTREAM_TARGET_LATENCY = float(os.getenv("UPSTREAM_TARGET_LATENCY", "8"))
+UPSTREAM_MAX_RPS = float(os.getenv("UPSTREAM_MAX_RPS", "0"))
+# 共用的上游连接池：最多保持的连接数（默认与并发上限一致，连接在请求之间保持复用）
+UPSTREAM_POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", str(UPSTREAM_MAX_CONCURRENCY)))
+# 域名健康状态：连续失败 DOMAIN_FAILURE_THRESHOLD 次的域名在 DOMAIN_COOLDOWN 秒内不再使用（之后先试探一次）
+DOMAIN_FAILURE_THRESHOLD = int(os.getenv("DOMAIN_FAILURE_THRESHOLD", "2"))
+DOMAIN_COOLDOWN = float(os.getenv("DOMAIN_COOLDOWN", "60"))
+
+# 图片解码（还原被打乱的图片、重新编码）的进程数，0表示在下载线程中解码（单核时默认为0，进程间传输只会增加开销）；
+# 以及同时等待解码的图片数上限，超过时下载线程等待（默认为进程数的2倍）
+DECODE_WORKERS = int(os.getenv("DECODE_WORKERS", str(os.cpu_count() if (os.cpu_count() or 1) > 1 else 0)))
+DECODE_QUEUE_SIZE = int(os.getenv("DECODE_QUEUE_SIZE", str(max(DECODE_WORKERS, 1) * 2)))
+
+# 文件系统/数据库操作的线程数（在事件循环之外执行）
+IO_WORKERS = int(os.getenv("IO_WORKERS", "8"))
+# 已解析的图片路径缓存条数（album_id + 图片路径 → 文件路径）
+PATH_CACHE_SIZE = int(os.getenv("PATH_CACHE_SIZE", "10000"))
+
+# 多进程部署：任务队列保存在共享的任务数据库中
+# RUN_DOWNLOADS=false 的进程只提供API，不领取下载任务（由专门的下载进程 python -m app.worker 执行）
+RUN_DOWNLOADS = os.getenv("RUN_DOWNLOADS", "true").lower() in ("1", "true", "yes")
+# 领取任务的租约时长和续约间隔（秒），进程退出后租约过期，任务由其他进程重新领取
+TASK_LEASE_SECONDS = float(os.getenv("TASK_LEASE_SECONDS", "30"))
+TASK_HEARTBEAT_INTERVAL = float(os.getenv("TASK_HEARTBEAT_INTERVAL", "10"))
+# 检查其他进程提交的新任务、同步其他进程的任务状态的间隔（秒）
+TASK_POLL_INTERVAL = float(os.getenv("TASK_POLL_INTERVAL", "1.0"))
+
+# 批量下载/批量查询状态时单次请求最多包含的数量
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "200"))
+
+# 下载进度回报的最小间隔（秒）
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", "1.0"))
+
+# 缩略图：磁盘缓存上限、内存缓存上限（字节），以及生成图片的进程数
+THUMB_CACHE_MAX_BYTES = int(os.getenv("THUMB_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+THUMB_MEMORY_MAX_BYTES = int(os.getenv("THUMB_MEMORY_MAX_BYTES", str(64 * 1024 * 1024)))
+THUMB_WORKERS = int(os.getenv("THUMB_WORKERS", str(os.cpu_count() or 2)))
+
+# PDF生成：进程数，以及下载完成后是否在后台自动生成（否则在首次请求PDF时生成）
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "1"))
+PDF_AUTO_BUILD = os.getenv("PDF_AUTO_BUILD", "true").lower() in ("1", "true", "yes")
+
+# 任务状态推送：保留用于断线续传的事件数，以及空闲时的心跳间隔（秒）
+EVENT_BUFFER_SIZE = int(os.getenv("EVENT_BUFFER_SIZE", "1000"))
+EVENT_KEEPALIVE = float(os.getenv("EVENT_KEEPALIVE", "15"))
+
 # 任务状态存储
-TASKS_FILE = BASE_DIR / "tasks.json"
+TASKS_FILE = DATA_DIR / "tasks.json"  # 旧版JSON存储，仅用于迁移
+TASKS_DB_FILE = DATA_DIR / "tasks.db"
+# 任务状态批量写入间隔（秒），同一任务在间隔内的多次更新会合并为一次写入
+TASK_FLUSH_INTERVAL = float(os.getenv("TASK_FLUSH_INTERVAL", "0.5"))
+# 任务保留策略：已结束的任务超过保留时长（秒）、或数量超过上限时移到归档数据库（0表示不限制），
+# 归档的任务仍可按task_id查询；每隔 TASK_ARCHIVE_INTERVAL 秒检查一次
+TASKS_ARCHIVE_DB_FILE = DATA_DIR / "tasks_archive.db"
+TASK_RETENTION_SECONDS = float(os.getenv("TASK_RETENTION_SECONDS", str(7 * 24 * 3600)))
+TASK_RETENTION_MAX = int(os.getenv("TASK_RETENTION_MAX", "5000"))
+TASK_ARCHIVE_INTERVAL = float(os.getenv("TASK_ARCHIVE_INTERVAL", "600"))
+# 下载清单：每个下载中的任务记录已完整写入的图片，任务中断后从上次完成的图片继续下载
+MANIFEST_DIR = DATA_DIR / "manifests"
+
+
+# 专辑元数据缓存（标题、章节、页数等，从上游获取）：有效期（秒）和预取线程数
+METADATA_DB_FILE = DATA_DIR / "album_meta.db"
+METADATA_TTL = float(os.getenv("METADATA_TTL", str(24 * 3600)))
+METADATA_WORKERS = int(os.getenv("METADATA_WORKERS", "4"))
+
+# 磁盘配额（字节，0表示不限制）：下载目录和PDF目录超过配额时，按最近访问时间清理最久未使用的专辑/PDF，
+# 清理到配额的90%；下载中、正在生成PDF、以及 EVICTION_MIN_IDLE 秒内访问过的专辑不清理。
+# 被清理的专辑再次请求时自动重新下载。每隔 EVICTION_INTERVAL 秒（以及每次下载完成后）检查一次
+STOCK_QUOTA_BYTES = int(os.getenv("STOCK_QUOTA_BYTES", "0"))
+PDF_QUOTA_BYTES = int(os.getenv("PDF_QUOTA_BYTES", "0"))
+EVICTION_INTERVAL = float(os.getenv("EVICTION_INTERVAL", "300"))
+EVICTION_MIN_IDLE = float(os.getenv("EVICTION_MIN_IDLE", "600"))
+
+# 专辑索引数据库
+INDEX_DB_FILE = DATA_DIR / "album_index.db"
 
+# 支持的图片后缀
+IMAGE_SUFFIXES = (".jpg", ".png")
@@ -1,38 +1,270 @@
 import jmcomic
 import asyncio
-import json
+import threading
+import time
 import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Optional
-from datetime import datetime
-from app.config import CONFIG_FILE, STOCK_DIR, PDF_DIR, TASKS_FILE
-from app.models import TaskStatus, TaskStatusResponse
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from datetime import datetime, timedelta
+from app.config import (
+    CONFIG_FILE,
+    DOWNLOAD_CONCURRENCY,
+    EVENT_BUFFER_SIZE,
+    EVICTION_INTERVAL,
+    MANIFEST_DIR,
+    PDF_AUTO_BUILD,
+    RUN_DOWNLOADS,
+    STOCK_DIR,
+    TASK_ARCHIVE_INTERVAL,
+    TASK_FLUSH_INTERVAL,
+    TASK_HEARTBEAT_INTERVAL,
+    TASK_LEASE_SECONDS,
+    TASK_POLL_INTERVAL,
+    TASK_RETENTION_MAX,
+    TASK_RETENTION_SECONDS
+)
+from app.models import PdfStatus, TaskStatus, TaskStatusResponse
+from app.album_index import album_index
+from app.album_meta import AlbumMetadataCache
+from app.task_store import TaskStore
+from app.scheduler import DownloadScheduler
+from app.downloader import DownloadManifest, TaskDownloader, DownloadCancelled
+from app.events import TaskEventBus, Subscriber
+from app.image_decoder import ImageDecoder
+from app.pdf_builder import PdfBuilder
+from app.quota import QuotaManager
+from app.io_pool import io_executor, run_io
+from app.upstream_client import UpstreamClients
+from app.upstream_limiter import upstream_limiter
+from app.metrics import (
+    metrics,
+    executor_queue_depth,
+    EXECUTOR_QUEUE_DEPTH,
+    STAGE_SECONDS,
+    TASK_QUEUE_WAIT,
+    TASKS,
+    TASKS_ARCHIVED,
+    TASKS_FINISHED,
+    TASKS_RESUMED,
+    TASKS_RUNNING_LOCAL,
+    UPSTREAM_CONCURRENCY,
+    UPSTREAM_CONNECTIONS,
+    UPSTREAM_DOMAIN_UP
+)
+
+# 专辑访问时间写入数据库的间隔（秒）
+ACCESS_FLUSH_INTERVAL = 30.0
+
 
 class DownloadService:
     def __init__(self):
         """初始化下载服务"""
         self.option = jmcomic.JmOption.from_file(str(CONFIG_FILE))
+        # 下载到数据目录（配置文件中的相对路径取决于启动时的工作目录，与专辑索引扫描的目录可能不一致）
+        self.option.dir_rule.base_dir = str(STOCK_DIR)
+        # 任务状态和下载队列保存在共享的任务数据库中，多个进程可以同时提供API和执行下载
+        self.store = TaskStore()
+        # 共用的上游客户端：所有下载任务和元数据缓存共用连接池和域名健康状态
+        self.upstream = UpstreamClients(self.option)
+        # 专辑元数据缓存（通过共用的上游客户端获取）
+        self.metadata = AlbumMetadataCache(self.upstream)
+        # 获取到的作者和标签写入专辑索引，用于搜索
+        self.metadata.on_save = self._save_album_meta
+        # 图片解码进程池：所有下载任务共用，下载线程只负责网络请求
+        self.decoder = ImageDecoder()
+        self.events = TaskEventBus()
+        # 本进程负责的任务（下载中，或下载完成后仍在生成PDF），状态以内存为准
         self.tasks: Dict[str, Dict] = {}
-        self._load_tasks()
+        # 下载调度：每个进程限制并发，同一专辑同时只有一个进行中的任务
+        self.scheduler = DownloadScheduler(
+            self.store,
+            self._download_task,
+            DOWNLOAD_CONCURRENCY,
+            lease_seconds=TASK_LEASE_SECONDS,
+            heartbeat_interval=TASK_HEARTBEAT_INTERVAL,
+            poll_interval=TASK_POLL_INTERVAL
+        )
+        self.scheduler.on_cancel = self._on_cancel_requested
+        self.scheduler.on_lease_lost = self._on_lease_lost
+        self._executor = ThreadPoolExecutor(
+            max_workers=DOWNLOAD_CONCURRENCY,
+            thread_name_prefix="download"
+        )
+        self._cancel_events: Dict[str, threading.Event] = {}
+        self._lost: Set[str] = set()
+        # PDF生成：状态变化同步到触发生成的下载任务
+        self.pdf_builder = PdfBuilder()
+        self.pdf_builder.on_change = self._update_pdf_status
+        self._pdf_tasks: Dict[str, str] = {}
+        # 磁盘配额：超过时清理最久未使用的专辑/PDF
+        self.quota = QuotaManager(self.pdf_builder)
+        self._quota_wakeup: Optional[asyncio.Event] = None
+        # 最近推送过的任务状态，避免重复推送（同步其他进程的变化时会再次看到本进程的写入）
+        self._published: "OrderedDict[str, Dict]" = OrderedDict()
+        self._sync_version = 0
+        self._sync_task: Optional[asyncio.Task] = None
+        self._retention_task: Optional[asyncio.Task] = None
+        self._quota_task: Optional[asyncio.Task] = None
+        metrics.add_collector(self._collect_metrics)
+        # 首次启动时从磁盘建立专辑索引
+        if album_index.is_empty():
+            album_index.rebuild()
+        self._backfill_album_meta()
+    
+    @staticmethod
+    def _save_album_meta(album_id: str, meta: Dict):
+        """元数据写入缓存后同步到专辑索引"""
+        album_index.set_album_meta(album_id, meta.get("title"), meta.get("authors") or [], meta.get("tags") or [])
+    
+    def _backfill_album_meta(self, batch: int = 500):
+        """已缓存元数据但索引中还没有作者和标签的专辑（旧版本下载的专辑）补上，不请求上游"""
+        album_ids = album_index.albums_without_meta()
+        for i in range(0, len(album_ids), batch):
+            for album_id, meta in self.metadata.get_cached_many(album_ids[i:i + batch]).items():
+                self._save_album_meta(album_id, meta)
+    
+    def start(self, run_downloads: bool = RUN_DOWNLOADS):
+        """
+        在事件循环中启动后台任务
+        
+        Args:
+            run_downloads: 是否在本进程中领取并执行下载任务
+        """
+        if run_downloads:
+            self.scheduler.start()
+        if self._sync_task is None:
+            self._sync_version = self.store.latest_version()
+            self._sync_task = asyncio.create_task(self._sync_loop())
+        if self._retention_task is None:
+            self._retention_task = asyncio.create_task(self._retention_loop())
+        if self._quota_task is None:
+            self._quota_wakeup = asyncio.Event()
+            self._quota_task = asyncio.create_task(self._quota_loop())
+    
+    def _collect_metrics(self):
+        """采集任务数、执行器队列长度和上游并发（输出指标前调用）"""
+        TASKS.clear()
+        for status, count in self.store.count_by_status().items():
+            TASKS.set(count, status=status)
+        TASKS_RUNNING_LOCAL.set(self.scheduler.running_count)
+        EXECUTOR_QUEUE_DEPTH.set(executor_queue_depth(self._executor), executor="download")
+        EXECUTOR_QUEUE_DEPTH.set(executor_queue_depth(io_executor), executor="io")
+        EXECUTOR_QUEUE_DEPTH.set(executor_queue_depth(self.pdf_builder._pool), executor="pdf")
+        EXECUTOR_QUEUE_DEPTH.set(executor_queue_depth(self.decoder._pool), executor="decode")
+        upstream = upstream_limiter.snapshot()
+        for state in ("limit", "in_flight", "waiting"):
+            UPSTREAM_CONCURRENCY.set(upstream[state], state=state)
+        clients = self.upstream.snapshot()
+        if clients["pool"] is not None:
+            UPSTREAM_CONNECTIONS.set(clients["pool"]["open"], state="open")
+            UPSTREAM_CONNECTIONS.set(clients["pool"]["idle"], state="idle")
+        for domain, health in clients["domains"].items():
+            UPSTREAM_DOMAIN_UP.set(1 if health["up"] else 0, domain=domain)
+    
+    def _to_status(self, task: Dict) -> TaskStatusResponse:
+        """任务数据转为状态响应"""
+        return TaskStatusResponse(
+            task_id=task["task_id"],
+            album_id=task.get("album_id", ""),
+            status=TaskStatus(task.get("status", TaskStatus.PENDING.value)),
+            progress=task.get("progress", 0.0),
+            queue_position=task.get("queue_position"),
+            current_image=task.get("current_image"),
+            total_images=task.get("total_images"),
+            current_photo=task.get("current_photo"),
+            total_photos=task.get("total_photos"),
+            bytes_downloaded=task.get("bytes_downloaded"),
+            bytes_per_second=task.get("bytes_per_second"),
+            eta_seconds=task.get("eta_seconds"),
+            pdf_status=task.get("pdf_status"),
+            message=task.get("message"),
+            error=task.get("error"),
+            updated_at=task.get("updated_at"),
+            profile=task.get("profile")
+        )
+    
+    def _publish(self, task: Dict):
+        """推送任务状态变化（与上次推送的内容相同时跳过）"""
+        task_id = task["task_id"]
+        data = self._to_status(task).model_dump(mode="json")
+        if self._published.get(task_id) == data:
+            return
+        self._published[task_id] = data
+        self._published.move_to_end(task_id)
+        while len(self._published) > EVENT_BUFFER_SIZE:
+            self._published.popitem(last=False)
+        self.events.publish(task_id, data)
+    
+    def _save_task(self, task_id: str):
+        """保存单个任务状态（由任务存储批量写入），并推送状态变化"""
+        if task_id in self._lost:
+            return
+        self.store.put(task_id, self.tasks[task_id])
+        self._publish(self.tasks[task_id])
     
-    def _load_tasks(self):
-        """从文件加载任务状态"""
-        if TASKS_FILE.exists():
+    async def _sync_loop(self):
+        """定期读取其他进程写入的任务变化，推送给本进程的订阅者"""
+        while True:
+            await asyncio.sleep(TASK_POLL_INTERVAL)
             try:
-                with open(TASKS_FILE, 'r', encoding='utf-8') as f:
-                    self.tasks = json.load(f)
+                tasks, self._sync_version = await run_io(self.store.changes_since, self._sync_version)
             except Exception as e:
-                print(f"加载任务状态失败: {e}")
-                self.tasks = {}
+                print(f"同步任务状态失败: {e}")
+                continue
+            for task in tasks:
+                # 本进程负责的任务已在状态变化时推送
+                if task["task_id"] not in self.tasks:
+                    self._publish(task)
     
-    def _save_tasks(self):
-        """保存任务状态到文件"""
-        try:
-            with open(TASKS_FILE, 'w', encoding='utf-8') as f:
-                json.dump(self.tasks, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"保存任务状态失败: {e}")
+    async def _retention_loop(self):
+        """定期把已结束的旧任务归档，共享任务表只保留未结束和最近的任务"""
+        while True:
+            try:
+                count = await run_io(self.store.archive, TASK_RETENTION_SECONDS, TASK_RETENTION_MAX)
+                if count:
+                    TASKS_ARCHIVED.inc(count)
+            except Exception as e:
+                print(f"归档任务失败: {e}")
+            await asyncio.sleep(TASK_ARCHIVE_INTERVAL)
     
+    async def _protected_albums(self) -> Set[str]:
+        """不能因磁盘配额清理的专辑：有未结束的任务（包括其他进程）、或正在生成PDF"""
+        active = await run_io(self.store.list_active)
+        protected = {task["album_id"] for task in active.values()}
+        protected.update(task["album_id"] for task in self.tasks.values())
+        protected.update(self.pdf_builder.busy_albums())
+        return protected
+
+    async def _quota_loop(self):
+        """
+        定期写入专辑的访问时间，并检查磁盘配额
+
+        每隔 EVICTION_INTERVAL 秒检查一次；下载完成或PDF生成后提前检查。
+        """
+        last_check = 0.0
+        while True:
+            try:
+                await asyncio.wait_for(self._quota_wakeup.wait(), ACCESS_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await run_io(album_index.flush_access)
+                if not self.quota.enabled:
+                    continue
+                if self._quota_wakeup.is_set() or time.monotonic() - last_check >= EVICTION_INTERVAL:
+                    self._quota_wakeup.clear()
+                    last_check = time.monotonic()
+                    await run_io(self.quota.evict, await self._protected_albums())
+            except Exception as e:
+                print(f"检查磁盘配额失败: {e}")
+
+    def _check_quota(self):
+        """下载目录或PDF目录有新增内容后提前检查配额"""
+        if self._quota_wakeup is not None and self.quota.enabled:
+            self._quota_wakeup.set()
+
     def _update_task_status(
         self, 
         task_id: str, 
@@ -52,82 +284,248 @@ class DownloadService:
             "progress": progress,
             "message": message,
             "error": error,
-            "current_image": current_image,
-            "total_images": total_images,
             "updated_at": datetime.now().isoformat()
         })
-        self._save_tasks()
+        # 未指定时保留下载过程中回报的图片计数
+        if current_image is not None:
+            self.tasks[task_id]["current_image"] = current_image
+        if total_images is not None:
+            self.tasks[task_id]["total_images"] = total_images
+        # 实时速度只在下载中有意义
+        if status != TaskStatus.DOWNLOADING:
+            self.tasks[task_id].pop("bytes_per_second", None)
+            self.tasks[task_id].pop("eta_seconds", None)
+        self._save_task(task_id)
     
-    async def download_album(self, album_id: str) -> str:
+    def _update_task_progress(self, task_id: str, progress: Dict):
+        """更新下载进度（由下载器节流回报）"""
+        task = self.tasks.get(task_id)
+        if task is None or task.get("status") != TaskStatus.DOWNLOADING.value:
+            return
+        
+        task.update(progress)
+        if progress.get("total_images"):
+            task["progress"] = min(progress["current_image"] / progress["total_images"], 1.0)
+        task["updated_at"] = datetime.now().isoformat()
+        self._save_task(task_id)
+    
+    def _update_pdf_status(self, album_id: str, info: Dict):
+        """PDF生成状态变化时更新对应的下载任务"""
+        if info["status"] == PdfStatus.COMPLETED.value:
+            self._check_quota()
+        task_id = self._pdf_tasks.get(album_id)
+        if task_id is None or task_id not in self.tasks:
+            return
+        self.tasks[task_id]["pdf_status"] = info["status"]
+        if "seconds" in info and "profile" in self.tasks[task_id]:
+            self.tasks[task_id]["profile"]["pdf_seconds"] = info["seconds"]
+        self.tasks[task_id]["updated_at"] = datetime.now().isoformat()
+        self._save_task(task_id)
+        if info["status"] in (PdfStatus.COMPLETED.value, PdfStatus.FAILED.value):
+            del self._pdf_tasks[album_id]
+            if task_id not in self._cancel_events:
+                self.tasks.pop(task_id, None)
+    
+    async def download_album(self, album_id: str, priority: int = 0, profile: bool = False) -> Tuple[str, bool]:
         """
         异步下载专辑
         
+        同一专辑已有排队中或下载中的任务时（包括其他进程创建的任务），直接返回该任务。
+        已缓存专辑元数据时，新任务在排队时即带有总页数；否则在后台预取元数据。
+        
         Args:
             album_id: 专辑ID
+            priority: 优先级，数值越大越优先
+            profile: 是否在任务中记录各阶段耗时（只对新建的任务生效）
             
         Returns:
-            task_id: 任务ID
+            (task_id, created): 任务ID，以及是否新建了任务
         """
-        task_id = str(uuid.uuid4())
-        
-        # 初始化任务状态
-        self.tasks[task_id] = {
-            "task_id": task_id,
+        now = datetime.now().isoformat()
+        task = {
+            "task_id": str(uuid.uuid4()),
             "album_id": album_id,
             "status": TaskStatus.PENDING.value,
             "progress": 0.0,
-            "created_at": datetime.now().isoformat(),
-            "updated_at": datetime.now().isoformat()
+            "priority": priority,
+            "profiling": profile,
+            "created_at": now,
+            "updated_at": now
         }
-        self._save_tasks()
+        meta = await run_io(self.metadata.get_cached, album_id)
+        if meta is not None:
+            task["total_photos"] = meta["total_photos"] or None
+            task["total_images"] = meta["total_images"]
         
-        # 在后台任务中执行下载
-        asyncio.create_task(self._download_task(task_id, album_id))
+        # 写入共享队列；已有任务时合并到已有任务，必要时提高排队优先级
+        task, created = await run_io(self.store.create_or_join, task)
+        if created:
+            self.scheduler.notify()
+            if meta is None:
+                self.metadata.submit(album_id)
+        if task["task_id"] not in self.tasks:
+            self._publish(task)
+        
+        return task["task_id"], created
+    
+    async def download_albums(
+        self,
+        album_ids: List[str],
+        priority: int = 0,
+        profile: bool = False
+    ) -> List[Tuple[str, str, bool]]:
+        """
+        批量下载专辑（重复的album_id只创建一个任务）
         
-        return task_id
+        Args:
+            album_ids: 专辑ID列表
+            priority: 优先级，数值越大越优先
+            profile: 是否在任务中记录各阶段耗时
+            
+        Returns:
+            [(album_id, task_id, created), ...]: 按请求顺序排列
+        """
+        results = []
+        for album_id in dict.fromkeys(album_ids):
+            task_id, created = await self.download_album(album_id, priority, profile)
+            results.append((album_id, task_id, created))
+        return results
     
-    async def _download_task(self, task_id: str, album_id: str):
-        """执行下载任务"""
+    async def cancel_task(self, task_id: str) -> bool:
+        """
+        取消排队中或下载中的任务
+        
+        排队中的任务直接结束；在其他进程中下载的任务由该进程在下次续约时中断。
+        
+        Args:
+            task_id: 任务ID
+            
+        Returns:
+            bool: 任务是否处于可取消的状态
+        """
+        cancel_event = self._cancel_events.get(task_id)
+        if cancel_event is not None:
+            # 在本进程中下载，直接中断
+            cancel_event.set()
+            return True
+        
+        result = await run_io(
+            self.store.request_cancel,
+            task_id,
+            {"message": "下载已取消", "updated_at": datetime.now().isoformat()}
+        )
+        if result is None:
+            return False
+        task = await run_io(self.store.get, task_id)
+        if task is not None:
+            self._publish(task)
+        return True
+    
+    def _on_cancel_requested(self, task_id: str):
+        """其他进程请求取消本进程正在下载的任务"""
+        cancel_event = self._cancel_events.get(task_id)
+        if cancel_event is not None:
+            cancel_event.set()
+    
+    def _on_lease_lost(self, task_id: str):
+        """任务租约已过期并被其他进程接管，停止下载且不再写入状态"""
+        print(f"任务 {task_id} 已被其他进程接管，停止下载")
+        self._lost.add(task_id)
+        self.store.discard(task_id)
+        self._on_cancel_requested(task_id)
+    
+    def _finish_task(self, task_id: str):
+        """任务结束后释放本进程的占用"""
+        self._cancel_events.pop(task_id, None)
+        self._lost.discard(task_id)
+        # 等待PDF生成的任务保留在内存中，PDF状态变化时继续更新
+        if task_id not in self._pdf_tasks.values():
+            self.tasks.pop(task_id, None)
+    
+    async def _download_task(self, task: Dict):
+        """
+        执行从共享队列领取到的下载任务
+
+        领取到的是中断的任务（下载中状态，原进程已退出）时，按下载清单从上次完成的图片继续下载。
+        """
+        task_id = task["task_id"]
+        album_id = task["album_id"]
+        resumed = task.get("status") == TaskStatus.DOWNLOADING.value
+        task.pop("queue_position", None)
+        self.tasks[task_id] = task
+        cancel_event = threading.Event()
+        self._cancel_events[task_id] = cancel_event
+        manifest = await run_io(DownloadManifest, MANIFEST_DIR / f"{task_id}.jsonl")
+        stats: Dict = {}
+        start = time.perf_counter()
+        try:
+            queue_wait = (datetime.now() - datetime.fromisoformat(task["created_at"])).total_seconds()
+        except (KeyError, TypeError, ValueError):
+            queue_wait = None
+        if queue_wait is not None:
+            TASK_QUEUE_WAIT.observe(queue_wait)
         try:
+            if resumed:
+                TASKS_RESUMED.inc()
+                message = f"继续下载（已完成 {len(manifest.done)} 张图片）..."
+            else:
+                message = "开始下载..."
             self._update_task_status(
                 task_id,
                 TaskStatus.DOWNLOADING,
-                progress=0.1,
-                message="开始下载..."
+                progress=0.0,
+                message=message
             )
             
-            # 在线程池中执行同步的下载操作
+            # 在下载线程池中执行同步的下载操作，进度回到事件循环中更新
             loop = asyncio.get_event_loop()
-            await loop.run_in_executor(
-                None,
+            
+            def on_progress(progress: Dict):
+                loop.call_soon_threadsafe(self._update_task_progress, task_id, progress)
+            
+            image_count = await loop.run_in_executor(
+                self._executor,
                 self._sync_download,
-                album_id
+                album_id,
+                cancel_event,
+                on_progress,
+                stats,
+                manifest
             )
             
-            # 检查是否下载成功（检查PDF是否存在）
-            pdf_path = PDF_DIR / f"{album_id}.pdf"
-            if pdf_path.exists():
+            if image_count == 0:
+                raise Exception("下载失败：未找到下载的文件")
+            
+            STAGE_SECONDS.observe(time.perf_counter() - start, stage="album")
+            self._record_profile(task, stats, queue_wait, time.perf_counter() - start)
+            # 图片入库后即可浏览，PDF单独生成
+            self._update_task_status(
+                task_id,
+                TaskStatus.COMPLETED,
+                progress=1.0,
+                message="下载完成"
+            )
+            if PDF_AUTO_BUILD:
+                self._pdf_tasks[album_id] = task_id
+                self.pdf_builder.enqueue(album_id)
+            self._check_quota()
+                    
+        except Exception as e:
+            if task_id in self._lost:
+                return
+            self._record_profile(task, stats, queue_wait, time.perf_counter() - start)
+            # 首次下载的专辑登记为下载中，结束登记（已写入的页面登记为可用，否则移除）
+            try:
+                await run_io(album_index.abort_album, album_id)
+            except Exception as index_error:
+                print(f"结束专辑登记失败 {album_id}: {index_error}")
+            if cancel_event.is_set():
                 self._update_task_status(
                     task_id,
-                    TaskStatus.COMPLETED,
-                    progress=1.0,
-                    message="下载完成"
+                    TaskStatus.CANCELLED,
+                    message="下载已取消"
                 )
-            else:
-                # 检查图片是否存在
-                # jmcomic可能下载到以专辑标题命名的文件夹
-                has_images = self._check_images_exist(album_id)
-                if has_images:
-                    self._update_task_status(
-                        task_id,
-                        TaskStatus.COMPLETED,
-                        progress=1.0,
-                        message="图片下载完成（PDF生成中）"
-                    )
-                else:
-                    raise Exception("下载失败：未找到下载的文件")
-                    
-        except Exception as e:
+                return
             error_msg = str(e)
             print(f"下载任务失败: {error_msg}")
             self._update_task_status(
@@ -137,88 +535,248 @@ class DownloadService:
                 error=error_msg,
                 message="下载失败"
             )
+        finally:
+            if task_id not in self._lost:
+                TASKS_FINISHED.inc(status=self.tasks.get(task_id, task).get("status"))
+                # 任务已结束，不再需要继续下载
+                await run_io(manifest.remove)
+            else:
+                # 进程退出或任务被其他进程接管，保留清单供继续下载
+                manifest.close()
+            self._finish_task(task_id)
+    
+    @staticmethod
+    def _record_profile(task: Dict, stats: Dict, queue_wait: Optional[float], elapsed: float):
+        """
+        记录任务的各阶段耗时（只对创建时要求性能分析的任务）
+        
+        Args:
+            task: 任务数据
+            stats: 下载线程中统计的各阶段耗时
+            queue_wait: 排队时间
+            elapsed: 下载总耗时
+        """
+        if not task.get("profiling"):
+            return
+        profile = dict(stats)
+        profile["download_seconds"] = round(elapsed, 3)
+        if queue_wait is not None:
+            profile["queue_wait_seconds"] = round(queue_wait, 3)
+        bytes_downloaded = task.get("bytes_downloaded") or 0
+        images = task.get("current_image") or 0
+        if elapsed > 0:
+            profile["bytes_per_second"] = round(bytes_downloaded / elapsed, 1)
+            profile["images_per_second"] = round(images / elapsed, 3)
+        task["profile"] = profile
     
-    def _sync_download(self, album_id: str):
-        """同步下载方法（在线程池中执行）"""
+    def _sync_download(
+        self,
+        album_id: str,
+        cancel_event: threading.Event,
+        on_progress: Optional[Callable[[Dict], None]] = None,
+        stats: Optional[Dict] = None,
+        manifest: Optional[DownloadManifest] = None
+    ) -> int:
+        """
+        同步下载方法（在线程池中执行）
+        
+        Args:
+            album_id: 专辑ID
+            cancel_event: 取消标记
+            on_progress: 进度回调
+            stats: 传入时写入各阶段耗时和重试次数（下载失败时也会写入）
+            manifest: 下载清单，记录完成的图片并跳过之前已完成的图片
+        
+        Returns:
+            int: 登记到专辑索引的图片数量
+        """
+        downloaders: List[TaskDownloader] = []
+        
+        def create_downloader(option):
+            downloader = TaskDownloader(option, cancel_event, on_progress, manifest, album_id, self.upstream, self.decoder)
+            downloaders.append(downloader)
+            return downloader
+        
         try:
-            # 使用jmcomic下载
-            album_list = [album_id]
-            self.option.download_album(album_list)
+            # 使用jmcomic下载，下载器在回调中检查取消标记并回报进度
+            album, _ = self.option.download_album(album_id, downloader=create_downloader)
         except Exception as e:
             print(f"下载错误: {e}")
             raise
-    
-    def _check_images_exist(self, album_id: str) -> bool:
-        """检查图片是否存在"""
-        # 查找包含该album_id的文件夹
-        if not STOCK_DIR.exists():
-            return False
+        finally:
+            if stats is not None and downloaders:
+                stats.update(downloaders[0].timer.snapshot())
+                stats["retries"] = downloaders[0].retries
+        if cancel_event.is_set():
+            raise DownloadCancelled("下载任务已取消")
         
-        # 方法1: 检查是否有以album_id开头的文件夹
-        for item in STOCK_DIR.iterdir():
-            if item.is_dir() and album_id in item.name:
-                # 检查是否有图片文件
-                images = list(item.rglob("*.jpg")) + list(item.rglob("*.png"))
-                if images:
-                    return True
-        
-        # 方法2: 递归查找包含该ID的文件夹
-        for item in STOCK_DIR.rglob("*"):
-            if item.is_dir() and album_id in str(item):
-                images = list(item.rglob("*.jpg")) + list(item.rglob("*.png"))
-                if images:
-                    return True
-        
-        return False
-    
-    def get_task_status(self, task_id: str) -> Optional[TaskStatusResponse]:
-        """获取任务状态"""
-        if task_id not in self.tasks:
+        # 下载完成后登记到专辑索引，图片有更新时旧的PDF失效
+        album_dir = Path(self.option.dir_rule.decide_album_root_dir(album))
+        index_start = time.perf_counter()
+        image_count = album_index.add_album(album_id, album_dir, album.name)
+        index_seconds = time.perf_counter() - index_start
+        STAGE_SECONDS.observe(index_seconds, stage="index")
+        if stats is not None:
+            stats["index_seconds"] = round(index_seconds, 3)
+        
+        # 下载时已获取专辑和章节信息，顺便更新元数据缓存（同时写入搜索索引的作者和标签）
+        try:
+            self.metadata.put_downloaded(album_id, album, downloaders[0].progress.photo_pages())
+        except Exception as e:
+            print(f"更新专辑元数据失败: {e}")
+        pdf_path = self.pdf_builder.pdf_path(album_id)
+        indexed = album_index.get_album(album_id)
+        if pdf_path.exists() and indexed and pdf_path.stat().st_mtime < indexed["mtime"]:
+            self.pdf_builder.invalidate(album_id)
+        return image_count
+    
+    async def get_task_status(self, task_id: str) -> Optional[TaskStatusResponse]:
+        """获取任务状态（本进程负责的任务直接读内存，其他任务读共享数据库）"""
+        task = self.tasks.get(task_id)
+        if task is None:
+            task = await run_io(self.store.get, task_id)
+        if task is None:
             return None
+        return self._to_status(task)
+    
+    async def _get_tasks(
+        self,
+        task_ids: Optional[List[str]] = None,
+        changed_since: Optional[str] = None
+    ) -> Dict[str, Dict]:
+        """批量读取任务，本进程负责的任务以内存中的状态为准"""
+        tasks = await run_io(self.store.get_many, task_ids, changed_since)
+        wanted = set(task_ids) if task_ids is not None else None
+        for task_id, task in self.tasks.items():
+            if wanted is not None and task_id not in wanted:
+                continue
+            if changed_since and (task.get("updated_at") or "") <= changed_since:
+                continue
+            tasks[task_id] = task
+        return tasks
+    
+    async def get_task_statuses(
+        self,
+        task_ids: Optional[List[str]] = None,
+        changed_since: Optional[str] = None
+    ) -> Tuple[List[TaskStatusResponse], List[str], str]:
+        """
+        批量获取任务状态
         
-        task = self.tasks[task_id]
+        Args:
+            task_ids: 任务ID列表（包括已归档的任务），None表示全部未归档的任务
+            changed_since: 只返回在此时间之后有更新的任务（上次返回的as_of）
+            
+        Returns:
+            (statuses, missing, as_of): 任务状态、不存在的任务ID，以及本次查询的时间点
+        """
+        # 其他进程的状态更新最多延迟 TASK_FLUSH_INTERVAL 写入数据库，
+        # as_of 往前留出余量，宁可重复返回也不遗漏
+        as_of = (datetime.now() - timedelta(seconds=TASK_FLUSH_INTERVAL + 1)).isoformat()
+        if task_ids is not None:
+            task_ids = list(dict.fromkeys(task_ids))
+            # changed_since 会过滤掉未变化的任务，不存在的任务需要单独确认
+            tasks = await self._get_tasks(task_ids, changed_since)
+            existing = tasks if not changed_since else await self._get_tasks(task_ids)
+            missing = [task_id for task_id in task_ids if task_id not in existing]
+            statuses = [self._to_status(tasks[task_id]) for task_id in task_ids if task_id in tasks]
+        else:
+            tasks = await self._get_tasks(None, changed_since)
+            missing = []
+            statuses = [self._to_status(task) for task in tasks.values()]
+        return statuses, missing, as_of
+    
+    async def open_event_stream(
+        self,
+        task_ids: Optional[Set[str]],
+        last_event_id: Optional[int] = None
+    ) -> Tuple[Subscriber, List[Tuple[int, str, Dict]]]:
+        """
+        订阅任务状态事件
         
-        return TaskStatusResponse(
-            task_id=task_id,
-            album_id=task.get("album_id", ""),
-            status=TaskStatus(task.get("status", TaskStatus.PENDING.value)),
-            progress=task.get("progress", 0.0),
-            current_image=task.get("current_image"),
-            total_images=task.get("total_images"),
-            message=task.get("message"),
-            error=task.get("error")
-        )
+        Args:
+            task_ids: 只订阅这些任务，None表示全部任务
+            last_event_id: 上次收到的事件ID，用于断线续传
+            
+        Returns:
+            (subscriber, initial_events): 订阅者，以及需要先发送的事件
+        """
+        subscriber = self.events.subscribe(task_ids)
+        
+        if last_event_id is not None:
+            initial_events = self.events.replay(last_event_id, task_ids)
+            if initial_events is not None:
+                return subscriber, initial_events
+        
+        # 无法续传时发送当前状态快照；订阅全部任务时只包含未结束的任务
+        event_id = self.events.last_event_id
+        if task_ids is None:
+            tasks = await run_io(self.store.list_active)
+            tasks.update({
+                task_id: task for task_id, task in self.tasks.items()
+                if task.get("status") in (TaskStatus.PENDING.value, TaskStatus.DOWNLOADING.value)
+            })
+        else:
+            tasks = await self._get_tasks(list(task_ids))
+        initial_events = [
+            (event_id, task_id, self._to_status(task).model_dump(mode="json"))
+            for task_id, task in tasks.items()
+        ]
+        return subscriber, initial_events
     
     def get_pdf_path(self, album_id: str) -> Optional[Path]:
-        """获取PDF文件路径"""
-        pdf_path = PDF_DIR / f"{album_id}.pdf"
+        """获取PDF文件路径（PDF按专辑索引中登记的专辑ID命名）"""
+        pdf_path = self.pdf_builder.pdf_path(album_index.resolve_id(album_id))
         if pdf_path.exists():
             return pdf_path
         return None
     
-    def get_images_path(self, album_id: str) -> Optional[Path]:
-        """获取图片文件夹路径"""
-        if not STOCK_DIR.exists():
-            return None
+    async def ensure_pdf(self, album_id: str) -> Optional[Path]:
+        """
+        获取PDF文件路径，尚未生成时立即生成
         
-        # 查找包含该album_id的文件夹
-        for item in STOCK_DIR.iterdir():
-            if item.is_dir() and album_id in item.name:
-                # 检查是否有图片
-                images = list(item.rglob("*.jpg")) + list(item.rglob("*.png"))
-                if images:
-                    return item
-        
-        # 递归查找
-        for item in STOCK_DIR.rglob("*"):
-            if item.is_dir() and album_id in str(item):
-                images = list(item.rglob("*.jpg")) + list(item.rglob("*.png"))
-                if images:
-                    return item
+        Returns:
+            Path: PDF路径；既没有PDF也没有图片时返回None
+        """
+        pdf_path = await run_io(self.get_pdf_path, album_id)
+        if pdf_path is not None:
+            return pdf_path
+        if await run_io(self.get_images_path, album_id) is None:
+            return None
+        return await self.pdf_builder.build(album_id)
+    
+    def get_images_path(self, album_id: str) -> Optional[Path]:
+        """获取图片文件夹路径（从专辑索引查找）"""
+        return album_index.get_folder(album_id)
+    
+    def close(self):
+        """
+        关闭服务，中断进行中的下载并写入剩余的任务状态
         
-        return None
+        进行中的任务保持下载中状态且不释放租约，租约过期后由其他进程（或重启后的本进程）继续下载。
+        """
+        self.scheduler.stop()
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            self._sync_task = None
+        if self._retention_task is not None:
+            self._retention_task.cancel()
+            self._retention_task = None
+        if self._quota_task is not None:
+            self._quota_task.cancel()
+            self._quota_task = None
+        album_index.flush_access()
+        for task_id, cancel_event in self._cancel_events.items():
+            self._lost.add(task_id)
+            cancel_event.set()
+        self._executor.shutdown(wait=False)
+        self.pdf_builder.close()
+        self.decoder.close()
+        self.metadata.close()
+        self.upstream.close()
+        io_executor.shutdown(wait=False)
+        self.store.close()
 
 
 # 全局单例
 download_service = DownloadService()
-
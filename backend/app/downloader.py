@@ -0,0 +1,464 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+import jmcomic
+from app.config import PROGRESS_INTERVAL, STOCK_DIR
+from app.album_index import album_index
+from app.image_decoder import ImageDecoder
+from app.upstream_client import UpstreamClients
+from app.upstream_limiter import upstream_limiter
+from app.metrics import DOWNLOAD_BYTES, DOWNLOAD_IMAGES, STAGE_SECONDS, UPSTREAM_FAILURES, UPSTREAM_RETRIES
+
+
+# 计算实时速度的时间窗口（秒）
+SPEED_WINDOW = 10.0
+
+
+class DownloadCancelled(Exception):
+    """下载任务被取消"""
+
+
+def partial_path(path: str) -> str:
+    """
+    图片写入过程中使用的临时文件路径
+
+    与图片在同一目录（改名是原子操作），以.开头不会被专辑索引扫描到，
+    保留原后缀（保存图片时按后缀决定格式）。
+    """
+    folder, name = os.path.split(path)
+    stem, suffix = os.path.splitext(name)
+    return os.path.join(folder, f".{stem}.{uuid.uuid4().hex[:8]}.part{suffix}")
+
+
+class DownloadManifest:
+    """
+    单个下载任务已完成图片的清单（JSON Lines文件，每张图片一行）
+
+    图片完整写入后追加一行，记录路径（相对下载目录）和大小。任务中断后被重新领取时，
+    清单中记录过且大小一致的图片直接跳过，从上次完成的图片继续下载。
+    进程崩溃时最后一行可能不完整，读取时忽略。
+    """
+
+    def __init__(self, path: Path):
+        """
+        Args:
+            path: 清单文件路径，已存在时读取之前完成的图片
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+        self.done: Dict[str, int] = {}
+        try:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self.done[entry["path"]] = int(entry["size"])
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _key(img_save_path: str) -> str:
+        try:
+            return Path(img_save_path).relative_to(STOCK_DIR).as_posix()
+        except ValueError:
+            return Path(img_save_path).as_posix()
+
+    def is_done(self, img_save_path: str) -> bool:
+        """图片是否已在之前的下载中完整写入（且之后没有变化）"""
+        size = self.done.get(self._key(img_save_path))
+        if size is None:
+            return False
+        try:
+            return os.path.getsize(img_save_path) == size
+        except OSError:
+            return False
+
+    def add(self, img_save_path: str, size: int):
+        """记录一张已完整写入的图片"""
+        key = self._key(img_save_path)
+        line = json.dumps({"path": key, "size": size}, ensure_ascii=False)
+        with self._lock:
+            if self._file is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._file = open(self.path, "a", encoding="utf-8")
+                # 上次中断时可能留下不完整的一行，另起一行避免与之拼接
+                if self._file.tell() > 0:
+                    self._file.write("\n")
+            self._file.write(line + "\n")
+            self._file.flush()
+            self.done[key] = size
+
+    def close(self):
+        """关闭清单文件（保留文件，供之后继续下载）"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def remove(self):
+        """任务已结束，删除清单文件"""
+        self.close()
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class DownloadProgress:
+    """
+    单个下载任务的进度统计（线程安全）
+
+    记录章节、图片数量和已传输字节数，并按最近一段时间的速度估算剩余时间。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total_photos = 0
+        self.done_photos = 0
+        self.total_images = 0
+        self.done_images = 0
+        self.bytes_downloaded = 0
+        self._photo_sizes: Dict[str, int] = {}
+        self._window = deque()
+
+    def start_album(self, photo_count: int, page_count: int):
+        with self._lock:
+            self.total_photos = photo_count
+            self.total_images = page_count
+
+    def start_photo(self, photo_id: str, image_count: int):
+        with self._lock:
+            self._photo_sizes[photo_id] = image_count
+            # 专辑页数未知时按章节累加
+            self.total_images = max(self.total_images, sum(self._photo_sizes.values()))
+
+    def photo_pages(self) -> Dict[str, int]:
+        """已开始下载的章节的页数，photo_id → 页数"""
+        with self._lock:
+            return dict(self._photo_sizes)
+
+    def finish_photo(self):
+        with self._lock:
+            self.done_photos += 1
+
+    def finish_image(self, size: int):
+        now = time.monotonic()
+        with self._lock:
+            self.done_images += 1
+            self.bytes_downloaded += size
+            self._window.append((now, self.done_images, self.bytes_downloaded))
+            while self._window and now - self._window[0][0] > SPEED_WINDOW:
+                self._window.popleft()
+
+    def snapshot(self) -> Dict:
+        """获取当前进度"""
+        with self._lock:
+            bytes_per_second = None
+            eta_seconds = None
+            if len(self._window) >= 2:
+                (t0, images0, bytes0), (t1, images1, bytes1) = self._window[0], self._window[-1]
+                elapsed = t1 - t0
+                if elapsed > 0:
+                    bytes_per_second = (bytes1 - bytes0) / elapsed
+                    images_per_second = (images1 - images0) / elapsed
+                    if images_per_second > 0 and self.total_images:
+                        eta_seconds = max(self.total_images - self.done_images, 0) / images_per_second
+            return {
+                "current_photo": self.done_photos,
+                "total_photos": self.total_photos or None,
+                "current_image": self.done_images,
+                "total_images": self.total_images or None,
+                "bytes_downloaded": self.bytes_downloaded,
+                "bytes_per_second": bytes_per_second,
+                "eta_seconds": eta_seconds
+            }
+
+
+class PagePublisher:
+    """
+    边下载边登记页面（线程安全）
+
+    页面完整写入后按专辑中的顺序登记到专辑索引：序号 = 之前章节的页数之和 + 页码，
+    与下载完成后整体登记的顺序一致；只登记从第一页起连续的页面，读者拿到的列表只会在末尾追加。
+    章节按顺序下载（threading.photo 为1）时，每个章节开始时之前章节的页数都已知。
+    """
+
+    def __init__(self, album_id: str, folder: Path, photo_indexes: List[int]):
+        """
+        Args:
+            album_id: 专辑ID
+            folder: 专辑根目录
+            photo_indexes: 专辑中各章节的序号（album_index）
+        """
+        self.album_id = album_id
+        self.folder = folder
+        self._lock = threading.Lock()
+        self._order = sorted(photo_indexes)
+        self._counts: Dict[int, int] = {}
+        self._offsets: Dict[int, int] = {}
+        # 已写入但尚未登记的页面：序号未知时按(章节, 页码)暂存，序号已知后按序号暂存
+        self._waiting: Dict[Tuple[int, int], Dict] = {}
+        self._ready: Dict[int, Dict] = {}
+        self._next = 0
+
+    def start_photo(self, photo_index: int, image_count: int):
+        """章节开始下载，记录页数并计算之后能确定位置的章节的起始序号"""
+        with self._lock:
+            self._counts[photo_index] = image_count
+            offset = 0
+            for index in self._order:
+                if index not in self._counts:
+                    break
+                self._offsets[index] = offset
+                offset += self._counts[index]
+            for key in [key for key in self._waiting if key[0] in self._offsets]:
+                image = self._waiting.pop(key)
+                image["seq"] = self._offsets[key[0]] + key[1] - 1
+                self._ready[image["seq"]] = image
+        self._publish()
+
+    def image_saved(self, photo_index: int, image_index: int, img_save_path: str):
+        """
+        一张页面已完整写入
+
+        Args:
+            photo_index: 章节序号
+            image_index: 章节中的页码（从1开始）
+            img_save_path: 图片路径
+        """
+        try:
+            stat = os.stat(img_save_path)
+            path = Path(img_save_path).relative_to(self.folder).as_posix()
+        except (OSError, ValueError):
+            return
+        image = {"path": path, "size": stat.st_size, "mtime": stat.st_mtime}
+        with self._lock:
+            if photo_index in self._offsets:
+                image["seq"] = self._offsets[photo_index] + image_index - 1
+                self._ready[image["seq"]] = image
+            else:
+                self._waiting[(photo_index, image_index)] = image
+        self._publish()
+
+    def _publish(self):
+        """登记从下一个序号起连续的页面"""
+        with self._lock:
+            batch = []
+            while self._next in self._ready:
+                batch.append(self._ready.pop(self._next))
+                self._next += 1
+            # 登记在锁内进行，保证按顺序写入
+            if batch:
+                try:
+                    album_index.add_partial_images(self.album_id, batch)
+                except Exception as e:
+                    print(f"登记下载中的页面失败 {self.album_id}: {e}")
+
+
+class StageTimer:
+    """单个下载任务各阶段的累计耗时和次数（线程安全，用于任务性能分析）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.seconds: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+
+    def record(self, stage: str, seconds: float):
+        STAGE_SECONDS.observe(seconds, stage=stage)
+        with self._lock:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+            self.counts[stage] = self.counts.get(stage, 0) + 1
+
+    def wrap(self, stage: str, func: Callable) -> Callable:
+        """包装函数，统计每次调用的耗时"""
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+        return timed
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            result = {f"{stage}_seconds": round(value, 3) for stage, value in self.seconds.items()}
+            result.update({f"{stage}_count": value for stage, value in self.counts.items()})
+            return result
+
+
+class TaskDownloader(jmcomic.JmDownloader):
+    """
+    绑定到单个下载任务的jmcomic下载器
+
+    在jmcomic的下载回调中检查取消标记，任务被取消时尽快中断下载；
+    同时统计进度，并按 PROGRESS_INTERVAL 节流回报给下载服务。
+    客户端的请求、解码、重试会被计入指标和任务的分阶段耗时。
+
+    图片先写入同目录的临时文件、完整写入后再改名，中断的下载不会留下不完整的图片；
+    传入下载清单时记录完成的图片，并跳过之前已完成的图片。
+    首次下载的专辑边下载边按顺序登记页面，下载完成前即可浏览已写入的页面。
+    传入共用的上游客户端时使用其连接池和域名健康状态，不再为每个任务单独创建客户端；
+    传入图片解码器时，图片的还原和重新编码在进程池中执行。
+    """
+
+    def __init__(
+        self,
+        option: jmcomic.JmOption,
+        cancel_event: threading.Event,
+        on_progress: Optional[Callable[[Dict], None]] = None,
+        manifest: Optional[DownloadManifest] = None,
+        album_id: Optional[str] = None,
+        clients: Optional[UpstreamClients] = None,
+        decoder: Optional[ImageDecoder] = None
+    ):
+        self.timer = StageTimer()
+        self.retries = 0
+        self.clients = clients
+        self.decoder = decoder
+        super().__init__(option)
+        self.cancel_event = cancel_event
+        self.on_progress = on_progress
+        self.manifest = manifest
+        # 登记到专辑索引时使用的专辑ID（与下载服务登记时一致），未指定时使用上游返回的ID
+        self.album_id = album_id
+        self.publisher: Optional[PagePublisher] = None
+        self.progress = DownloadProgress()
+        # 保护进度上报时间和重试计数（多个图片下载线程同时更新）
+        self._lock = threading.Lock()
+        self._last_report = 0.0
+
+    def create_client(self):
+        """创建客户端，包装请求、解码、重试方法用于统计（每个下载器有独立的客户端对象，连接池可以共用）"""
+        if self.clients is not None:
+            client = self.clients.new_client()
+        else:
+            client = super().create_client()
+            # 每次HTTP请求（包括重试）都经过进程内共用的自适应并发控制
+            client.postman.get = upstream_limiter.wrap(client.postman.get)
+        if self.decoder is not None:
+            client.save_image_resp = self.decoder.wrap(client.save_image_resp)
+        client.save_image_resp = self._atomic_save(client.save_image_resp)
+        client.get_album_detail = self.timer.wrap("metadata", client.get_album_detail)
+        client.get_photo_detail = self.timer.wrap("metadata", client.get_photo_detail)
+        client.get_jm_image = self.timer.wrap("fetch", client.get_jm_image)
+        client.save_image_resp = self.timer.wrap("decode", client.save_image_resp)
+
+        before_retry = client.before_retry
+        fallback = client.fallback
+
+        def counted_retry(*args, **kwargs):
+            with self._lock:
+                self.retries += 1
+            UPSTREAM_RETRIES.inc()
+            return before_retry(*args, **kwargs)
+
+        def counted_fallback(*args, **kwargs):
+            UPSTREAM_FAILURES.inc()
+            return fallback(*args, **kwargs)
+
+        client.before_retry = counted_retry
+        client.fallback = counted_fallback
+        return client
+
+    @staticmethod
+    def _atomic_save(save_image_resp: Callable) -> Callable:
+        """包装图片保存方法：先写入临时文件，完整写入后改名为目标文件"""
+        def atomic_save(decode_image, img_save_path, img_url, resp, scramble_id):
+            tmp = partial_path(img_save_path)
+            try:
+                result = save_image_resp(decode_image, tmp, img_url, resp, scramble_id)
+                os.replace(tmp, img_save_path)
+            except BaseException:
+                try:
+                    os.unlink(tmp)
+                except FileNotFoundError:
+                    pass
+                raise
+            return result
+        return atomic_save
+
+    def check_cancelled(self):
+        """任务已取消时抛出DownloadCancelled"""
+        if self.cancel_event.is_set():
+            raise DownloadCancelled("下载任务已取消")
+
+    def report_progress(self, force: bool = False):
+        """回报进度，距上次回报不足 PROGRESS_INTERVAL 时跳过"""
+        if self.on_progress is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_report < PROGRESS_INTERVAL:
+                return
+            self._last_report = now
+        self.on_progress(self.progress.snapshot())
+
+    def before_album(self, album):
+        self.check_cancelled()
+        super().before_album(album)
+        self.progress.start_album(len(album), album.page_count)
+        folder = Path(self.option.dir_rule.decide_album_root_dir(album))
+        album_id = self.album_id or album.album_id
+        if album_index.begin_album(album_id, folder, album.name, album.page_count):
+            self.publisher = PagePublisher(
+                album_id, folder, [int(index) for _, index, _ in album.episode_list]
+            )
+        self.report_progress(force=True)
+
+    def after_album(self, album):
+        super().after_album(album)
+        self.report_progress(force=True)
+
+    def before_photo(self, photo):
+        self.check_cancelled()
+        super().before_photo(photo)
+        self.progress.start_photo(photo.photo_id, len(photo))
+        if self.publisher is not None:
+            self.publisher.start_photo(photo.album_index, len(photo))
+        # 清理上次中断时留下的临时文件
+        save_dir = self.option.decide_image_save_dir(photo, ensure_exists=False)
+        if os.path.isdir(save_dir):
+            for part in Path(save_dir).glob(".*.part.*"):
+                try:
+                    part.unlink()
+                except FileNotFoundError:
+                    pass
+
+    def after_photo(self, photo):
+        super().after_photo(photo)
+        self.progress.finish_photo()
+        self.report_progress()
+
+    def before_image(self, image, img_save_path):
+        self.check_cancelled()
+        if image.exists and not image.cache and self.manifest is not None and self.manifest.is_done(img_save_path):
+            # 之前中断的下载已完整写入这张图片，按缓存命中处理
+            image.cache = True
+        super().before_image(image, img_save_path)
+
+    def after_image(self, image, img_save_path):
+        super().after_image(image, img_save_path)
+        # 缓存命中的图片不计入传输字节数
+        size = 0
+        cached = image.exists and image.cache
+        if not cached:
+            try:
+                size = os.path.getsize(img_save_path)
+            except OSError:
+                pass
+            DOWNLOAD_BYTES.inc(size)
+            if self.manifest is not None:
+                self.manifest.add(img_save_path, size)
+        DOWNLOAD_IMAGES.inc(cached="true" if cached else "false")
+        if self.publisher is not None:
+            self.publisher.image_saved(image.from_photo.album_index, image.index, img_save_path)
+        self.progress.finish_image(size)
+        self.report_progress()
@@ -0,0 +1,77 @@
+import asyncio
+import itertools
+import random
+from collections import deque
+from typing import Dict, List, Optional, Set, Tuple
+from app.config import EVENT_BUFFER_SIZE
+
+
+class Subscriber:
+    """单个推送连接的事件队列"""
+
+    def __init__(self, task_ids: Optional[Set[str]], maxsize: int = 256):
+        self.task_ids = task_ids
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        # 消费跟不上时置位，由连接方断开并按事件ID重新续传
+        self.overflowed = False
+
+    def accepts(self, task_id: str) -> bool:
+        return self.task_ids is None or task_id in self.task_ids
+
+
+class TaskEventBus:
+    """
+    任务状态事件总线
+
+    每次任务状态变化生成一个递增ID的事件，保留最近 EVENT_BUFFER_SIZE 个事件，
+    断线重连时可以从上次收到的事件ID之后续传。需在事件循环线程中调用。
+    """
+
+    def __init__(self, buffer_size: int = EVENT_BUFFER_SIZE):
+        # 每个进程的事件ID从随机起点开始递增：多进程部署时客户端重连到其他进程，
+        # 带来的事件ID不会落在本进程的缓冲区范围内，会改为发送状态快照
+        self._counter = itertools.count(random.randrange(1, 1 << 40) << 12)
+        self._buffer: deque = deque(maxlen=buffer_size)
+        self._subscribers: List[Subscriber] = []
+
+    @property
+    def last_event_id(self) -> int:
+        return self._buffer[-1][0] if self._buffer else 0
+
+    def publish(self, task_id: str, data: Dict):
+        """发布任务状态事件"""
+        event = (next(self._counter), task_id, data)
+        self._buffer.append(event)
+        for subscriber in self._subscribers:
+            if subscriber.overflowed or not subscriber.accepts(task_id):
+                continue
+            try:
+                subscriber.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                subscriber.overflowed = True
+
+    def replay(self, last_event_id: int, task_ids: Optional[Set[str]]) -> Optional[List[Tuple[int, str, Dict]]]:
+        """
+        获取指定事件ID之后的事件
+
+        Returns:
+            事件列表；缓冲区已不包含该ID之后的全部事件时返回None
+        """
+        # 事件ID超出当前范围（如服务重启）或已被挤出缓冲区时无法续传
+        if last_event_id > self.last_event_id:
+            return None
+        if self._buffer and self._buffer[0][0] > last_event_id + 1:
+            return None
+        return [
+            event for event in self._buffer
+            if event[0] > last_event_id and (task_ids is None or event[1] in task_ids)
+        ]
+
+    def subscribe(self, task_ids: Optional[Set[str]]) -> Subscriber:
+        subscriber = Subscriber(task_ids)
+        self._subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        if subscriber in self._subscribers:
+            self._subscribers.remove(subscriber)
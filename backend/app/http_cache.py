@@ -0,0 +1,179 @@
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import AsyncIterator, Callable, Dict, Optional, Tuple
+import anyio
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+from app.album_index import album_index, compute_digests
+from app.io_pool import run_io
+
+
+# 下载完成的内容不会再变化，允许客户端长期缓存
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+CHUNK_SIZE = 64 * 1024
+
+
+class RangeNotSatisfiable(Exception):
+    """Range请求超出文件范围"""
+
+
+def get_file_etag(path: Path, stat: os.stat_result) -> str:
+    """获取文件ETag，优先使用入库时预先计算的值"""
+    etag = album_index.get_etag(path, stat.st_size, stat.st_mtime)
+    if etag is None:
+        etag, crc32 = compute_digests(path)
+        album_index.set_etag(path, stat.st_size, stat.st_mtime, etag, crc32)
+    return etag
+
+
+def is_not_modified(request: Request, etag: str, mtime: Optional[float] = None) -> bool:
+    """根据If-None-Match / If-Modified-Since判断客户端缓存是否仍然有效"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and mtime is not None:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析单个字节范围
+
+    Returns:
+        (start, end): 包含两端的字节范围；格式不支持（如多个范围）时返回None
+
+    Raises:
+        RangeNotSatisfiable: 范围超出文件大小
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    start_text, _, end_text = spec.strip().partition("-")
+    try:
+        if start_text == "":
+            # 后缀范围：最后N个字节
+            length = int(end_text)
+            if length <= 0:
+                raise RangeNotSatisfiable()
+            return max(size - length, 0), size - 1
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise RangeNotSatisfiable()
+    return start, min(end, size - 1)
+
+
+async def iter_file(path: Path, start: int, length: int):
+    """按块读取文件的指定范围"""
+    async with await anyio.open_file(path, "rb") as f:
+        await f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = await f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+async def cached_file_response(
+    request: Request,
+    path: Path,
+    media_type: str,
+    filename: Optional[str] = None,
+    cache_control: str = IMMUTABLE_CACHE_CONTROL
+) -> Response:
+    """
+    返回支持条件请求和Range的文件响应
+
+    Args:
+        request: 当前请求
+        path: 文件路径
+        media_type: 媒体类型
+        filename: 下载文件名（Content-Disposition）
+        cache_control: Cache-Control头
+
+    Returns:
+        Response: 200 / 206 / 304 / 416 响应
+    """
+    stat = await run_io(os.stat, path)
+    etag = await run_io(get_file_etag, path, stat)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+    }
+    if filename is not None:
+        headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+
+    if is_not_modified(request, etag, stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    return range_response(
+        request,
+        stat.st_size,
+        headers,
+        media_type,
+        lambda start, length: iter_file(path, start, length)
+    )
+
+
+def range_response(
+    request: Request,
+    size: int,
+    headers: Dict[str, str],
+    media_type: str,
+    iter_range: Callable[[int, int], AsyncIterator[bytes]]
+) -> Response:
+    """
+    按请求的Range返回完整内容或其中一段
+
+    Args:
+        request: 当前请求
+        size: 内容总大小
+        headers: 响应头（需包含ETag，用于判断If-Range）
+        media_type: 媒体类型
+        iter_range: 按 (起始位置, 长度) 逐块生成内容的函数
+
+    Returns:
+        Response: 200 / 206 / 416 响应
+    """
+    headers["Accept-Ranges"] = "bytes"
+    start, end = 0, size - 1
+    status_code = 200
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    # If-Range与当前ETag不一致时忽略Range，返回完整内容
+    if range_header and size > 0 and (if_range is None or if_range == headers.get("ETag")):
+        try:
+            byte_range = parse_range(range_header, size)
+        except RangeNotSatisfiable:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+        if byte_range is not None:
+            start, end = byte_range
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    length = end - start + 1 if size > 0 else 0
+    headers["Content-Length"] = str(length)
+    if request.method == "HEAD":
+        return Response(status_code=status_code, headers=headers, media_type=media_type)
+    return StreamingResponse(
+        iter_range(start, length),
+        status_code=status_code,
+        headers=headers,
+        media_type=media_type
+    )
@@ -0,0 +1,111 @@
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional
+from app.config import DECODE_QUEUE_SIZE, DECODE_WORKERS
+from app.metrics import DECODE_WAIT_SECONDS
+
+
+def decode_image(data: bytes, num: int, path: str):
+    """
+    还原被打乱的图片并按目标路径的后缀重新编码保存（在进程池中执行）
+
+    Args:
+        data: 上游返回的原始图片数据
+        num: 分割数，0表示不需要还原（只转换格式）
+        path: 保存路径
+    """
+    from jmcomic import JmImageTool
+
+    JmImageTool.decode_and_save(num, JmImageTool.open_image(data), path)
+
+
+def _suffix(path: str) -> str:
+    """文件后缀（与jmcomic判断是否需要转换格式的方式相同）"""
+    return path[path.rfind("."):]
+
+
+class ImageDecoder:
+    """
+    图片解码进程池（下载服务的所有任务共用）
+
+    还原被打乱的图片（切成条再重新拼接）和重新编码都是CPU密集的操作，在下载线程中执行时受GIL限制，
+    所有下载线程加起来只能用满一个核。这里把原始数据交给进程池处理，下载线程只负责网络请求。
+    同时等待解码的图片数不超过 max_pending，解码跟不上时下载线程在提交前等待，不会继续获取新图片，
+    内存中积压的原始数据有上限。
+    """
+
+    def __init__(self, workers: int = DECODE_WORKERS, max_pending: int = DECODE_QUEUE_SIZE):
+        """
+        Args:
+            workers: 解码进程数，0表示在下载线程中解码
+            max_pending: 同时提交给进程池（执行中和排队中）的图片数上限
+        """
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            return self._pool
+
+    def decode(self, data: bytes, num: int, path: str):
+        """
+        在进程池中解码并保存图片，等待完成（排队的图片已满时先等待空位）
+
+        Args:
+            data: 原始图片数据
+            num: 分割数，0表示只转换格式
+            path: 保存路径
+        """
+        start = time.perf_counter()
+        self._slots.acquire()
+        DECODE_WAIT_SECONDS.observe(time.perf_counter() - start)
+        try:
+            pool = self._get_pool()
+            try:
+                pool.submit(decode_image, data, num, path).result()
+            except BrokenProcessPool:
+                # 解码进程异常退出，下次提交时重新创建进程池
+                with self._pool_lock:
+                    if self._pool is pool:
+                        self._pool = None
+                raise
+        finally:
+            self._slots.release()
+
+    def wrap(self, save_image_resp: Callable) -> Callable:
+        """
+        包装jmcomic客户端的 save_image_resp：需要还原或转换格式的图片交给进程池，
+        不需要处理的图片仍由原方法直接写入文件
+        """
+        if not self.enabled:
+            return save_image_resp
+
+        from jmcomic import JmImageTool
+
+        def save(decode_image, img_save_path, img_url, resp, scramble_id):
+            url = img_url or resp.url
+            url = url.split("?", 1)[0]
+            if decode_image is False or scramble_id is None:
+                if _suffix(url) == _suffix(img_save_path):
+                    return save_image_resp(decode_image, img_save_path, img_url, resp, scramble_id)
+                num = 0
+            else:
+                num = JmImageTool.get_num_by_url(scramble_id, url)
+            return self.decode(resp.content, num, img_save_path)
+
+        return save
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,25 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable
+from app.config import IO_WORKERS
+
+
+# 文件系统和数据库操作专用的线程池，与下载线程、默认线程池分开，
+# 避免阻塞事件循环，也避免大量并发请求占满其他线程池
+io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io")
+
+
+async def run_io(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    在IO线程池中执行阻塞的文件系统/数据库操作
+
+    Args:
+        func: 同步函数
+        *args, **kwargs: 函数参数
+
+    Returns:
+        函数返回值
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(io_executor, partial(func, *args, **kwargs))
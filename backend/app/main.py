@@ -1,22 +1,44 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from pathlib import Path
+import asyncio
+import base64
+from email.utils import formatdate
+import json
 import os
-from typing import List
+from typing import Any, Dict, List, Optional
 
 from app.models import (
     DownloadRequest,
+    BatchDownloadRequest,
     TaskResponse,
+    BatchTaskResponse,
     TaskStatusResponse,
+    BulkStatusRequest,
+    BulkStatusResponse,
+    PdfStatusResponse,
     AlbumInfo,
-    AlbumListResponse
+    AlbumListResponse,
+    AlbumMetadata,
+    MetadataBatchRequest,
+    MetadataBatchResponse
 )
 from app.download_service import download_service
+from app.album_index import album_index, search_query
+from app.album_meta import AlbumNotFound
+from app.thumbnails import image_deriver
+from app.io_pool import run_io
+from app.http_cache import cached_file_response, is_not_modified, range_response, IMMUTABLE_CACHE_CONTROL
+from app.archive import AlbumArchive, ARCHIVE_MEDIA_TYPES
+from app.metrics import metrics, monitor_event_loop, RequestMetricsMiddleware
+from app.upstream_limiter import upstream_limiter
 from app.config import (
     API_HOST,
     API_PORT,
+    BATCH_MAX_SIZE,
     CORS_ORIGINS,
+    EVENT_KEEPALIVE,
     PDF_DIR,
     STOCK_DIR
 )
@@ -36,6 +58,28 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# 接口耗时统计
+app.add_middleware(RequestMetricsMiddleware)
+
+# 事件循环延迟监测
+_loop_monitor: Optional[asyncio.Task] = None
+
+
+@app.on_event("startup")
+async def startup():
+    """启动下载调度、任务状态同步和事件循环监测"""
+    global _loop_monitor
+    download_service.start()
+    _loop_monitor = asyncio.create_task(monitor_event_loop())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """关闭时写入剩余的任务状态"""
+    if _loop_monitor is not None:
+        _loop_monitor.cancel()
+    download_service.close()
+    image_deriver.close()
 
 
 @app.get("/")
@@ -54,6 +98,29 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    运行指标（Prometheus文本格式）
+    
+    多进程部署时每个进程的指标独立统计，任务数来自共享的任务数据库。
+    """
+    content = await run_io(metrics.render)
+    return PlainTextResponse(content, media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/v1/download/upstream")
+async def get_upstream_state():
+    """
+    本进程上游请求的自适应并发控制、连接池和域名健康状态
+    
+    Returns:
+        dict: 当前并发上限、进行中和等待中的请求数、平滑后的请求耗时、各结果的请求数，
+            以及连接池（pool）和各域名（domains）的状态
+    """
+    return {**upstream_limiter.snapshot(), **download_service.upstream.snapshot()}
+
+
 @app.post("/api/v1/download/album", response_model=TaskResponse)
 async def start_download(request: DownloadRequest):
     """
@@ -66,15 +133,77 @@ async def start_download(request: DownloadRequest):
         TaskResponse: 任务信息
     """
     try:
-        task_id = await download_service.download_album(request.album_id)
+        task_id, created = await download_service.download_album(
+            request.album_id,
+            priority=request.priority,
+            profile=request.profile
+        )
+        status = await download_service.get_task_status(task_id)
         return TaskResponse(
             task_id=task_id,
             album_id=request.album_id,
-            status="pending",
-            message="下载任务已创建"
+            status=status.status,
+            message="下载任务已创建" if created else "该专辑已在下载队列中"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"创建下载任务失败: {str(e)}")
+
+
+@app.post("/api/v1/download/albums", response_model=BatchTaskResponse)
+async def start_batch_download(request: BatchDownloadRequest):
+    """
+    批量开始下载专辑
+    
+    Args:
+        request: 包含album_ids的请求，重复的album_id只创建一个任务
+        
+    Returns:
+        BatchTaskResponse: 按请求顺序排列的任务信息
+    """
+    if not request.album_ids:
+        raise HTTPException(status_code=400, detail="album_ids不能为空")
+    if len(request.album_ids) > BATCH_MAX_SIZE:
+        raise HTTPException(status_code=400, detail=f"单次最多提交{BATCH_MAX_SIZE}个专辑")
+    
+    try:
+        results = await download_service.download_albums(
+            request.album_ids,
+            priority=request.priority,
+            profile=request.profile
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"创建下载任务失败: {str(e)}")
+    
+    return BatchTaskResponse(tasks=[
+        TaskResponse(
+            task_id=task_id,
+            album_id=album_id,
+            status=(await download_service.get_task_status(task_id)).status,
+            message="下载任务已创建" if created else "该专辑已在下载队列中"
+        )
+        for album_id, task_id, created in results
+    ])
+
+
+@app.post("/api/v1/download/status", response_model=BulkStatusResponse)
+async def get_bulk_download_status(request: BulkStatusRequest):
+    """
+    批量获取下载任务状态
+    
+    Args:
+        request: task_ids（不传表示全部未归档的任务）和可选的changed_since
+        
+    Returns:
+        BulkStatusResponse: 任务状态列表；传入changed_since时只包含之后有变化的任务
+    """
+    if request.task_ids is not None and len(request.task_ids) > BATCH_MAX_SIZE:
+        raise HTTPException(status_code=400, detail=f"单次最多查询{BATCH_MAX_SIZE}个任务")
+    
+    statuses, missing, as_of = await download_service.get_task_statuses(
+        request.task_ids,
+        request.changed_since
+    )
+    return BulkStatusResponse(tasks=statuses, missing=missing, as_of=as_of)
 
 
 @app.get("/api/v1/download/status/{task_id}", response_model=TaskStatusResponse)
@@ -88,145 +217,573 @@ async def get_download_status(task_id: str):
     Returns:
         TaskStatusResponse: 任务状态信息
     """
-    status = download_service.get_task_status(task_id)
+    status = await download_service.get_task_status(task_id)
     if status is None:
         raise HTTPException(status_code=404, detail="任务不存在")
     return status
 
 
-@app.get("/api/v1/download/result/{album_id}")
-async def get_download_result(album_id: str):
+def _format_sse(event_id: int, data: dict) -> str:
+    """格式化为Server-Sent Events消息"""
+    return f"id: {event_id}\nevent: status\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.get("/api/v1/download/events")
+async def stream_download_events(
+    request: Request,
+    task_ids: Optional[str] = None,
+    last_event_id: Optional[int] = None
+):
+    """
+    推送任务状态变化（Server-Sent Events）
+    
+    Args:
+        task_ids: 逗号分隔的任务ID，不传则推送全部任务
+        last_event_id: 上次收到的事件ID，也可以通过Last-Event-ID请求头传递
+        
+    Returns:
+        StreamingResponse: text/event-stream 事件流
+    """
+    ids = set(task_ids.split(",")) if task_ids else None
+    header_id = request.headers.get("last-event-id")
+    if last_event_id is None and header_id and header_id.isdigit():
+        last_event_id = int(header_id)
+    
+    subscriber, initial_events = await download_service.open_event_stream(ids, last_event_id)
+    
+    async def event_stream():
+        try:
+            yield "retry: 3000\n\n"
+            for event_id, _, data in initial_events:
+                yield _format_sse(event_id, data)
+            
+            # 消费跟不上时断开，客户端会带上Last-Event-ID重连续传
+            while not subscriber.overflowed:
+                if await request.is_disconnected():
+                    break
+                try:
+                    event_id, _, data = await asyncio.wait_for(
+                        subscriber.queue.get(),
+                        timeout=EVENT_KEEPALIVE
+                    )
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield _format_sse(event_id, data)
+        finally:
+            download_service.events.unsubscribe(subscriber)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.post("/api/v1/download/cancel/{task_id}", response_model=TaskStatusResponse)
+async def cancel_download(task_id: str):
+    """
+    取消排队中或下载中的任务
+    
+    Args:
+        task_id: 任务ID
+        
+    Returns:
+        TaskStatusResponse: 任务状态信息
+    """
+    status = await download_service.get_task_status(task_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    if not await download_service.cancel_task(task_id):
+        raise HTTPException(status_code=409, detail="任务已结束，无法取消")
+    return await download_service.get_task_status(task_id)
+
+
+async def _require_complete(album_id: str):
+    """专辑仍在下载中时返回409（打包和PDF需要完整的专辑）"""
+    album = await run_io(album_index.get_album, album_id)
+    if album is not None and not album["complete"]:
+        raise HTTPException(status_code=409, detail="专辑仍在下载中")
+
+
+async def _refetch_evicted(album_id: str) -> Optional[JSONResponse]:
+    """
+    专辑因磁盘配额被清理时重新下载
+
+    Returns:
+        JSONResponse: 已清理时返回202和下载任务ID；未清理过返回None（由调用方返回404）
+    """
+    if not await run_io(album_index.is_evicted, album_id):
+        return None
+    task_id, _ = await download_service.download_album(album_id)
+    return JSONResponse(
+        status_code=202,
+        content={"album_id": album_id, "task_id": task_id, "message": "专辑已被清理，正在重新下载"}
+    )
+
+
+@app.api_route("/api/v1/download/result/{album_id}", methods=["GET", "HEAD"])
+async def get_download_result(album_id: str, request: Request):
     """
     获取下载结果（PDF文件）
     
+    PDF尚未生成时立即生成后返回。支持ETag/Last-Modified条件请求和Range分段请求。
+    专辑已因磁盘配额被清理时重新下载，返回202和下载任务ID。
+    
     Args:
         album_id: 专辑ID
         
     Returns:
-        FileResponse: PDF文件流
+        Response: PDF文件流
     """
-    pdf_path = download_service.get_pdf_path(album_id)
+    await _require_complete(album_id)
+    try:
+        pdf_path = await download_service.ensure_pdf(album_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"生成PDF失败: {str(e)}")
     if pdf_path is None:
+        refetch = await _refetch_evicted(album_id)
+        if refetch is not None:
+            return refetch
         raise HTTPException(status_code=404, detail="PDF文件不存在")
     
-    return FileResponse(
-        path=str(pdf_path),
+    album_index.touch(album_id)
+    return await cached_file_response(
+        request,
+        pdf_path,
         media_type="application/pdf",
         filename=f"{album_id}.pdf"
     )
 
 
+@app.get("/api/v1/download/pdf/{album_id}", response_model=PdfStatusResponse)
+async def get_pdf_status(album_id: str):
+    """
+    获取专辑的PDF生成状态
+    
+    Args:
+        album_id: 专辑ID
+        
+    Returns:
+        PdfStatusResponse: PDF生成状态
+    """
+    info = await run_io(download_service.pdf_builder.get_status, album_id) or {}
+    return PdfStatusResponse(album_id=album_id, **info)
+
+
+def _encode_cursor(key: Any) -> str:
+    """将分页位置编码为不透明的游标"""
+    return base64.urlsafe_b64encode(json.dumps(key).encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> Any:
+    """解码游标，格式不正确时返回400"""
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise HTTPException(status_code=400, detail="无效的游标")
+
+
+def _parse_fields(fields: Optional[str], allowed: tuple, default: tuple) -> List[str]:
+    """解析字段投影参数"""
+    if not fields:
+        return list(default)
+    selected = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in selected if field not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"不支持的字段: {', '.join(unknown)}")
+    return selected
+
+
+# 图片列表可选的字段
+IMAGE_FIELDS = ("name", "path", "size", "full_path")
+
+
+@app.get("/api/v1/download/metadata/{album_id}", response_model=AlbumMetadata)
+async def get_album_metadata(album_id: str, photos: bool = False, refresh: bool = False):
+    """
+    获取专辑元数据（标题、作者、标签、章节列表、总页数），不需要先下载
+    
+    Args:
+        album_id: 专辑ID
+        photos: 同时获取每个章节的页数（每个章节一次上游请求，结果会被缓存）
+        refresh: 忽略未过期的缓存，重新从上游获取
+        
+    Returns:
+        AlbumMetadata: 专辑元数据；缓存有效期内不访问上游
+    """
+    future = download_service.metadata.submit(album_id, photos, refresh)
+    try:
+        meta = await asyncio.wrap_future(future)
+    except AlbumNotFound:
+        raise HTTPException(status_code=404, detail="专辑不存在")
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"获取专辑信息失败: {str(e)}")
+    return download_service.metadata.to_response(meta)
+
+
+@app.post("/api/v1/download/metadata", response_model=MetadataBatchResponse)
+async def get_album_metadata_batch(request: MetadataBatchRequest):
+    """
+    批量获取/预取专辑元数据
+    
+    Args:
+        request: album_ids；wait为false时只返回已缓存的专辑，其余在后台获取（稍后再次请求即可拿到）
+        
+    Returns:
+        MetadataBatchResponse: 专辑元数据、后台获取中的专辑和获取失败的专辑
+    """
+    if len(request.album_ids) > BATCH_MAX_SIZE:
+        raise HTTPException(status_code=400, detail=f"单次最多查询{BATCH_MAX_SIZE}个专辑")
+    
+    metadata = download_service.metadata
+    album_ids = list(dict.fromkeys(request.album_ids))
+    pending = await run_io(metadata.prefetch, album_ids, request.photos)
+    errors = {}
+    if request.wait and pending:
+        futures = [asyncio.wrap_future(metadata.submit(album_id, request.photos)) for album_id in pending]
+        for album_id, result in zip(pending, await asyncio.gather(*futures, return_exceptions=True)):
+            if isinstance(result, AlbumNotFound):
+                errors[album_id] = "专辑不存在"
+            elif isinstance(result, Exception):
+                errors[album_id] = str(result)
+        pending = []
+    cached = await run_io(metadata.get_cached_many, album_ids)
+    return MetadataBatchResponse(
+        albums=[metadata.to_response(cached[album_id]) for album_id in album_ids if album_id in cached],
+        pending=pending,
+        errors=errors
+    )
+
+
 @app.get("/api/v1/download/images/{album_id}")
-async def get_images_info(album_id: str):
+async def get_images_info(
+    album_id: str,
+    cursor: Optional[str] = None,
+    limit: int = Query(200, ge=1, le=1000),
+    fields: Optional[str] = None
+):
     """
-    获取专辑图片列表信息
+    获取专辑图片列表信息（按游标分页）
+    
+    下载中的专辑返回已写入的页面（从第一页起连续，之后只会在末尾追加），complete为false，
+    total为上游给出的总页数；此时next_cursor总会返回，稍后用它继续获取新写入的页面。
+    专辑已因磁盘配额被清理时重新下载，返回202和下载任务ID。
     
     Args:
         album_id: 专辑ID
+        cursor: 上一页返回的next_cursor，不传表示第一页
+        limit: 每页数量
+        fields: 逗号分隔的字段，可选 name,path,size,full_path（默认 name,path）
         
     Returns:
         JSONResponse: 图片列表信息
     """
-    images_path = download_service.get_images_path(album_id)
+    selected = _parse_fields(fields, IMAGE_FIELDS, ("name", "path"))
+    after_seq = _decode_cursor(cursor) if cursor else -1
+    if not isinstance(after_seq, int):
+        raise HTTPException(status_code=400, detail="无效的游标")
+    
+    images_path = await run_io(download_service.get_images_path, album_id)
     if images_path is None:
+        refetch = await _refetch_evicted(album_id)
+        if refetch is not None:
+            return refetch
         raise HTTPException(status_code=404, detail="图片文件夹不存在")
+    album_index.touch(album_id)
     
-    # 获取所有图片文件
-    image_files = sorted(
-        list(images_path.rglob("*.jpg")) + 
-        list(images_path.rglob("*.png"))
-    )
-    
+    # 从专辑索引获取图片列表
+    images, next_seq = await run_io(album_index.list_images_page, album_id, after_seq, limit)
     images_info = []
-    for img_path in image_files:
-        relative_path = img_path.relative_to(images_path)
-        images_info.append({
+    for image in images:
+        img_path = images_path / image["path"]
+        values = {
             "name": img_path.name,
-            "path": str(relative_path),
+            "path": image["path"],
+            "size": image["size"],
             "full_path": str(img_path)
-        })
+        }
+        images_info.append({field: values[field] for field in selected})
     
+    album = await run_io(album_index.get_album, album_id)
+    complete = album is None or bool(album["complete"])
+    if not complete and next_seq is None:
+        next_seq = images[-1]["seq"] if images else after_seq
+    total = len(images_info)
+    if album is not None:
+        total = album["page_count"] if complete else max(album["expected_pages"] or 0, album["page_count"])
     return {
         "album_id": album_id,
-        "base_path": str(images_path),
         "images": images_info,
-        "total": len(images_info)
+        "total": total,
+        "complete": complete,
+        "next_cursor": _encode_cursor(next_seq) if next_seq is not None else None
     }
 
 
-@app.get("/api/v1/download/image/{album_id}/{image_path:path}")
-async def get_image_file(album_id: str, image_path: str):
+@app.api_route("/api/v1/download/image/{album_id}/{image_path:path}", methods=["GET", "HEAD"])
+async def get_image_file(
+    album_id: str,
+    image_path: str,
+    request: Request,
+    w: Optional[int] = Query(None, ge=16, le=4096),
+    q: int = Query(80, ge=1, le=100),
+    fmt: Optional[str] = Query(None, pattern="^(jpeg|webp|png)$")
+):
     """
     获取单张图片文件
     
     Args:
         album_id: 专辑ID
         image_path: 图片相对路径
+        w: 缩放到的宽度（可选）
+        q: 缩放/转码时的编码质量
+        fmt: 输出格式 jpeg/webp/png（可选）
         
     Returns:
-        FileResponse: 图片文件流
+        Response: 图片文件流；指定w或fmt时返回缩放/转码后的图片，均支持条件请求；
+            专辑已因磁盘配额被清理时重新下载，返回202和下载任务ID
     """
-    images_path = download_service.get_images_path(album_id)
-    if images_path is None:
-        raise HTTPException(status_code=404, detail="图片文件夹不存在")
-    
-    full_path = images_path / image_path
-    if not full_path.exists() or not full_path.is_file():
+    # 先查已解析路径缓存，未命中时再查专辑索引，均不遍历目录
+    full_path = album_index.path_cache.get(album_id, image_path)
+    if full_path is None:
+        full_path = await run_io(album_index.resolve_image, album_id, image_path)
+    if full_path is None:
+        refetch = await _refetch_evicted(album_id)
+        if refetch is not None:
+            return refetch
         raise HTTPException(status_code=404, detail="图片文件不存在")
+    album_index.touch(album_id)
+    
+    # 指定了尺寸或格式时返回缓存的派生图片
+    if w is not None or fmt is not None:
+        if fmt is None:
+            fmt = "png" if full_path.suffix.lower() == ".png" else "jpeg"
+        try:
+            key = await run_io(image_deriver.cache_key, full_path, w, q, fmt)
+        except FileNotFoundError:
+            album_index.path_cache.discard(album_id, image_path)
+            raise HTTPException(status_code=404, detail="图片文件不存在")
+        headers = {"ETag": f'"{key}"', "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+        if is_not_modified(request, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+        data, media_type = await image_deriver.get(full_path, w, q, fmt, key=key)
+        return Response(content=data, media_type=media_type, headers=headers)
     
     # 根据文件扩展名确定媒体类型
     media_type = "image/jpeg" if full_path.suffix.lower() == ".jpg" else "image/png"
     
-    return FileResponse(
-        path=str(full_path),
-        media_type=media_type,
-        filename=full_path.name
-    )
+    try:
+        return await cached_file_response(request, full_path, media_type=media_type)
+    except FileNotFoundError:
+        # 文件已在磁盘上被删除，缓存的路径失效
+        album_index.path_cache.discard(album_id, image_path)
+        raise HTTPException(status_code=404, detail="图片文件不存在")
 
 
-@app.get("/api/v1/download/list", response_model=AlbumListResponse)
-async def get_download_list():
+@app.api_route("/api/v1/download/archive/{album_id}", methods=["GET", "HEAD"])
+async def get_album_archive(
+    album_id: str,
+    request: Request,
+    fmt: str = Query("cbz", pattern="^(zip|cbz)$")
+):
     """
-    获取已下载的专辑列表
+    打包下载整个专辑的图片（不压缩的ZIP/CBZ）
     
+    边读取图片边发送，不生成临时文件。支持ETag/Last-Modified条件请求和Range断点续传。
+    
+    Args:
+        album_id: 专辑ID
+        fmt: 打包格式 cbz/zip；cbz按页码重新命名图片，zip保留原始目录结构
+        
+    Returns:
+        Response: ZIP文件流；专辑已因磁盘配额被清理时重新下载，返回202和下载任务ID
+    """
+    images_path = await run_io(download_service.get_images_path, album_id)
+    if images_path is None:
+        refetch = await _refetch_evicted(album_id)
+        if refetch is not None:
+            return refetch
+        raise HTTPException(status_code=404, detail="图片文件夹不存在")
+    await _require_complete(album_id)
+    album_index.touch(album_id)
+    images = await run_io(album_index.list_images, album_id)
+    if not images:
+        raise HTTPException(status_code=404, detail="图片文件夹不存在")
+    
+    archive = AlbumArchive(images_path, images, flat_names=(fmt == "cbz"))
+    try:
+        await run_io(archive.prepare)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="图片文件不存在，请重建专辑索引")
+    
+    headers = {
+        "ETag": archive.etag,
+        "Last-Modified": formatdate(archive.mtime, usegmt=True),
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL,
+        "Content-Disposition": f'attachment; filename="{album_id}.{fmt}"'
+    }
+    if is_not_modified(request, archive.etag, archive.mtime):
+        return Response(status_code=304, headers=headers)
+    return range_response(request, archive.size, headers, ARCHIVE_MEDIA_TYPES[fmt], archive.iter_range)
+
+
+# 专辑列表可选的字段
+ALBUM_FIELDS = tuple(AlbumInfo.model_fields)
+
+
+async def _album_items(albums: List[Dict], selected: set) -> List[AlbumInfo]:
+    """将专辑索引记录转换为返回的专辑信息，只保留选择的字段"""
+    # 从磁盘重建索引得到的专辑没有标题，使用已缓存的元数据补上（不访问上游）
+    untitled = [album["album_id"] for album in albums if not album["title"]]
+    cached = await run_io(download_service.metadata.get_cached_many, untitled) if "title" in selected and untitled else {}
+    items = []
+    for album in albums:
+        values = {
+            "album_id": album["album_id"],
+            "title": album["title"] or cached.get(album["album_id"], {}).get("title"),
+            "downloaded_at": album["downloaded_at"],
+            "has_pdf": bool(album["has_pdf"]),
+            "has_images": album["page_count"] > 0,
+            "page_count": album["page_count"],
+            "complete": bool(album["complete"]),
+            "authors": json.loads(album["authors"]) if album["authors"] else None,
+            "tags": json.loads(album["tags"]) if album["tags"] else None
+        }
+        items.append(AlbumInfo(**{field: values[field] for field in selected}))
+    return items
+
+
+@app.get(
+    "/api/v1/download/list",
+    response_model=AlbumListResponse,
+    response_model_exclude_unset=True
+)
+async def get_download_list(
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    sort: str = Query("downloaded_at", pattern="^(downloaded_at|album_id)$"),
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    fields: Optional[str] = None
+):
+    """
+    获取已下载的专辑列表（按游标分页）
+    
+    Args:
+        cursor: 上一页返回的next_cursor，不传表示第一页
+        limit: 每页数量
+        sort: 排序字段 downloaded_at / album_id
+        order: asc / desc
+        fields: 逗号分隔的字段，album_id总会返回（默认返回全部字段）
+        
     Returns:
         AlbumListResponse: 专辑列表
     """
-    albums = []
-    
-    # 从PDF目录获取
-    if PDF_DIR.exists():
-        for pdf_file in PDF_DIR.glob("*.pdf"):
-            album_id = pdf_file.stem
-            albums.append(AlbumInfo(
-                album_id=album_id,
-                has_pdf=True,
-                has_images=download_service.get_images_path(album_id) is not None
-            ))
-    
-    # 从图片目录获取（避免重复）
-    if STOCK_DIR.exists():
-        for item in STOCK_DIR.iterdir():
-            if item.is_dir():
-                # 尝试从文件夹名提取album_id
-                # 这里简化处理，实际可能需要更复杂的逻辑
-                images = list(item.rglob("*.jpg")) + list(item.rglob("*.png"))
-                if images:
-                    # 检查是否已在列表中
-                    album_id = item.name
-                    if not any(a.album_id == album_id for a in albums):
-                        albums.append(AlbumInfo(
-                            album_id=album_id,
-                            has_pdf=download_service.get_pdf_path(album_id) is not None,
-                            has_images=True
-                        ))
+    selected = set(_parse_fields(fields, ALBUM_FIELDS, ALBUM_FIELDS)) | {"album_id"}
+    
+    after = None
+    if cursor:
+        key = _decode_cursor(cursor)
+        # 游标中记录了排序方式，换了排序方式的游标不可复用
+        if not isinstance(key, list) or len(key) != 4 or key[:2] != [sort, order]:
+            raise HTTPException(status_code=400, detail="无效的游标")
+        after = (key[2], key[3])
+    
+    # 从专辑索引获取
+    albums, next_key = await run_io(album_index.list_albums_page, sort, order == "desc", limit, after)
+    total = await run_io(album_index.count_albums)
+    items = await _album_items(albums, selected)
     
     return AlbumListResponse(
-        albums=albums,
-        total=len(albums)
+        albums=items,
+        total=total,
+        next_cursor=_encode_cursor([sort, order, *next_key]) if next_key else None
     )
 
 
+@app.get(
+    "/api/v1/download/search",
+    response_model=AlbumListResponse,
+    response_model_exclude_unset=True
+)
+async def search_albums(
+    q: str = Query(..., max_length=200),
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    fields: Optional[str] = None
+):
+    """
+    搜索已下载的专辑（本地索引，不访问上游）
+    
+    按ID、标题、文件夹名、作者和标签匹配，每个词按前缀匹配，中日韩文字可以搜索标题中的任意一段，
+    多个词用空格分隔时需要全部匹配。ID完全相同的专辑排在最前，其余按相关度排序。
+    
+    Args:
+        q: 搜索内容
+        cursor: 上一页返回的next_cursor，不传表示第一页
+        limit: 每页数量
+        fields: 逗号分隔的字段，album_id总会返回（默认返回全部字段）
+        
+    Returns:
+        AlbumListResponse: 匹配的专辑，total为匹配总数
+    """
+    if search_query(q) is None:
+        raise HTTPException(status_code=400, detail="搜索内容不能为空")
+    selected = set(_parse_fields(fields, ALBUM_FIELDS, ALBUM_FIELDS)) | {"album_id"}
+    
+    offset = 0
+    if cursor:
+        key = _decode_cursor(cursor)
+        # 游标中记录了搜索内容，换了搜索内容的游标不可复用
+        if not isinstance(key, list) or len(key) != 2 or key[0] != q or not isinstance(key[1], int):
+            raise HTTPException(status_code=400, detail="无效的游标")
+        offset = key[1]
+    
+    albums, total = await run_io(album_index.search, q, limit, offset)
+    items = await _album_items(albums, selected)
+    next_offset = offset + len(albums)
+    
+    return AlbumListResponse(
+        albums=items,
+        total=total,
+        next_cursor=_encode_cursor([q, next_offset]) if next_offset < total else None
+    )
+
+
+@app.get("/api/v1/download/storage")
+async def get_storage_usage():
+    """
+    获取磁盘占用和配额
+    
+    Returns:
+        dict: 下载目录（去重后）和PDF目录的占用与配额（0表示不限制），以及本进程累计清理的专辑数、PDF数和字节数
+    """
+    return await run_io(download_service.quota.usage)
+
+
+@app.post("/api/v1/download/index/rebuild")
+async def rebuild_album_index():
+    """
+    从磁盘重建专辑索引
+    
+    Returns:
+        dict: 重建后的专辑数量
+    """
+    total = await run_io(album_index.rebuild)
+    return {"total": total}
+
+
+@app.post("/api/v1/download/index/dedupe")
+async def dedupe_album_images():
+    """
+    对尚未去重的已下载图片（如启用去重前下载的专辑）做内容去重，并清理不再被引用的blob
+    
+    Returns:
+        dict: 处理的图片数、替换为硬链接的图片数、节省的字节数、清理的blob数
+    """
+    return await run_io(album_index.dedupe)
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
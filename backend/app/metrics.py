@@ -0,0 +1,357 @@
+import asyncio
+import contextlib
+import math
+import threading
+import time
+from typing import Callable, Dict, List, Sequence, Tuple
+
+
+# 耗时直方图的默认分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+# 数据库写入、事件循环延迟等较短耗时的分桶（秒）
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Metric:
+    """指标基类：按标签值分组保存数据（线程安全）"""
+
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签: {', '.join(self.labelnames)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def clear(self):
+        """清空全部数据（采集时整体重新设置的指标使用）"""
+        with self._lock:
+            self._values.clear()
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """返回 (指标名后缀, 标签文本, 值) 列表"""
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    """只增不减的计数"""
+
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [("_total", _format_labels(self.labelnames, key), value) for key, value in items]
+
+
+class Gauge(Metric):
+    """可增可减的当前值"""
+
+    type_name = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [("", _format_labels(self.labelnames, key), value) for key, value in items]
+
+
+class Histogram(Metric):
+    """按分桶统计的分布（如耗时）"""
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data["counts"][i] += 1
+                    break
+            data["sum"] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """统计代码块的耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, list(data["counts"]), data["sum"]) for key, data in self._values.items())
+        samples = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames + ("le",), key + (_format_value(bound),))
+                samples.append(("_bucket", labels, cumulative))
+            labels = _format_labels(self.labelnames, key)
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    指标注册表
+
+    输出Prometheus文本格式。需要在采集时才能得到的值（如队列长度、任务数）
+    通过 add_collector 注册回调，在每次输出前更新。
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+
+    def _register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"指标已存在: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], None]):
+        """注册采集回调"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """输出全部指标（Prometheus文本格式）"""
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                print(f"采集指标失败: {e}")
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def executor_queue_depth(executor) -> int:
+    """线程池/进程池中等待执行的任务数"""
+    if executor is None:
+        return 0
+    work_queue = getattr(executor, "_work_queue", None)
+    if work_queue is not None:
+        return work_queue.qsize()
+    # 进程池：已提交但尚未完成的任务（含执行中的）
+    pending = getattr(executor, "_pending_work_items", None)
+    return len(pending) if pending is not None else 0
+
+
+class RequestMetricsMiddleware:
+    """
+    统计每个接口的耗时（ASGI中间件）
+
+    按路由模板（如 /api/v1/download/status/{task_id}）分组，避免路径参数导致标签过多；
+    耗时计算到返回响应头为止，流式响应（文件、状态推送）的传输时间不计入。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        recorded = False
+
+        def record(status: int):
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=str(status)
+            )
+
+        async def send_wrapper(message):
+            nonlocal recorded
+            if message["type"] == "http.response.start" and not recorded:
+                recorded = True
+                record(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if not recorded:
+                record(500)
+
+
+async def monitor_event_loop(interval: float = 0.5):
+    """定期测量事件循环延迟：实际唤醒时间比预定时间晚了多少"""
+    loop = asyncio.get_event_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(loop.time() - start - interval, 0.0)
+        EVENT_LOOP_LAG.observe(lag)
+        EVENT_LOOP_LAG_LAST.set(lag)
+
+
+# 全局单例
+metrics = MetricsRegistry()
+
+# 下载任务
+TASKS = metrics.gauge(
+    "jm_tasks", "各状态的任务数（共享任务表中未归档的任务）", ["status"]
+)
+TASKS_RUNNING_LOCAL = metrics.gauge(
+    "jm_tasks_running_local", "本进程正在执行的下载任务数"
+)
+TASKS_FINISHED = metrics.counter(
+    "jm_tasks_finished", "本进程执行结束的下载任务数", ["status"]
+)
+TASKS_RESUMED = metrics.counter(
+    "jm_tasks_resumed", "本进程接手的中断任务数（从上次完成的图片继续下载）"
+)
+TASKS_ARCHIVED = metrics.counter(
+    "jm_tasks_archived", "本进程归档到冷存储的已结束任务数"
+)
+TASK_QUEUE_WAIT = metrics.histogram(
+    "jm_task_queue_wait_seconds", "任务从创建到开始下载的排队时间"
+)
+STAGE_SECONDS = metrics.histogram(
+    "jm_download_stage_seconds",
+    "下载各阶段耗时：metadata=获取专辑/章节信息，fetch=单张图片请求，decode=单张图片解码保存，"
+    "index=入库，album=整个专辑下载，pdf=生成PDF",
+    ["stage"]
+)
+DOWNLOAD_BYTES = metrics.counter(
+    "jm_download_bytes", "下载的图片字节数（用rate()计算每秒字节数）"
+)
+DOWNLOAD_IMAGES = metrics.counter(
+    "jm_download_images", "下载完成的图片数（用rate()计算每秒图片数）", ["cached"]
+)
+DECODE_WAIT_SECONDS = metrics.histogram(
+    "jm_decode_wait_seconds", "图片等待提交到解码进程池的时间（解码跟不上下载时变长）", buckets=FAST_BUCKETS
+)
+UPSTREAM_RETRIES = metrics.counter(
+    "jm_upstream_retries", "上游请求重试次数"
+)
+UPSTREAM_FAILURES = metrics.counter(
+    "jm_upstream_failures", "上游请求在所有域名、所有重试后仍然失败的次数"
+)
+UPSTREAM_REQUESTS = metrics.counter(
+    "jm_upstream_requests", "上游请求数（含重试）：ok=正常，slow=超过目标耗时，throttled=被限流，error=失败", ["outcome"]
+)
+UPSTREAM_CONCURRENCY = metrics.gauge(
+    "jm_upstream_concurrency", "上游请求的并发：limit=当前上限，in_flight=进行中，waiting=等待名额", ["state"]
+)
+UPSTREAM_CONNECTIONS = metrics.gauge(
+    "jm_upstream_connections", "共用连接池的连接数：open=已建立，idle=空闲", ["state"]
+)
+UPSTREAM_DOMAIN_UP = metrics.gauge(
+    "jm_upstream_domain_up", "上游域名是否可用（1=可用，0=连续失败后停用中）", ["domain"]
+)
+
+# 执行器和事件循环
+EXECUTOR_QUEUE_DEPTH = metrics.gauge(
+    "jm_executor_queue_depth", "线程池/进程池中等待执行的任务数", ["executor"]
+)
+EVENT_LOOP_LAG = metrics.histogram(
+    "jm_event_loop_lag_seconds", "事件循环延迟", buckets=FAST_BUCKETS
+)
+EVENT_LOOP_LAG_LAST = metrics.gauge(
+    "jm_event_loop_lag_last_seconds", "最近一次测量的事件循环延迟"
+)
+
+# HTTP和存储
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    "jm_http_request_duration_seconds", "接口耗时（到返回响应头为止）", ["method", "route", "status"]
+)
+DISK_USAGE = metrics.gauge(
+    "jm_disk_usage_bytes", "磁盘占用：stock=下载目录（去重后），pdf=PDF目录", ["kind"]
+)
+EVICTIONS = metrics.counter(
+    "jm_evictions", "本进程因磁盘配额清理的数量：stock=专辑图片，pdf=PDF", ["kind"]
+)
+EVICTED_BYTES = metrics.counter(
+    "jm_evicted_bytes", "本进程因磁盘配额释放的字节数", ["kind"]
+)
+TASK_STORE_WRITE_SECONDS = metrics.histogram(
+    "jm_task_store_write_seconds", "任务数据库写事务耗时（含等待锁）", ["op"], buckets=FAST_BUCKETS
+)
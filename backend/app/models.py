@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from enum import Enum
 
 
@@ -8,10 +8,26 @@ class TaskStatus(str, Enum):
     DOWNLOADING = "downloading"
     COMPLETED = "completed"
     FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+class PdfStatus(str, Enum):
+    PENDING = "pending"
+    BUILDING = "building"
+    COMPLETED = "completed"
+    FAILED = "failed"
 
 
 class DownloadRequest(BaseModel):
     album_id: str
+    priority: int = 0  # 数值越大越优先
+    profile: bool = False  # 在任务状态中记录各阶段耗时
+
+
+class BatchDownloadRequest(BaseModel):
+    album_ids: List[str]
+    priority: int = 0
+    profile: bool = False
 
 
 class TaskResponse(BaseModel):
@@ -26,10 +42,40 @@ class TaskStatusResponse(BaseModel):
     album_id: str
     status: TaskStatus
     progress: float  # 0.0 to 1.0
+    queue_position: Optional[int] = None  # 排队中的位置，从1开始
     current_image: Optional[int] = None
     total_images: Optional[int] = None
+    current_photo: Optional[int] = None
+    total_photos: Optional[int] = None
+    bytes_downloaded: Optional[int] = None
+    bytes_per_second: Optional[float] = None
+    eta_seconds: Optional[float] = None  # 按最近的下载速度估算的剩余时间
+    pdf_status: Optional[PdfStatus] = None  # PDF单独生成，图片下载完成后即可浏览
     message: Optional[str] = None
     error: Optional[str] = None
+    updated_at: Optional[str] = None
+    profile: Optional[Dict[str, float]] = None  # 创建时指定profile的任务结束后记录的各阶段耗时（秒）和吞吐
+
+
+class BatchTaskResponse(BaseModel):
+    tasks: List[TaskResponse]
+
+
+class BulkStatusRequest(BaseModel):
+    task_ids: Optional[List[str]] = None  # 不传表示全部未归档的任务
+    changed_since: Optional[str] = None  # 上次响应的as_of，只返回之后有变化的任务
+
+
+class BulkStatusResponse(BaseModel):
+    tasks: List[TaskStatusResponse]
+    missing: List[str] = []  # 不存在的任务ID
+    as_of: str  # 下次查询时作为changed_since传入
+
+
+class PdfStatusResponse(BaseModel):
+    album_id: str
+    status: Optional[PdfStatus] = None  # 从未生成过时为None
+    error: Optional[str] = None
 
 
 class AlbumInfo(BaseModel):
@@ -38,9 +84,45 @@ class AlbumInfo(BaseModel):
     downloaded_at: Optional[str] = None
     has_pdf: bool = False
     has_images: bool = False
+    page_count: Optional[int] = None
+    complete: bool = True  # 为false时仍在下载，page_count为已写入的页数
+    authors: Optional[list[str]] = None  # 上游元数据中的作者，未获取过元数据时为None
+    tags: Optional[list[str]] = None
 
 
 class AlbumListResponse(BaseModel):
     albums: list[AlbumInfo]
     total: int
+    next_cursor: Optional[str] = None  # 下一页游标，没有下一页时为None
+
+
+class PhotoMetadata(BaseModel):
+    photo_id: str
+    index: int
+    title: Optional[str] = None
+    page_count: Optional[int] = None  # 只在获取了章节页数时返回
+
+
+class AlbumMetadata(BaseModel):
+    album_id: str
+    title: Optional[str] = None
+    authors: List[str] = []
+    tags: List[str] = []
+    pub_date: Optional[str] = None
+    update_date: Optional[str] = None
+    total_photos: int = 0
+    total_images: Optional[int] = None  # 上游未提供页数且未获取章节页数时为None
+    photos: List[PhotoMetadata] = []
+    fetched_at: str  # 从上游获取的时间
+
+
+class MetadataBatchRequest(BaseModel):
+    album_ids: List[str]
+    photos: bool = False  # 同时获取每个章节的页数
+    wait: bool = False  # 等待获取完成；否则只返回已缓存的专辑，其余在后台获取
+
 
+class MetadataBatchResponse(BaseModel):
+    albums: List[AlbumMetadata]
+    pending: List[str] = []  # 正在后台获取的专辑
+    errors: Dict[str, str] = {}  # 获取失败的专辑
@@ -0,0 +1,303 @@
+import asyncio
+import hashlib
+import io
+import os
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+from uuid import uuid4
+from app.config import PDF_DIR, PDF_WORKERS
+from app.models import PdfStatus
+from app.album_index import album_index
+from app.io_pool import io_executor
+from app.metrics import STAGE_SECONDS
+
+
+# 没有DPI信息时按96DPI换算页面尺寸（与img2pdf一致）
+DEFAULT_DPI = 96
+
+
+def _load_page(path: str):
+    """
+    读取单页图片，返回 (宽, 高, (页面宽pt, 页面高pt), 色彩空间, JPEG数据)
+
+    RGB/灰度JPEG直接嵌入原始数据，其余图片转为JPEG后嵌入。
+    """
+    from PIL import Image
+
+    with Image.open(path) as img:
+        width, height = img.size
+        dpi = img.info.get("dpi") or (DEFAULT_DPI, DEFAULT_DPI)
+        dpi_x, dpi_y = (float(d) or DEFAULT_DPI for d in dpi[:2])
+        page_size = (width * 72 / dpi_x, height * 72 / dpi_y)
+        if img.format == "JPEG" and img.mode in ("RGB", "L"):
+            colorspace = "/DeviceRGB" if img.mode == "RGB" else "/DeviceGray"
+            with open(path, "rb") as f:
+                return width, height, page_size, colorspace, f.read()
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=95)
+        colorspace = "/DeviceRGB" if img.mode == "RGB" else "/DeviceGray"
+        return width, height, page_size, colorspace, buffer.getvalue()
+
+
+class _DigestWriter:
+    """写入文件的同时计算SHA-256和CRC32（与 compute_digests 的结果相同）"""
+
+    def __init__(self, f):
+        self._f = f
+        self._digest = hashlib.sha256()
+        self.crc32 = 0
+
+    def write(self, data: bytes):
+        self._digest.update(data)
+        self.crc32 = zlib.crc32(data, self.crc32)
+        self._f.write(data)
+
+    def tell(self) -> int:
+        return self._f.tell()
+
+    @property
+    def etag(self) -> str:
+        return f'"{self._digest.hexdigest()}"'
+
+
+def write_pdf(image_paths: List[str], pdf_path: str) -> Tuple[int, str, int]:
+    """
+    逐页把图片写入PDF（在进程池中执行）
+
+    每次只读取一页图片并立即写出，内存占用与专辑页数无关。
+    先写入临时文件，完成后再替换目标文件。临时文件名每次不同，多个进程同时生成同一专辑的PDF时互不影响。
+    写入时顺便计算ETag，首次请求PDF时不需要再读取整个文件。
+
+    Args:
+        image_paths: 按顺序排列的图片路径
+        pdf_path: 输出的PDF路径
+
+    Returns:
+        (page_count, etag, crc32): 写入的页数，以及PDF的ETag和CRC32
+    """
+    if not image_paths:
+        raise ValueError("没有可生成PDF的图片")
+
+    tmp_path = f"{pdf_path}.{uuid4().hex}.tmp"
+    try:
+        etag, crc32 = _write_pdf_file(image_paths, tmp_path)
+        os.replace(tmp_path, pdf_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return len(image_paths), etag, crc32
+
+
+def _write_pdf_file(image_paths: List[str], path: str) -> Tuple[str, int]:
+    """把图片逐页写入PDF文件，返回文件的ETag和CRC32"""
+    # 对象编号：1=Catalog，2=Pages，之后每页依次为 Page、Contents、Image
+    page_count = len(image_paths)
+    page_ids = [3 + i * 3 for i in range(page_count)]
+    offsets: Dict[int, int] = {}
+
+    with open(path, "wb") as raw:
+        f = _DigestWriter(raw)
+
+        def write_object(obj_id: int, body: bytes):
+            offsets[obj_id] = f.tell()
+            f.write(b"%d 0 obj\n" % obj_id + body + b"\nendobj\n")
+
+        f.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        write_object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+        write_object(2, f"<< /Type /Pages /Kids [{kids}] /Count {page_count} >>".encode())
+
+        for page_id, path in zip(page_ids, image_paths):
+            width, height, (page_w, page_h), colorspace, data = _load_page(path)
+            contents_id, image_id = page_id + 1, page_id + 2
+            write_object(page_id, (
+                f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_w:.4f} {page_h:.4f}] "
+                f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> /Contents {contents_id} 0 R >>"
+            ).encode())
+            stream = f"q\n{page_w:.4f} 0 0 {page_h:.4f} 0 0 cm\n/Im0 Do\nQ".encode()
+            write_object(contents_id, b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+            header = (
+                f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                f"/ColorSpace {colorspace} /BitsPerComponent 8 /Filter /DCTDecode /Length {len(data)} >>\nstream\n"
+            ).encode()
+            offsets[image_id] = f.tell()
+            f.write(b"%d 0 obj\n" % image_id + header)
+            f.write(data)
+            f.write(b"\nendstream\nendobj\n")
+
+        object_count = 2 + page_count * 3
+        xref_offset = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (object_count + 1))
+        for obj_id in range(1, object_count + 1):
+            f.write(b"%010d 00000 n \n" % offsets[obj_id])
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (object_count + 1, xref_offset))
+    return f.etag, f.crc32
+
+
+class PdfBuilder:
+    """
+    PDF生成
+
+    PDF生成与图片下载分离：下载完成后图片即可浏览，PDF在进程池中单独生成。
+    后台队列按低优先级逐个生成；首次请求某专辑的PDF时立即生成（会插队到后台队列之前），
+    同一专辑同时只生成一次。
+    """
+
+    def __init__(self, pdf_dir: Path = PDF_DIR, workers: int = PDF_WORKERS):
+        self.pdf_dir = pdf_dir
+        self._workers = max(1, workers)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._queue: Deque[str] = deque()
+        self._status: Dict[str, Dict] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        # 状态变化回调，参数为 (album_id, 状态信息)
+        self.on_change: Optional[Callable[[str, Dict], None]] = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self._workers)
+        return self._pool
+
+    def pdf_path(self, album_id: str) -> Path:
+        return self.pdf_dir / f"{album_id}.pdf"
+
+    def _set_status(
+        self,
+        album_id: str,
+        status: PdfStatus,
+        error: Optional[str] = None,
+        seconds: Optional[float] = None
+    ):
+        info = {"status": status.value, "error": error}
+        if seconds is not None:
+            info["seconds"] = round(seconds, 3)
+        self._status[album_id] = info
+        if self.on_change is not None:
+            self.on_change(album_id, info)
+
+    def get_status(self, album_id: str) -> Optional[Dict]:
+        """
+        获取专辑的PDF生成状态（会查询专辑索引，需在线程池中调用）
+
+        Returns:
+            状态信息 {"status", "error"}；从未生成过且PDF不存在时返回None
+        """
+        album_id = album_index.resolve_id(album_id)
+        info = self._status.get(album_id)
+        if info is None and self.pdf_path(album_id).exists():
+            return {"status": PdfStatus.COMPLETED.value, "error": None}
+        return info
+
+    def enqueue(self, album_id: str):
+        """加入后台低优先级生成队列"""
+        if album_id in self._inflight or album_id in self._queue:
+            return
+        if self._worker is None:
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.create_task(self._background_worker())
+        self._queue.append(album_id)
+        self._set_status(album_id, PdfStatus.PENDING)
+        self._wakeup.set()
+
+    def busy_albums(self) -> Set[str]:
+        """正在生成或排队等待生成PDF的专辑"""
+        return set(self._inflight) | set(self._queue)
+
+    def invalidate(self, album_id: str):
+        """专辑图片有变化时删除旧的PDF，下次请求时重新生成"""
+        try:
+            self.pdf_path(album_id).unlink()
+        except FileNotFoundError:
+            return
+        album_index.set_pdf(album_id, None)
+        self._status.pop(album_id, None)
+
+    async def build(self, album_id: str) -> Path:
+        """
+        按专辑索引中的图片顺序生成PDF（已在生成中时等待同一次生成）
+
+        PDF按专辑索引中登记的专辑ID命名和登记（旧目录规则的文件夹为文件夹名，请求中的ID是它的别名）。
+
+        Args:
+            album_id: 专辑ID
+
+        Returns:
+            Path: 生成的PDF路径
+        """
+        loop = asyncio.get_event_loop()
+        album_id = await loop.run_in_executor(io_executor, album_index.resolve_id, album_id)
+        future = self._inflight.get(album_id)
+        if future is not None:
+            return await asyncio.shield(future)
+        # 从后台队列中取出，改为立即生成
+        if album_id in self._queue:
+            self._queue.remove(album_id)
+
+        future = loop.create_future()
+        self._inflight[album_id] = future
+        pdf_path = self.pdf_path(album_id)
+        start = time.perf_counter()
+        try:
+            self._set_status(album_id, PdfStatus.BUILDING)
+            folder = await loop.run_in_executor(io_executor, album_index.get_folder, album_id)
+            if folder is None:
+                raise FileNotFoundError("图片文件夹不存在")
+            image_files = await loop.run_in_executor(io_executor, album_index.list_image_files, album_id, folder)
+            _, etag, crc32 = await loop.run_in_executor(
+                self._get_pool(),
+                write_pdf,
+                [str(path) for path in image_files],
+                str(pdf_path)
+            )
+            # 记录生成时计算的ETag，之后的请求不需要再读取整个PDF
+            stat = await loop.run_in_executor(io_executor, pdf_path.stat)
+            await loop.run_in_executor(
+                io_executor, album_index.set_etag, pdf_path, stat.st_size, stat.st_mtime, etag, crc32
+            )
+            await loop.run_in_executor(io_executor, album_index.set_pdf, album_id, pdf_path)
+            seconds = time.perf_counter() - start
+            STAGE_SECONDS.observe(seconds, stage="pdf")
+            self._set_status(album_id, PdfStatus.COMPLETED, seconds=seconds)
+            future.set_result(pdf_path)
+            return pdf_path
+        except Exception as e:
+            print(f"生成PDF失败: {e}")
+            self._set_status(album_id, PdfStatus.FAILED, str(e))
+            future.set_exception(e)
+            # 避免无人等待时出现未获取异常的警告
+            future.exception()
+            raise
+        finally:
+            del self._inflight[album_id]
+
+    async def _background_worker(self):
+        """后台队列：一次只生成一个PDF，避免与按需生成争抢进程"""
+        while True:
+            while not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            album_id = self._queue.popleft()
+            try:
+                await self.build(album_id)
+            except Exception:
+                pass
+
+    def close(self):
+        """关闭进程池"""
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
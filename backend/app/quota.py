@@ -0,0 +1,181 @@
+import shutil
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Set
+from app.config import (
+    EVICTION_MIN_IDLE,
+    PDF_DIR,
+    PDF_QUOTA_BYTES,
+    STOCK_DIR,
+    STOCK_QUOTA_BYTES
+)
+from app.album_index import album_index
+from app.blob_store import blob_store
+from app.pdf_builder import PdfBuilder
+from app.metrics import DISK_USAGE, EVICTED_BYTES, EVICTIONS
+
+
+# 超过配额后清理到配额的这个比例，避免每次下载完成都触发清理
+EVICTION_TARGET_RATIO = 0.9
+# 每轮清理最多检查的专辑数
+EVICTION_BATCH = 1000
+
+
+class QuotaManager:
+    """
+    下载目录和PDF目录的磁盘配额
+
+    下载目录的占用按专辑索引中登记的图片计算（去重后共享的内容只计一次），PDF目录按文件大小计算。
+    超过配额时按最近使用时间（接口访问时记录，未访问过时为下载时间）从旧到新清理，直到配额的90%：
+    - 专辑：删除图片文件夹和只被该专辑引用的blob，从索引中移除并记录为已清理，再次请求时重新下载；
+    - PDF：删除PDF文件，再次请求时重新生成。
+    下载中（包括其他进程）、正在生成PDF、未下载完成、以及 min_idle 秒内访问过的专辑不清理。
+    """
+
+    def __init__(
+        self,
+        pdf_builder: PdfBuilder,
+        stock_quota: int = STOCK_QUOTA_BYTES,
+        pdf_quota: int = PDF_QUOTA_BYTES,
+        min_idle: float = EVICTION_MIN_IDLE
+    ):
+        """
+        Args:
+            pdf_builder: 下载服务的PDF生成器（清理PDF时同步其状态）
+            stock_quota: 下载目录配额（字节），0表示不限制
+            pdf_quota: PDF目录配额（字节），0表示不限制
+            min_idle: 最近这么多秒内访问过的专辑不清理
+        """
+        self.pdf_builder = pdf_builder
+        self.stock_quota = stock_quota
+        self.pdf_quota = pdf_quota
+        self.min_idle = min_idle
+        self._lock = threading.Lock()
+        self._evicted = {"albums": 0, "pdfs": 0, "bytes": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.stock_quota > 0 or self.pdf_quota > 0
+
+    @staticmethod
+    def pdf_usage() -> int:
+        """PDF目录占用的字节数"""
+        total = 0
+        for pdf_path in PDF_DIR.glob("*.pdf"):
+            try:
+                total += pdf_path.stat().st_size
+            except FileNotFoundError:
+                continue
+        return total
+
+    def usage(self) -> Dict:
+        """当前占用、配额和累计清理的数量"""
+        stock_bytes = album_index.stock_usage()
+        pdf_bytes = self.pdf_usage()
+        DISK_USAGE.set(stock_bytes, kind="stock")
+        DISK_USAGE.set(pdf_bytes, kind="pdf")
+        return {
+            "stock_bytes": stock_bytes,
+            "stock_quota": self.stock_quota,
+            "pdf_bytes": pdf_bytes,
+            "pdf_quota": self.pdf_quota,
+            "min_idle": self.min_idle,
+            "evicted": dict(self._evicted)
+        }
+
+    def _remove_folder(self, folder: str) -> bool:
+        """删除专辑文件夹（只删除下载目录之内的文件夹）"""
+        path = Path(folder).resolve()
+        root = STOCK_DIR.resolve()
+        if path == root or root not in path.parents:
+            print(f"专辑文件夹不在下载目录中，跳过清理: {folder}")
+            return False
+        shutil.rmtree(path, ignore_errors=True)
+        return True
+
+    def _evict_album(self, album_id: str, folder: str) -> int:
+        """
+        清理一个专辑的图片
+
+        Returns:
+            int: 释放的字节数
+        """
+        size, blobs = album_index.exclusive_images(album_id)
+        # 先从索引中移除，之后的请求不再返回即将删除的图片
+        album_index.mark_evicted(album_id)
+        if not self._remove_folder(folder):
+            return 0
+        blob_store.release(blobs)
+        EVICTIONS.inc(kind="stock")
+        EVICTED_BYTES.inc(size, kind="stock")
+        self._evicted["albums"] += 1
+        self._evicted["bytes"] += size
+        return size
+
+    def _evict_pdf(self, album_id: str) -> int:
+        """
+        删除一个专辑的PDF
+
+        Returns:
+            int: 释放的字节数
+        """
+        try:
+            size = self.pdf_builder.pdf_path(album_id).stat().st_size
+        except FileNotFoundError:
+            size = 0
+        self.pdf_builder.invalidate(album_id)
+        EVICTIONS.inc(kind="pdf")
+        EVICTED_BYTES.inc(size, kind="pdf")
+        self._evicted["pdfs"] += 1
+        self._evicted["bytes"] += size
+        return size
+
+    def evict(self, protected: Set[str]) -> Dict:
+        """
+        检查配额，超过时清理最久未使用的专辑和PDF
+
+        Args:
+            protected: 不能清理的专辑ID（下载中、正在生成PDF）
+
+        Returns:
+            dict: 清理的专辑数、PDF数和释放的字节数
+        """
+        result = {"albums": 0, "pdfs": 0, "bytes": 0}
+        if not self.enabled:
+            return result
+        # 多个调用方（定时检查和下载完成后的检查）不同时清理
+        with self._lock:
+            album_index.flush_access()
+            cutoff = (datetime.now() - timedelta(seconds=self.min_idle)).isoformat()
+            if self.stock_quota > 0:
+                usage = album_index.stock_usage()
+                if usage > self.stock_quota:
+                    target = self.stock_quota * EVICTION_TARGET_RATIO
+                    for album in album_index.lru_albums(EVICTION_BATCH):
+                        if usage <= target or album["last_used"] > cutoff:
+                            break
+                        if album["album_id"] in protected:
+                            continue
+                        freed = self._evict_album(album["album_id"], album["folder"])
+                        usage -= freed
+                        result["albums"] += 1
+                        result["bytes"] += freed
+                    if usage > self.stock_quota:
+                        print(f"下载目录仍超过配额（{usage} > {self.stock_quota}），其余专辑正在使用中")
+            if self.pdf_quota > 0:
+                usage = self.pdf_usage()
+                if usage > self.pdf_quota:
+                    target = self.pdf_quota * EVICTION_TARGET_RATIO
+                    for album in album_index.lru_albums(EVICTION_BATCH, with_pdf=True):
+                        if usage <= target or album["last_used"] > cutoff:
+                            break
+                        if album["album_id"] in protected:
+                            continue
+                        freed = self._evict_pdf(album["album_id"])
+                        usage -= freed
+                        result["pdfs"] += 1
+                        result["bytes"] += freed
+        if result["albums"] or result["pdfs"]:
+            print(f"磁盘配额清理：{result['albums']} 个专辑，{result['pdfs']} 个PDF，释放 {result['bytes']} 字节")
+        return result
@@ -0,0 +1,183 @@
+import asyncio
+import os
+import socket
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+from app.io_pool import run_io
+from app.task_store import TaskStore
+
+
+def make_worker_id() -> str:
+    """生成下载进程ID：主机名-进程号-随机后缀"""
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+def worker_alive(worker_id: str, current_worker_id: str) -> Optional[bool]:
+    """
+    判断下载进程是否仍在运行
+
+    只能判断本机的进程：进程号不存在，或进程号与本进程相同但ID不同（重启后复用了进程号，
+    容器中常见）时认为已退出。
+
+    Returns:
+        是否仍在运行；其他主机上的进程或无法判断时返回None
+    """
+    try:
+        host, pid, _ = worker_id.rsplit("-", 2)
+        pid = int(pid)
+    except ValueError:
+        return None
+    if os.name != "posix" or host != socket.gethostname():
+        return None
+    if pid == os.getpid():
+        return worker_id == current_worker_id
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class DownloadScheduler:
+    """
+    下载任务调度器
+
+    任务队列保存在共享的任务数据库中，任意进程都可以提交任务，
+    启用了下载的进程按优先级（数值越大越优先，同优先级先进先出）领取任务，
+    每个进程最多同时运行 concurrency 个任务。
+
+    领取任务时获得租约，运行期间每 heartbeat_interval 秒续约一次；
+    进程退出后租约过期，任务会被其他进程重新领取。
+    启动时检查本机已退出的进程持有的租约并立即置为过期，重启后马上继续中断的下载。
+    """
+
+    def __init__(
+        self,
+        store: TaskStore,
+        runner: Callable[[Dict], Awaitable[None]],
+        concurrency: int,
+        lease_seconds: float,
+        heartbeat_interval: float,
+        poll_interval: float
+    ):
+        """
+        Args:
+            store: 共享的任务存储
+            runner: 执行单个任务的协程函数，参数为领取到的任务数据
+            concurrency: 本进程的最大并发任务数
+            lease_seconds: 租约时长
+            heartbeat_interval: 续约间隔
+            poll_interval: 队列为空时检查其他进程提交的新任务的间隔
+        """
+        self.store = store
+        self.worker_id = make_worker_id()
+        self._runner = runner
+        self._concurrency = max(1, concurrency)
+        self._lease_seconds = lease_seconds
+        self._heartbeat_interval = heartbeat_interval
+        self._poll_interval = poll_interval
+        self._running: Set[str] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._workers: List[asyncio.Task] = []
+        # 续约时发现任务被请求取消、或租约已被其他进程接管的回调，参数为task_id
+        self.on_cancel: Optional[Callable[[str], None]] = None
+        self.on_lease_lost: Optional[Callable[[str], None]] = None
+
+    def start(self):
+        """在事件循环中启动工作协程和续约协程"""
+        if self._workers:
+            return
+        self._wakeup = asyncio.Event()
+        self._workers = [
+            asyncio.create_task(self._worker()) for _ in range(self._concurrency)
+        ]
+        self._workers.append(asyncio.create_task(self._heartbeat()))
+        self._workers.append(asyncio.create_task(self._recover_interrupted()))
+
+    @property
+    def started(self) -> bool:
+        return bool(self._workers)
+
+    def notify(self):
+        """本进程提交了新任务，立即唤醒空闲的工作协程"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def is_running(self, task_id: str) -> bool:
+        """任务是否正在本进程中运行"""
+        return task_id in self._running
+
+    @property
+    def running_count(self) -> int:
+        return len(self._running)
+
+    async def _worker(self):
+        """工作协程：从共享队列领取任务并执行"""
+        while True:
+            # 领取前清除唤醒标记：领取期间提交的任务会重新设置标记，不会被漏掉
+            self._wakeup.clear()
+            try:
+                task = await run_io(self.store.claim, self.worker_id, self._lease_seconds)
+            except Exception as e:
+                print(f"领取任务失败: {e}")
+                task = None
+            if task is None:
+                # 队列为空：等待本进程提交新任务，或定期检查其他进程提交的任务
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self._poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            task_id = task["task_id"]
+            self._running.add(task_id)
+            try:
+                await self._runner(task)
+            except Exception as e:
+                print(f"调度任务异常: {e}")
+            finally:
+                self._running.discard(task_id)
+                # 进程退出时不释放租约，过期后由其他进程继续下载
+                if self._workers:
+                    try:
+                        await run_io(self.store.release, task_id, self.worker_id)
+                    except Exception as e:
+                        print(f"释放任务租约失败: {e}")
+
+    async def _recover_interrupted(self):
+        """启动时让本机已退出的下载进程的租约立即过期，不必等待租约到期"""
+        try:
+            owners = await run_io(self.store.lease_owners)
+            dead = [owner for owner in owners if worker_alive(owner, self.worker_id) is False]
+            if dead and await run_io(self.store.expire_leases, dead):
+                self.notify()
+        except Exception as e:
+            print(f"恢复中断的任务失败: {e}")
+
+    async def _heartbeat(self):
+        """续约协程：为运行中的任务续约，并检查其他进程发来的取消请求"""
+        while True:
+            await asyncio.sleep(self._heartbeat_interval)
+            if not self._running:
+                continue
+            try:
+                lost, cancel_requested = await run_io(
+                    self.store.heartbeat, self.worker_id, list(self._running), self._lease_seconds
+                )
+            except Exception as e:
+                print(f"任务续约失败: {e}")
+                continue
+            for task_id in lost:
+                if self.on_lease_lost is not None:
+                    self.on_lease_lost(task_id)
+            for task_id in cancel_requested - lost:
+                if self.on_cancel is not None:
+                    self.on_cancel(task_id)
+
+    def stop(self):
+        """停止领取新任务"""
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
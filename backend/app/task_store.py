@@ -0,0 +1,566 @@
+import atexit
+import contextlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from app.config import TASKS_ARCHIVE_DB_FILE, TASKS_DB_FILE, TASKS_FILE, TASK_FLUSH_INTERVAL
+from app.models import TaskStatus
+from app.metrics import TASK_STORE_WRITE_SECONDS
+
+
+# 终态任务需要立即落盘
+TERMINAL_STATUSES = (TaskStatus.COMPLETED.value, TaskStatus.FAILED.value, TaskStatus.CANCELLED.value)
+# 未结束的任务，同一专辑同时只能有一个
+ACTIVE_STATUSES = (TaskStatus.PENDING.value, TaskStatus.DOWNLOADING.value)
+
+# 每次写入都分配全局递增的版本号，供其他进程增量同步任务变化
+NEXT_VERSION = "(SELECT COALESCE(MAX(version), 0) + 1 FROM tasks)"
+
+# 刚结束的任务可能还在生成PDF、状态仍会更新，至少保留这么久（秒）才归档
+ARCHIVE_MIN_AGE = 600
+
+
+def _pack(data: str) -> bytes:
+    """归档时压缩任务数据"""
+    return zlib.compress(data.encode("utf-8"))
+
+
+class TaskStore:
+    """
+    任务状态存储与共享队列
+
+    基于SQLite（WAL模式），每个任务一行，同一台机器上的多个API进程和下载进程共用一个数据库：
+    - 创建任务、领取任务、取消任务立即写入（BEGIN IMMEDIATE，跨进程互斥）；
+    - 下载进度等状态更新先记录在内存中，由后台线程按间隔批量写入，终态更新会立即触发写入；
+    - 下载进程通过租约领取任务并定期续约，进程退出后租约过期，任务会被其他进程重新领取；
+    - 已结束的旧任务定期移到归档数据库（压缩保存），共享任务表只保留未结束和最近的任务，
+      归档的任务仍可按task_id查询。
+    """
+
+    def __init__(
+        self,
+        db_file: Path = TASKS_DB_FILE,
+        flush_interval: float = TASK_FLUSH_INTERVAL,
+        archive_file: Path = TASKS_ARCHIVE_DB_FILE
+    ):
+        """初始化任务数据库并启动后台写入线程"""
+        self._lock = threading.Lock()
+        # 数据库连接在多个线程间共用，同一时间只允许一个线程使用
+        self._db_lock = threading.Lock()
+        self._pending: Dict[str, Dict] = {}
+        self._flush_interval = flush_interval
+        self._wakeup = threading.Event()
+        self._closed = False
+
+        # 多个进程同时写入时等待对方提交，而不是立即报错
+        self._conn = sqlite3.connect(str(db_file), check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.create_function("task_pack", 1, _pack, deterministic=True)
+        self._conn.execute("ATTACH DATABASE ? AS archive", (str(archive_file),))
+        self._conn.execute("PRAGMA archive.journal_mode=WAL")
+        self._init_schema()
+        self._migrate_json()
+
+        self._thread = threading.Thread(target=self._flush_loop, name="task-store-flush", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _init_schema(self):
+        """创建表结构，旧版数据库补上队列相关字段"""
+        with self._transaction("init"):
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    task_id TEXT PRIMARY KEY,
+                    album_id TEXT,
+                    status TEXT,
+                    updated_at TEXT,
+                    data TEXT NOT NULL
+                )
+            """)
+            columns = [row["name"] for row in self._conn.execute("PRAGMA table_info(tasks)")]
+            for column, definition in (
+                ("priority", "INTEGER NOT NULL DEFAULT 0"),
+                ("seq", "INTEGER"),
+                ("lease_owner", "TEXT"),
+                ("lease_expires", "REAL"),
+                ("cancel_requested", "INTEGER NOT NULL DEFAULT 0"),
+                ("version", "INTEGER NOT NULL DEFAULT 0"),
+            ):
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE tasks ADD COLUMN {column} {definition}")
+            if "seq" not in columns:
+                self._conn.execute("""
+                    UPDATE tasks SET
+                        seq = rowid,
+                        priority = COALESCE(json_extract(data, '$.priority'), 0),
+                        version = rowid
+                """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_queue ON tasks(status, priority, seq)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_album ON tasks(album_id, status)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_version ON tasks(version)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_updated ON tasks(updated_at)")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS archive.tasks (
+                    task_id TEXT PRIMARY KEY,
+                    album_id TEXT,
+                    status TEXT,
+                    updated_at TEXT,
+                    archived_at TEXT,
+                    data BLOB NOT NULL
+                )
+            """)
+
+    @contextlib.contextmanager
+    def _transaction(self, op: str):
+        """
+        写事务：BEGIN IMMEDIATE 在开始时即获取写锁，保证跨进程的读-改-写互斥
+
+        Args:
+            op: 操作名称，用于统计写入耗时
+        """
+        start = time.perf_counter()
+        with self._db_lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+        TASK_STORE_WRITE_SECONDS.observe(time.perf_counter() - start, op=op)
+
+    def _migrate_json(self):
+        """将旧版tasks.json导入数据库（只执行一次）"""
+        if not TASKS_FILE.exists():
+            return
+        try:
+            with open(TASKS_FILE, 'r', encoding='utf-8') as f:
+                tasks = json.load(f)
+            with self._transaction("migrate"):
+                for task_id, task in tasks.items():
+                    self._conn.execute(
+                        f"""
+                        INSERT OR IGNORE INTO tasks
+                            (task_id, album_id, status, updated_at, data, priority, seq, version)
+                        VALUES (?, ?, ?, ?, ?, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM tasks), {NEXT_VERSION})
+                        """,
+                        self._to_row(task_id, task) + (task.get("priority", 0),)
+                    )
+            TASKS_FILE.rename(TASKS_FILE.with_suffix(".json.bak"))
+        except Exception as e:
+            print(f"迁移旧任务状态失败: {e}")
+
+    @staticmethod
+    def _to_row(task_id: str, task: Dict) -> tuple:
+        return (
+            task_id,
+            task.get("album_id"),
+            task.get("status"),
+            task.get("updated_at"),
+            json.dumps(task, ensure_ascii=False)
+        )
+
+    @staticmethod
+    def _from_row(row: sqlite3.Row) -> Dict:
+        """数据库行转为任务数据，状态以状态列为准"""
+        task = json.loads(row["data"])
+        task["status"] = row["status"]
+        task["priority"] = row["priority"]
+        return task
+
+    @staticmethod
+    def _from_archive_row(row: sqlite3.Row) -> Dict:
+        """归档数据库的行转为任务数据"""
+        task = json.loads(zlib.decompress(row["data"]))
+        task["status"] = row["status"]
+        task["queue_position"] = None
+        return task
+
+    def _queue_position(self, row: sqlite3.Row) -> Optional[int]:
+        """排队中任务的位置（从1开始）"""
+        if row["status"] != TaskStatus.PENDING.value:
+            return None
+        return self._conn.execute(
+            """
+            SELECT COUNT(*) + 1 FROM tasks
+            WHERE status = 'pending' AND cancel_requested = 0
+              AND (priority > ? OR (priority = ? AND seq < ?))
+            """,
+            (row["priority"], row["priority"], row["seq"])
+        ).fetchone()[0]
+
+    def _with_position(self, row: sqlite3.Row) -> Dict:
+        task = self._from_row(row)
+        task["queue_position"] = self._queue_position(row)
+        return task
+
+    def create_or_join(self, task: Dict) -> Tuple[Dict, bool]:
+        """
+        创建下载任务；同一专辑已有未结束的任务时返回该任务
+
+        已有任务仍在排队时，只会提高其优先级（不会降低）。
+
+        Args:
+            task: 新任务数据，需包含task_id、album_id、priority
+
+        Returns:
+            (task, created): 任务数据（含queue_position），以及是否新建了任务
+        """
+        priority = task.get("priority", 0)
+        with self._transaction("create"):
+            row = self._conn.execute(
+                "SELECT * FROM tasks WHERE album_id = ? AND status IN (?, ?) AND cancel_requested = 0 LIMIT 1",
+                (task["album_id"], *ACTIVE_STATUSES)
+            ).fetchone()
+            if row is not None:
+                if row["status"] == TaskStatus.PENDING.value and priority > row["priority"]:
+                    self._conn.execute(
+                        f"UPDATE tasks SET priority = ?, version = {NEXT_VERSION} WHERE task_id = ?",
+                        (priority, row["task_id"])
+                    )
+                    row = self._conn.execute(
+                        "SELECT * FROM tasks WHERE task_id = ?", (row["task_id"],)
+                    ).fetchone()
+                return self._with_position(row), False
+
+            self._conn.execute(
+                f"""
+                INSERT INTO tasks (task_id, album_id, status, updated_at, data, priority, seq, version)
+                VALUES (?, ?, ?, ?, ?, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM tasks), {NEXT_VERSION})
+                """,
+                self._to_row(task["task_id"], task) + (priority,)
+            )
+            row = self._conn.execute(
+                "SELECT * FROM tasks WHERE task_id = ?", (task["task_id"],)
+            ).fetchone()
+            return self._with_position(row), True
+
+    def claim(self, worker_id: str, lease_seconds: float) -> Optional[Dict]:
+        """
+        领取一个任务：优先级最高的排队任务，或租约已过期（领取的进程已退出）的下载中任务
+
+        Args:
+            worker_id: 下载进程ID
+            lease_seconds: 租约时长，需在到期前续约
+
+        Returns:
+            领取到的任务数据；没有可领取的任务时返回None
+        """
+        now = time.time()
+        with self._transaction("claim"):
+            # 请求取消时下载进程已退出的任务，直接结束
+            self._conn.execute(
+                f"""
+                UPDATE tasks SET
+                    status = ?,
+                    data = json_set(data, '$.status', ?, '$.message', '下载已取消'),
+                    lease_owner = NULL,
+                    lease_expires = NULL,
+                    version = {NEXT_VERSION}
+                WHERE status = ? AND cancel_requested = 1 AND lease_expires < ?
+                """,
+                (TaskStatus.CANCELLED.value, TaskStatus.CANCELLED.value, TaskStatus.DOWNLOADING.value, now)
+            )
+            row = self._conn.execute(
+                """
+                SELECT * FROM tasks
+                WHERE status IN (?, ?) AND cancel_requested = 0
+                  AND (lease_expires IS NULL OR lease_expires < ?)
+                ORDER BY status = 'pending', priority DESC, seq
+                LIMIT 1
+                """,
+                (*ACTIVE_STATUSES, now)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                f"""
+                UPDATE tasks SET status = ?, lease_owner = ?, lease_expires = ?, version = {NEXT_VERSION}
+                WHERE task_id = ?
+                """,
+                (TaskStatus.DOWNLOADING.value, worker_id, now + lease_seconds, row["task_id"])
+            )
+            return self._from_row(row)
+
+    def heartbeat(self, worker_id: str, task_ids: Iterable[str], lease_seconds: float) -> Tuple[Set[str], Set[str]]:
+        """
+        为正在下载的任务续约
+
+        Returns:
+            (lost, cancel_requested): 租约已被其他进程接管的任务，以及被请求取消的任务
+        """
+        task_ids = list(task_ids)
+        if not task_ids:
+            return set(), set()
+        placeholders = ",".join("?" * len(task_ids))
+        with self._transaction("heartbeat"):
+            self._conn.execute(
+                f"UPDATE tasks SET lease_expires = ? WHERE lease_owner = ? AND task_id IN ({placeholders})",
+                (time.time() + lease_seconds, worker_id, *task_ids)
+            )
+            rows = self._conn.execute(
+                f"SELECT task_id, lease_owner, cancel_requested FROM tasks WHERE task_id IN ({placeholders})",
+                task_ids
+            ).fetchall()
+        owned = {row["task_id"] for row in rows if row["lease_owner"] == worker_id}
+        lost = set(task_ids) - owned
+        cancel_requested = {row["task_id"] for row in rows if row["cancel_requested"]}
+        return lost, cancel_requested
+
+    def lease_owners(self) -> Set[str]:
+        """持有未过期租约的下载进程ID"""
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT lease_owner FROM tasks WHERE status = ? AND lease_owner IS NOT NULL AND lease_expires >= ?",
+                (TaskStatus.DOWNLOADING.value, time.time())
+            ).fetchall()
+        return {row["lease_owner"] for row in rows}
+
+    def expire_leases(self, worker_ids: Iterable[str]) -> int:
+        """
+        让已退出的下载进程的租约立即过期，其任务可以马上被重新领取
+
+        Args:
+            worker_ids: 已确认退出的下载进程ID
+
+        Returns:
+            int: 租约被置为过期的任务数
+        """
+        worker_ids = list(worker_ids)
+        if not worker_ids:
+            return 0
+        placeholders = ",".join("?" * len(worker_ids))
+        with self._transaction("expire_leases"):
+            cursor = self._conn.execute(
+                f"UPDATE tasks SET lease_expires = 0 WHERE status = ? AND lease_owner IN ({placeholders})",
+                (TaskStatus.DOWNLOADING.value, *worker_ids)
+            )
+            return cursor.rowcount
+
+    def release(self, task_id: str, worker_id: str):
+        """下载结束后释放租约（先写入最终状态，避免释放后被其他进程当作未完成的任务领取）"""
+        self.flush()
+        with self._transaction("release"):
+            self._conn.execute(
+                "UPDATE tasks SET lease_owner = NULL, lease_expires = NULL WHERE task_id = ? AND lease_owner = ?",
+                (task_id, worker_id)
+            )
+
+    def request_cancel(self, task_id: str, task: Optional[Dict] = None) -> Optional[str]:
+        """
+        取消任务：排队中的任务直接结束，下载中的任务标记为待取消，由领取它的进程中断下载
+
+        Args:
+            task_id: 任务ID
+            task: 排队中的任务被直接取消时写入的任务数据（状态、消息等）
+
+        Returns:
+            "cancelled"（已取消）、"requested"（已通知下载进程）或 None（任务不存在或已结束）
+        """
+        with self._transaction("cancel"):
+            row = self._conn.execute("SELECT * FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+            if row is None or row["status"] not in ACTIVE_STATUSES:
+                return None
+            if row["status"] == TaskStatus.PENDING.value:
+                data = self._from_row(row)
+                data.update(task or {})
+                data["status"] = TaskStatus.CANCELLED.value
+                self._conn.execute(
+                    f"""
+                    UPDATE tasks SET status = ?, updated_at = ?, data = ?, version = {NEXT_VERSION}
+                    WHERE task_id = ?
+                    """,
+                    (data["status"], data.get("updated_at"), json.dumps(data, ensure_ascii=False), task_id)
+                )
+                return "cancelled"
+            self._conn.execute(
+                f"UPDATE tasks SET cancel_requested = 1, version = {NEXT_VERSION} WHERE task_id = ?",
+                (task_id,)
+            )
+            return "requested"
+
+    def discard(self, task_id: str):
+        """丢弃尚未写入的状态更新（任务已被其他进程接管时）"""
+        with self._lock:
+            self._pending.pop(task_id, None)
+
+    def get(self, task_id: str) -> Optional[Dict]:
+        """获取单个任务（含queue_position），尚未写入的更新优先"""
+        return self.get_many([task_id]).get(task_id)
+
+    def get_many(self, task_ids: Optional[List[str]] = None, changed_since: Optional[str] = None) -> Dict[str, Dict]:
+        """
+        批量获取任务（含queue_position）
+
+        Args:
+            task_ids: 任务ID列表（包括已归档的任务），None表示共享任务表中的全部任务
+            changed_since: 只返回updated_at晚于此时间的任务
+        """
+        self.flush()
+        where, params = [], []
+        if task_ids is not None:
+            if not task_ids:
+                return {}
+            where.append(f"task_id IN ({','.join('?' * len(task_ids))})")
+            params.extend(task_ids)
+        if changed_since:
+            where.append("updated_at > ?")
+            params.append(changed_since)
+        sql = "SELECT * FROM tasks" + (f" WHERE {' AND '.join(where)}" if where else "")
+        with self._db_lock:
+            rows = self._conn.execute(sql, params).fetchall()
+            tasks = {row["task_id"]: self._with_position(row) for row in rows}
+            # 指定了任务ID时，共享任务表中没有的再到归档中查找
+            archived = [task_id for task_id in task_ids or () if task_id not in tasks]
+            if archived:
+                sql = f"SELECT * FROM archive.tasks WHERE task_id IN ({','.join('?' * len(archived))})"
+                if changed_since:
+                    sql += " AND updated_at > ?"
+                    archived.append(changed_since)
+                rows = self._conn.execute(sql, archived).fetchall()
+                tasks.update((row["task_id"], self._from_archive_row(row)) for row in rows)
+            return tasks
+
+    def list_active(self) -> Dict[str, Dict]:
+        """获取全部未结束的任务（含queue_position）"""
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT * FROM tasks WHERE status IN (?, ?)", ACTIVE_STATUSES
+            ).fetchall()
+            return {row["task_id"]: self._with_position(row) for row in rows}
+
+    def changes_since(self, version: int, limit: int = 500) -> Tuple[List[Dict], int]:
+        """
+        获取版本号之后有变化的任务，用于同步其他进程写入的状态
+
+        Returns:
+            (tasks, last_version): 有变化的任务（含queue_position），以及最后一条的版本号
+        """
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT * FROM tasks WHERE version > ? ORDER BY version LIMIT ?", (version, limit)
+            ).fetchall()
+            tasks = [self._with_position(row) for row in rows]
+        return tasks, (rows[-1]["version"] if rows else version)
+
+    def count_by_status(self) -> Dict[str, int]:
+        """各状态的任务数"""
+        with self._db_lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    def archive(self, ttl: float, max_count: int) -> int:
+        """
+        把已结束的旧任务移到归档数据库
+
+        超过 ttl 秒未更新的任务，以及已结束任务数超过 max_count 时较旧的部分会被归档。
+        先写入归档再从共享任务表删除，中途退出时任务只会在两边重复，不会丢失。
+
+        Args:
+            ttl: 已结束任务的保留时长（秒），0表示不按时间归档
+            max_count: 共享任务表中保留的已结束任务数上限，0表示不限制
+
+        Returns:
+            int: 归档的任务数
+        """
+        statuses = ", ".join(f"'{status}'" for status in TERMINAL_STATUSES)
+        conditions = []
+        now = datetime.now()
+        params = {
+            "now": now.isoformat(),
+            "recent": (now - timedelta(seconds=ARCHIVE_MIN_AGE)).isoformat(),
+            "cutoff": (now - timedelta(seconds=ttl)).isoformat(),
+            "max_count": max_count,
+        }
+        if ttl > 0:
+            conditions.append("COALESCE(updated_at, '') < :cutoff")
+        if max_count > 0:
+            conditions.append(f"""
+                task_id NOT IN (
+                    SELECT task_id FROM tasks WHERE status IN ({statuses})
+                    ORDER BY updated_at DESC LIMIT :max_count
+                )
+            """)
+        if not conditions:
+            return 0
+        # 版本号最大的任务不归档，保证新分配的版本号始终递增
+        where = f"""
+            status IN ({statuses})
+            AND COALESCE(updated_at, '') < :recent
+            AND version < (SELECT MAX(version) FROM tasks)
+            AND ({' OR '.join(conditions)})
+        """
+        with self._transaction("archive"):
+            self._conn.execute(
+                f"""
+                INSERT OR REPLACE INTO archive.tasks (task_id, album_id, status, updated_at, archived_at, data)
+                SELECT task_id, album_id, status, updated_at, :now, task_pack(data) FROM tasks WHERE {where}
+                """,
+                params
+            )
+            return self._conn.execute(f"DELETE FROM tasks WHERE {where}", params).rowcount
+
+    def latest_version(self) -> int:
+        with self._db_lock:
+            return self._conn.execute("SELECT COALESCE(MAX(version), 0) FROM tasks").fetchone()[0]
+
+    def put(self, task_id: str, task: Dict):
+        """
+        记录任务状态（异步批量写入）
+
+        Args:
+            task_id: 任务ID
+            task: 任务数据
+        """
+        with self._lock:
+            self._pending[task_id] = dict(task)
+        if task.get("status") in TERMINAL_STATUSES:
+            self._wakeup.set()
+
+    def flush(self):
+        """将待写入的任务状态写入数据库"""
+        with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+        try:
+            with self._transaction("flush"):
+                self._conn.executemany(
+                    f"""
+                    UPDATE tasks SET status = ?, updated_at = ?, data = ?, version = {NEXT_VERSION}
+                    WHERE task_id = ?
+                    """,
+                    [
+                        (task.get("status"), task.get("updated_at"), json.dumps(task, ensure_ascii=False), task_id)
+                        for task_id, task in pending.items()
+                    ]
+                )
+        except Exception as e:
+            print(f"保存任务状态失败: {e}")
+            # 写入失败时保留数据等待下次重试，期间的新状态优先
+            with self._lock:
+                pending.update(self._pending)
+                self._pending = pending
+
+    def _flush_loop(self):
+        """后台写入线程"""
+        while not self._closed:
+            self._wakeup.wait(self._flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def close(self):
+        """停止后台线程并写入剩余数据"""
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join(timeout=5)
+        self.flush()
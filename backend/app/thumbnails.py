@@ -0,0 +1,254 @@
+import asyncio
+import hashlib
+import io
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from uuid import uuid4
+from app.config import (
+    THUMB_CACHE_DIR,
+    THUMB_CACHE_MAX_BYTES,
+    THUMB_MEMORY_MAX_BYTES,
+    THUMB_WORKERS
+)
+from app.io_pool import io_executor
+from app.metrics import metrics, executor_queue_depth, EXECUTOR_QUEUE_DEPTH
+
+
+# 支持输出的格式：参数名 → (PIL格式名, 后缀, 媒体类型)
+IMAGE_FORMATS = {
+    "jpeg": ("JPEG", ".jpg", "image/jpeg"),
+    "webp": ("WEBP", ".webp", "image/webp"),
+    "png": ("PNG", ".png", "image/png"),
+}
+
+
+def render_image(src: str, width: Optional[int], quality: int, fmt: str) -> bytes:
+    """
+    缩放并重新编码图片（在进程池中执行）
+
+    Args:
+        src: 原图路径
+        width: 目标宽度，None或不小于原图宽度时不缩放
+        quality: 编码质量（1-100）
+        fmt: 输出格式，IMAGE_FORMATS中的键
+
+    Returns:
+        bytes: 编码后的图片
+    """
+    from PIL import Image
+
+    with Image.open(src) as img:
+        if width and img.width > width:
+            height = max(1, round(img.height * width / img.width))
+            # JPEG可以在解码时直接降采样，减少解码开销
+            img.draft("RGB", (width, height))
+            img = img.resize((width, height), Image.LANCZOS)
+        if fmt == "jpeg" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        buffer = io.BytesIO()
+        img.save(buffer, format=IMAGE_FORMATS[fmt][0], quality=quality)
+        return buffer.getvalue()
+
+
+class MemoryLRU:
+    """按字节数限制大小的内存LRU缓存"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        data = self._items.get(key)
+        if data is not None:
+            self._items.move_to_end(key)
+        return data
+
+    def put(self, key: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        old = self._items.pop(key, None)
+        if old is not None:
+            self._size -= len(old)
+        self._items[key] = data
+        self._size += len(data)
+        while self._size > self.max_bytes:
+            _, evicted = self._items.popitem(last=False)
+            self._size -= len(evicted)
+
+
+class ImageDeriver:
+    """
+    缩略图/转码图片生成
+
+    生成的图片按原图（路径、大小、修改时间）和参数计算缓存键，
+    先查内存LRU，再查磁盘缓存，都未命中时在进程池中生成。
+    磁盘缓存超过 THUMB_CACHE_MAX_BYTES 时按最近使用时间淘汰。
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path = THUMB_CACHE_DIR,
+        max_bytes: int = THUMB_CACHE_MAX_BYTES,
+        memory_max_bytes: int = THUMB_MEMORY_MAX_BYTES,
+        workers: int = THUMB_WORKERS
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.memory = MemoryLRU(memory_max_bytes)
+        self._workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._disk_usage: Optional[int] = None
+        self._evicting = False
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self._workers)
+        return self._pool
+
+    @staticmethod
+    def cache_key(src: Path, width: Optional[int], quality: int, fmt: str) -> str:
+        stat = src.stat()
+        raw = f"{src}|{stat.st_size}|{stat.st_mtime_ns}|{width}|{quality}|{fmt}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _cache_path(self, key: str, fmt: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}{IMAGE_FORMATS[fmt][1]}"
+
+    @staticmethod
+    def _read_cached(path: Path) -> Optional[bytes]:
+        """读取磁盘缓存，命中时更新修改时间用于淘汰排序"""
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+            return data
+        except OSError:
+            return None
+
+    def _write_cached(self, path: Path, data: bytes):
+        """
+        写入磁盘缓存（临时文件+重命名，避免读到半个文件）
+
+        临时文件名每次不同，同一缓存键同时生成（同一进程或多个进程）时互不影响，后写入的覆盖先写入的。
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = Path(f"{path}.{uuid4().hex}.tmp")
+        try:
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                tmp_path.unlink()
+            except FileNotFoundError:
+                pass
+            raise
+        if self._disk_usage is None:
+            self._disk_usage = sum(stat.st_size for _, stat in self._cached_files())
+        else:
+            self._disk_usage += len(data)
+
+    def _cached_files(self):
+        """已写入完成的缓存文件及其状态（不包括正在写入的临时文件）"""
+        for f in self.cache_dir.rglob("*"):
+            if f.suffix == ".tmp":
+                continue
+            try:
+                stat = f.stat()
+            except FileNotFoundError:
+                # 已被其他进程淘汰
+                continue
+            if os.path.isfile(f):
+                yield f, stat
+
+    def _evict(self):
+        """淘汰最久未使用的缓存文件，直到占用降到上限的90%"""
+        try:
+            files = [(stat.st_mtime, stat.st_size, f) for f, stat in self._cached_files()]
+            usage = sum(size for _, size, _ in files)
+            target = self.max_bytes * 0.9
+            for _, size, f in sorted(files):
+                if usage <= target:
+                    break
+                try:
+                    f.unlink()
+                    usage -= size
+                except OSError:
+                    pass
+            self._disk_usage = usage
+        finally:
+            self._evicting = False
+
+    async def get(
+        self,
+        src: Path,
+        width: Optional[int],
+        quality: int,
+        fmt: str,
+        key: Optional[str] = None
+    ) -> Tuple[bytes, str]:
+        """
+        获取缩放/转码后的图片
+
+        Args:
+            src: 原图路径
+            width: 目标宽度
+            quality: 编码质量
+            fmt: 输出格式
+            key: 已计算好的缓存键（可选）
+
+        Returns:
+            (data, media_type): 图片数据和媒体类型
+        """
+        media_type = IMAGE_FORMATS[fmt][2]
+        loop = asyncio.get_event_loop()
+        if key is None:
+            key = await loop.run_in_executor(io_executor, self.cache_key, src, width, quality, fmt)
+
+        data = self.memory.get(key)
+        if data is not None:
+            return data, media_type
+
+        # 同一图片的并发请求只生成一次
+        future = self._inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future), media_type
+        future = loop.create_future()
+        self._inflight[key] = future
+        try:
+            cache_path = self._cache_path(key, fmt)
+            data = await loop.run_in_executor(io_executor, self._read_cached, cache_path)
+            if data is None:
+                data = await loop.run_in_executor(
+                    self._get_pool(), render_image, str(src), width, quality, fmt
+                )
+                await loop.run_in_executor(io_executor, self._write_cached, cache_path, data)
+                if self._disk_usage > self.max_bytes and not self._evicting:
+                    self._evicting = True
+                    loop.run_in_executor(io_executor, self._evict)
+            self.memory.put(key, data)
+            future.set_result(data)
+            return data, media_type
+        except Exception as e:
+            future.set_exception(e)
+            # 避免无人等待时出现未获取异常的警告
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def close(self):
+        """关闭进程池"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+# 全局单例
+image_deriver = ImageDeriver()
+metrics.add_collector(
+    lambda: EXECUTOR_QUEUE_DEPTH.set(executor_queue_depth(image_deriver._pool), executor="thumbnail")
+)
@@ -0,0 +1,261 @@
+import functools
+import threading
+import time
+from typing import Dict, List, Optional
+import jmcomic
+from common.postman.postman_api import AbstractPostman
+from common.postman.postman_impl import CurlCffiPostman
+from jmcomic.jm_option import CacheRegistry
+from app.config import DOMAIN_COOLDOWN, DOMAIN_FAILURE_THRESHOLD, UPSTREAM_POOL_SIZE
+from app.upstream_limiter import upstream_limiter
+
+
+class PooledPostman(AbstractPostman):
+    """
+    使用连接池的HTTP请求对象（替代jmcomic默认的每次请求新建连接）
+
+    池中每个会话持有一个curl句柄，连接、TLS会话和DNS解析结果在请求之间保持复用；
+    每次请求独占一个会话，请求结束后放回池中，池中最多 size 个会话。
+    """
+
+    postman_key = "pooled_curl_cffi"
+
+    def __init__(self, kwargs: dict, size: int = UPSTREAM_POOL_SIZE) -> None:
+        """
+        Args:
+            kwargs: 请求的默认参数（与jmcomic配置中的postman.meta_data相同，共用同一个字典）
+            size: 最多保持的会话（连接）数
+        """
+        super().__init__(kwargs)
+        self.size = max(1, size)
+        self._idle: List = []
+        self._created = 0
+        self._cond = threading.Condition()
+
+    def _acquire(self):
+        """取出一个空闲会话（最近用过的优先，连接更可能仍然有效），没有时新建或等待"""
+        with self._cond:
+            while not self._idle and self._created >= self.size:
+                self._cond.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._created += 1
+        from curl_cffi import requests
+        return requests.Session(use_thread_local_curl=False)
+
+    def _release(self, session):
+        with self._cond:
+            self._idle.append(session)
+            self._cond.notify()
+
+    def _request(self, method: str, url: str, **kwargs):
+        session = self._acquire()
+        try:
+            return session.request(method, url, **kwargs)
+        finally:
+            self._release(session)
+
+    def __get__(self):
+        return functools.partial(self._request, "GET")
+
+    def __post__(self):
+        return functools.partial(self._request, "POST")
+
+    def copy(self):
+        return self.__class__(self.meta_data.copy(), self.size)
+
+    def snapshot(self) -> Dict:
+        with self._cond:
+            return {"size": self.size, "open": self._created, "idle": len(self._idle)}
+
+    def close(self):
+        """关闭空闲的会话"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+        for session in idle:
+            session.close()
+
+
+class DomainHealth:
+    """
+    上游域名的健康状态（进程内所有客户端共用）
+
+    记录每个域名的平滑请求耗时和连续失败次数：连续失败 failure_threshold 次的域名在 cooldown 秒内不再使用，
+    之后允许试探一次，成功即恢复，失败则再次停用。
+    """
+
+    def __init__(self, failure_threshold: int = DOMAIN_FAILURE_THRESHOLD, cooldown: float = DOMAIN_COOLDOWN):
+        """
+        Args:
+            failure_threshold: 连续失败多少次后停用域名
+            cooldown: 停用时长（秒）
+        """
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict] = {}
+
+    def _get(self, domain: str) -> Dict:
+        """调用方需持有锁"""
+        stats = self._stats.get(domain)
+        if stats is None:
+            stats = {"latency": None, "failures": 0, "down_until": 0.0, "ok": 0, "errors": 0}
+            self._stats[domain] = stats
+        return stats
+
+    def record_success(self, domain: str, latency: float):
+        with self._lock:
+            stats = self._get(domain)
+            stats["latency"] = latency if stats["latency"] is None else stats["latency"] * 0.8 + latency * 0.2
+            stats["failures"] = 0
+            stats["down_until"] = 0.0
+            stats["ok"] += 1
+
+    def record_failure(self, domain: str):
+        with self._lock:
+            stats = self._get(domain)
+            stats["failures"] += 1
+            stats["errors"] += 1
+            if stats["failures"] >= self.failure_threshold:
+                stats["down_until"] = time.monotonic() + self.cooldown
+
+    def order(self, domains: List[str]) -> List[str]:
+        """
+        按健康状态排列域名：可用且有耗时记录的按耗时从快到慢，其次是尚未请求过的（保持配置顺序）；
+        停用中的域名不返回，全部停用时按恢复时间从早到晚返回全部域名
+
+        Args:
+            domains: 客户端的域名列表
+
+        Returns:
+            本次请求依次尝试的域名
+        """
+        now = time.monotonic()
+        with self._lock:
+            stats = {domain: self._get(domain) for domain in domains}
+        available = [domain for domain in domains if stats[domain]["down_until"] <= now]
+        if not available:
+            return sorted(domains, key=lambda domain: stats[domain]["down_until"])
+        measured = sorted(
+            (domain for domain in available if stats[domain]["latency"] is not None),
+            key=lambda domain: stats[domain]["latency"]
+        )
+        return measured + [domain for domain in available if stats[domain]["latency"] is None]
+
+    def snapshot(self) -> Dict[str, Dict]:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                domain: {
+                    "up": stats["down_until"] <= now,
+                    "latency_seconds": round(stats["latency"], 3) if stats["latency"] is not None else None,
+                    "consecutive_failures": stats["failures"],
+                    "retry_in_seconds": round(max(stats["down_until"] - now, 0.0), 1),
+                    "requests": {"ok": stats["ok"], "error": stats["errors"]}
+                }
+                for domain, stats in self._stats.items()
+            }
+
+
+class UpstreamClients:
+    """
+    下载服务共用的上游客户端
+
+    首次使用时按jmcomic配置创建一次客户端（解析域名列表、获取cookies等），之后每个下载任务/元数据缓存
+    得到的客户端共用同一个连接池（请求经过自适应并发控制）和域名健康状态，不再重复初始化和建立连接。
+    请求按域名健康状态选择最快的可用域名，失败时立即换下一个域名，停用中的域名直接跳过。
+    """
+
+    def __init__(self, option: jmcomic.JmOption, pool_size: int = UPSTREAM_POOL_SIZE):
+        """
+        Args:
+            option: 下载服务使用的jmcomic配置
+            pool_size: 连接池大小
+        """
+        self.option = option
+        self.pool_size = pool_size
+        self.health = DomainHealth()
+        self._lock = threading.Lock()
+        self._base: Optional[jmcomic.JmcomicClient] = None
+        self._postman = None
+
+    def _get_base(self) -> jmcomic.JmcomicClient:
+        """创建（首次使用时）基础客户端和共用的连接池"""
+        with self._lock:
+            if self._base is None:
+                base = self.option.new_jm_client()
+                postman = base.postman
+                # jmcomic默认的请求对象每次请求都新建连接，改为连接池（共用同一份请求参数和cookies）
+                if type(postman) is CurlCffiPostman:
+                    postman = PooledPostman(postman.meta_data, self.pool_size)
+                # 每次HTTP请求（包括重试）都经过进程内共用的自适应并发控制
+                postman.get = upstream_limiter.wrap(postman.get)
+                self._postman = postman
+                self._base = base
+            return self._base
+
+    def new_client(self) -> jmcomic.JmcomicClient:
+        """
+        创建一个使用共用连接池和域名健康状态的客户端
+
+        客户端对象很轻量：各自的方法包装和专辑缓存互不影响，连接、域名列表和cookies共用。
+        """
+        base = self._get_base()
+        client = type(base)(
+            postman=self._postman,
+            domain_list=list(base.domain_list),
+            retry_times=base.retry_times,
+            domain_retry_strategy=self._request_with_failover
+        )
+        CacheRegistry.enable_client_cache_on_condition(self.option, client, self.option.client.cache)
+        return client
+
+    def _request_with_failover(self, client, request=None, url=None, is_image=False, **kwargs):
+        """
+        按域名健康状态发送请求（作为jmcomic客户端的域名重试策略）
+
+        相对路径的请求依次尝试可用的域名，每个域名失败一次即换下一个，全部失败后再重试一轮，
+        最多 retry_times + 1 轮；图片等完整URL的请求最多尝试 retry_times + 1 次。
+        """
+        # 创建客户端时jmcomic会以客户端为唯一参数调用一次
+        if request is None:
+            return None
+
+        retry_errors = []
+        rounds = client.retry_times + 1
+        for retry_count in range(rounds):
+            domains = self.health.order(client.domain_list) if url.startswith("/") else [None]
+            for domain in domains:
+                req_kwargs = dict(kwargs)
+                req_url = client.of_api_url(url, domain) if domain is not None else url
+                if domain is not None or is_image:
+                    client.update_request_with_specify_domain(req_kwargs, domain, is_image)
+                start = time.monotonic()
+                try:
+                    resp = request(req_url, **req_kwargs)
+                    resp = client.raise_if_resp_should_retry(resp, is_image)
+                except Exception as e:
+                    if domain is not None:
+                        self.health.record_failure(domain)
+                    if client.retry_times == 0 and len(domains) == 1:
+                        raise
+                    client.before_retry(e, req_kwargs, retry_count, req_url)
+                    retry_errors.append({"domain": domain, "url": req_url, "retry": retry_count, "error": e})
+                    continue
+                if domain is not None:
+                    self.health.record_success(domain, time.monotonic() - start)
+                return resp
+        return client.fallback(request, url, len(client.domain_list), rounds, is_image,
+                               retry_errors=retry_errors, **kwargs)
+
+    def snapshot(self) -> Dict:
+        """连接池和各域名的状态"""
+        return {
+            "pool": self._postman.snapshot() if isinstance(self._postman, PooledPostman) else None,
+            "domains": self.health.snapshot()
+        }
+
+    def close(self):
+        if isinstance(self._postman, PooledPostman):
+            self._postman.close()
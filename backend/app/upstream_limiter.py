@@ -0,0 +1,147 @@
+import threading
+import time
+from typing import Callable, Dict
+from app.config import (
+    UPSTREAM_INITIAL_CONCURRENCY,
+    UPSTREAM_MAX_CONCURRENCY,
+    UPSTREAM_MAX_RPS,
+    UPSTREAM_MIN_CONCURRENCY,
+    UPSTREAM_TARGET_LATENCY
+)
+from app.metrics import UPSTREAM_REQUESTS
+
+
+# 两次减小并发上限之间的最短间隔（秒）：同一波拥塞中的多个失败只减一次
+DECREASE_COOLDOWN = 1.0
+# 上游限流/过载时返回的状态码
+THROTTLE_STATUS_CODES = (429, 503)
+
+
+class AdaptiveLimiter:
+    """
+    上游请求的自适应并发控制（AIMD），进程内所有下载任务共用
+
+    每个请求（包括重试）需要先获得一个并发名额：
+    - 请求成功且耗时不超过 target_latency 时，并发上限缓慢增加（每完成约“上限”个请求加1）；
+    - 请求失败、被限流（429/503）或耗时超过 target_latency 时，并发上限减半
+      （DECREASE_COOLDOWN 秒内最多一次），不低于 min_limit。
+    另外可以限制每秒发出的请求数（max_rps，0表示不限制）。
+    """
+
+    def __init__(
+        self,
+        initial: int = UPSTREAM_INITIAL_CONCURRENCY,
+        min_limit: int = UPSTREAM_MIN_CONCURRENCY,
+        max_limit: int = UPSTREAM_MAX_CONCURRENCY,
+        target_latency: float = UPSTREAM_TARGET_LATENCY,
+        max_rps: float = UPSTREAM_MAX_RPS,
+        decrease_factor: float = 0.5
+    ):
+        """
+        Args:
+            initial: 初始并发上限
+            min_limit: 并发上限的下限
+            max_limit: 并发上限的上限
+            target_latency: 单个请求的目标耗时（秒），超过时视为拥塞，0表示不按耗时调整
+            max_rps: 每秒最多发出的请求数，0表示不限制
+            decrease_factor: 拥塞时并发上限乘以的系数
+        """
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.target_latency = target_latency
+        self.max_rps = max_rps
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+        self._last_decrease = 0.0
+        self._next_send = 0.0
+        self._latency = None
+        self._counts = {"ok": 0, "slow": 0, "throttled": 0, "error": 0}
+
+    def acquire(self):
+        """获取一个并发名额（阻塞直到有空闲名额），并按速率限制等待"""
+        with self._cond:
+            self.waiting += 1
+            try:
+                while self.in_flight >= int(self.limit):
+                    self._cond.wait()
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+            delay = 0.0
+            if self.max_rps > 0:
+                now = time.monotonic()
+                send_at = max(now, self._next_send)
+                self._next_send = send_at + 1 / self.max_rps
+                delay = send_at - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def release(self, latency: float, outcome: str):
+        """
+        归还名额并按请求结果调整并发上限
+
+        Args:
+            latency: 请求耗时（秒）
+            outcome: ok / slow / throttled / error
+        """
+        UPSTREAM_REQUESTS.inc(outcome=outcome)
+        with self._cond:
+            self.in_flight -= 1
+            self._counts[outcome] += 1
+            # 平滑后的请求耗时，只用于展示
+            self._latency = latency if self._latency is None else self._latency * 0.9 + latency * 0.1
+            if outcome == "ok":
+                self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+            else:
+                now = time.monotonic()
+                if now - self._last_decrease >= DECREASE_COOLDOWN:
+                    self._last_decrease = now
+                    self.limit = max(self.limit * self.decrease_factor, self.min_limit)
+            self._cond.notify_all()
+
+    def classify(self, status_code: int, latency: float) -> str:
+        """按响应状态码和耗时判断请求结果"""
+        if status_code in THROTTLE_STATUS_CODES:
+            return "throttled"
+        if status_code >= 500:
+            return "error"
+        if self.target_latency > 0 and latency > self.target_latency:
+            return "slow"
+        return "ok"
+
+    def wrap(self, request: Callable) -> Callable:
+        """包装HTTP请求方法（如jmcomic客户端的 postman.get），每次请求都经过并发控制"""
+        def limited(*args, **kwargs):
+            self.acquire()
+            start = time.monotonic()
+            try:
+                resp = request(*args, **kwargs)
+            except BaseException:
+                self.release(time.monotonic() - start, "error")
+                raise
+            latency = time.monotonic() - start
+            self.release(latency, self.classify(getattr(resp, "status_code", 200), latency))
+            return resp
+        return limited
+
+    def snapshot(self) -> Dict:
+        """当前状态：并发上限、进行中和等待中的请求数，以及各结果的请求数"""
+        with self._cond:
+            return {
+                "limit": int(self.limit),
+                "min_limit": self.min_limit,
+                "max_limit": self.max_limit,
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "target_latency": self.target_latency,
+                "max_rps": self.max_rps,
+                "latency_seconds": round(self._latency, 3) if self._latency is not None else None,
+                "requests": dict(self._counts)
+            }
+
+
+# 全局单例
+upstream_limiter = AdaptiveLimiter()
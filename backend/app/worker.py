@@ -0,0 +1,38 @@
+"""
+独立的下载进程：只从共享队列领取并执行下载任务，不提供API
+
+与API进程共用 tasks.db、album_index.db 和下载目录，可以启动多个。
+API进程设置 RUN_DOWNLOADS=false 后只负责接收请求，下载全部交给下载进程。
+
+用法：
+    python -m app.worker
+"""
+import asyncio
+import signal
+from app.download_service import download_service
+
+
+async def main():
+    """运行下载进程，收到SIGINT/SIGTERM时退出"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # Windows不支持add_signal_handler，依靠KeyboardInterrupt退出
+            pass
+
+    download_service.start(run_downloads=True)
+    print(f"下载进程已启动: {download_service.scheduler.worker_id}")
+    try:
+        await stop.wait()
+    finally:
+        download_service.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
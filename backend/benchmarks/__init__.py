@@ -0,0 +1,6 @@
+"""
+离线基准测试
+
+用本地的上游站点替身和合成的下载目录测量API和下载流程的吞吐量、延迟和内存，
+不访问真实站点，结果可以和保存的基线对比。用法见 backend/README.md。
+"""
@@ -0,0 +1,441 @@
+"""
+离线基准测试
+
+在子进程中启动上游替身和API服务（使用独立的数据目录），生成合成专辑后依次运行各个场景，
+输出吞吐量、p50/p99延迟和API进程的峰值内存，并与保存的基线对比。
+
+python -m benchmarks.run                      # 运行并与基线对比，有退化时退出码为1
+python -m benchmarks.run --save-baseline      # 运行并把结果保存为新的基线
+python -m benchmarks.run --data-dir /tmp/jm-bench --albums 10000   # 复用数据目录，免去重复生成
+
+依赖 httpx（pip install httpx）。
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+
+try:
+    import httpx
+except ImportError:
+    sys.exit("基准测试需要 httpx：pip install httpx")
+
+from benchmarks.stock import generate_stock
+from benchmarks.upstream import FIRST_ALBUM_ID
+
+
+BACKEND_DIR = Path(__file__).parent.parent
+DEFAULT_BASELINE = Path(__file__).parent / "baseline.json"
+
+SCENARIOS = ("list", "images", "image", "download", "status", "rebuild")
+# 对比基线的指标：越大越好为True，越小越好为False
+COMPARED_FIELDS = {"throughput": True, "p50_ms": False, "p99_ms": False}
+# 单次批量提交的专辑数（不超过服务端的 BATCH_MAX_SIZE 默认值）
+DOWNLOAD_BATCH_SIZE = 200
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: List[float], q: float) -> float:
+    """最近秩法计算百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def read_peak_rss_mb(pid: int) -> Optional[float]:
+    """进程的峰值常驻内存（MB），仅支持Linux"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def summarize(count: int, errors: int, seconds: float, latencies: List[float]) -> Dict:
+    return {
+        "count": count,
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "throughput": round(count / seconds, 2) if seconds > 0 else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+async def run_load(
+    client: httpx.AsyncClient,
+    request: Callable[[httpx.AsyncClient, int], Awaitable[httpx.Response]],
+    total: int,
+    concurrency: int
+) -> Dict:
+    """
+    以固定并发发送 total 个请求
+
+    Args:
+        client: HTTP客户端
+        request: 发送单个请求的协程函数，参数为客户端和并发序号
+        total: 请求总数
+        concurrency: 并发数
+    """
+    counter = itertools.count()
+    latencies: List[float] = []
+    errors = 0
+
+    async def worker(index: int):
+        nonlocal errors
+        while next(counter) < total:
+            start = time.perf_counter()
+            try:
+                resp = await request(client, index)
+                failed = resp.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            latencies.append(time.perf_counter() - start)
+            if failed:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return summarize(total, errors, time.perf_counter() - start, latencies)
+
+
+class Benchmark:
+    """一次基准测试运行：管理子进程、数据目录和各场景"""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.data_dir: Path = args.data_dir or Path(tempfile.mkdtemp(prefix="jm-bench-"))
+        self.stock_ids: List[str] = []
+        self.task_ids: List[str] = []
+        self.results: Dict = {"scenarios": {}}
+        self._processes: List[subprocess.Popen] = []
+        self._logs = []
+        self.server: Optional[subprocess.Popen] = None
+
+    def prepare(self):
+        """生成合成专辑，清除上次运行留下的数据库、缓存和下载结果"""
+        for pattern in ("tasks.db*", "tasks_archive.db*", "album_index.db*"):
+            for path in self.data_dir.glob(pattern):
+                path.unlink()
+        shutil.rmtree(self.data_dir / "cache", ignore_errors=True)
+        shutil.rmtree(self.data_dir / "pdf", ignore_errors=True)
+        stock_dir = self.data_dir / "stock"
+        if stock_dir.exists():
+            for path in stock_dir.glob("Bench *"):
+                shutil.rmtree(path)
+
+        start = time.perf_counter()
+        self.stock_ids = generate_stock(
+            stock_dir, self.args.albums, self.args.chapters, self.args.pages
+        )
+        print(f"合成专辑: {len(self.stock_ids)} 个（{time.perf_counter() - start:.1f}s）")
+
+    def _spawn(self, module: str, args: List[str], log_name: str) -> subprocess.Popen:
+        env = dict(os.environ, DATA_DIR=str(self.data_dir))
+        log = open(self.data_dir / log_name, "wb")
+        self._logs.append(log)
+        process = subprocess.Popen(
+            [sys.executable, "-m", module, *args],
+            cwd=BACKEND_DIR,
+            env=env,
+            stdout=log,
+            stderr=subprocess.STDOUT
+        )
+        self._processes.append(process)
+        return process
+
+    async def start(self, client: httpx.AsyncClient):
+        """启动上游替身和API服务，等待API可用（首次启动包含建立专辑索引的时间）"""
+        upstream_port = free_port()
+        self._spawn("benchmarks.upstream", [
+            "--port", str(upstream_port),
+            "--chapters", str(self.args.upstream_chapters),
+            "--pages", str(self.args.upstream_pages),
+            "--latency-ms", str(self.args.latency_ms),
+            "--jitter-ms", str(self.args.jitter_ms),
+            "--error-rate", str(self.args.error_rate),
+        ], "upstream.log")
+
+        start = time.perf_counter()
+        self.server = self._spawn("benchmarks.server", [
+            "--upstream", f"127.0.0.1:{upstream_port}",
+            "--port", str(self.args.port),
+        ], "server.log")
+        while True:
+            if self.server.poll() is not None:
+                raise RuntimeError(f"API服务启动失败，见 {self.data_dir / 'server.log'}")
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+        self.results["startup_seconds"] = round(time.perf_counter() - start, 3)
+        print(f"API服务已启动（{self.results['startup_seconds']}s）")
+
+    def stop(self):
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        for log in self._logs:
+            log.close()
+        if self.args.data_dir is None and not self.args.keep:
+            shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def _record(self, name: str, result: Dict):
+        result["peak_rss_mb"] = read_peak_rss_mb(self.server.pid)
+        self.results["scenarios"][name] = result
+        print(
+            f"  {name:<9} {result['count']:>6} 次  {result['throughput']:>9.1f}/s  "
+            f"p50 {result['p50_ms']:>8.2f}ms  p99 {result['p99_ms']:>8.2f}ms  "
+            f"错误 {result['errors']}  峰值内存 {result['peak_rss_mb']}MB"
+        )
+
+    async def scenario_list(self, client: httpx.AsyncClient):
+        """按游标逐页浏览专辑列表，到最后一页后从头开始"""
+        cursors: List[Optional[str]] = [None] * self.args.concurrency
+
+        async def request(client: httpx.AsyncClient, index: int) -> httpx.Response:
+            params = {"limit": 50}
+            if cursors[index]:
+                params["cursor"] = cursors[index]
+            resp = await client.get("/api/v1/download/list", params=params)
+            if resp.status_code == 200:
+                cursors[index] = resp.json().get("next_cursor")
+            return resp
+
+        return await run_load(client, request, self.args.requests, self.args.concurrency)
+
+    async def scenario_images(self, client: httpx.AsyncClient):
+        """随机专辑的图片列表"""
+        async def request(client: httpx.AsyncClient, index: int) -> httpx.Response:
+            return await client.get(f"/api/v1/download/images/{self.rng.choice(self.stock_ids)}")
+
+        return await run_load(client, request, self.args.requests, self.args.concurrency)
+
+    async def scenario_image(self, client: httpx.AsyncClient):
+        """随机专辑的随机一页原图"""
+        async def request(client: httpx.AsyncClient, index: int) -> httpx.Response:
+            album_id = self.rng.choice(self.stock_ids)
+            chapter = self.rng.randint(1, self.args.chapters)
+            page = self.rng.randint(1, self.args.pages)
+            return await client.get(f"/api/v1/download/image/{album_id}/{chapter}/{page:05d}.jpg")
+
+        return await run_load(client, request, self.args.requests, self.args.concurrency)
+
+    async def scenario_download(self, client: httpx.AsyncClient):
+        """
+        批量下载上游替身的专辑，轮询批量状态直到全部结束
+
+        吞吐量为每秒完成的专辑数，延迟为单个专辑的下载耗时（任务的profile）
+        """
+        album_ids = [str(FIRST_ALBUM_ID + i) for i in range(self.args.download_albums)]
+        start = time.perf_counter()
+        for i in range(0, len(album_ids), DOWNLOAD_BATCH_SIZE):
+            resp = await client.post("/api/v1/download/albums", json={
+                "album_ids": album_ids[i:i + DOWNLOAD_BATCH_SIZE],
+                "profile": True
+            })
+            resp.raise_for_status()
+            self.task_ids.extend(task["task_id"] for task in resp.json()["tasks"])
+
+        statuses: Dict[str, Dict] = {}
+        while True:
+            for i in range(0, len(self.task_ids), DOWNLOAD_BATCH_SIZE):
+                resp = await client.post("/api/v1/download/status", json={
+                    "task_ids": self.task_ids[i:i + DOWNLOAD_BATCH_SIZE]
+                })
+                resp.raise_for_status()
+                statuses.update((task["task_id"], task) for task in resp.json()["tasks"])
+            if all(statuses.get(task_id, {}).get("status") in TERMINAL_STATUSES for task_id in self.task_ids):
+                break
+            await asyncio.sleep(0.25)
+        elapsed = time.perf_counter() - start
+
+        finished = list(statuses.values())
+        errors = sum(1 for task in finished if task["status"] != "completed")
+        profiles = [task.get("profile") or {} for task in finished]
+        latencies = [profile["download_seconds"] for profile in profiles if "download_seconds" in profile]
+        result = summarize(len(finished), errors, elapsed, latencies)
+        images = sum(task.get("total_images") or 0 for task in finished)
+        size = sum(task.get("bytes_downloaded") or 0 for task in finished)
+        result["images_per_second"] = round(images / elapsed, 2)
+        result["mb_per_second"] = round(size / elapsed / 1024 / 1024, 2)
+        # 各阶段的平均耗时（秒/专辑）
+        stages = sorted({key for profile in profiles for key in profile if key.endswith("_seconds")})
+        result["stages"] = {
+            key: round(sum(profile.get(key, 0) for profile in profiles) / max(len(profiles), 1), 3)
+            for key in stages
+        }
+        return result
+
+    async def scenario_status(self, client: httpx.AsyncClient):
+        """查询下载场景创建的任务状态"""
+        if not self.task_ids:
+            return None
+
+        async def request(client: httpx.AsyncClient, index: int) -> httpx.Response:
+            return await client.get(f"/api/v1/download/status/{self.rng.choice(self.task_ids)}")
+
+        return await run_load(client, request, self.args.requests, self.args.concurrency)
+
+    async def scenario_rebuild(self, client: httpx.AsyncClient):
+        """从磁盘重建专辑索引（扫描全部专辑）"""
+        async def request(client: httpx.AsyncClient, index: int) -> httpx.Response:
+            return await client.post("/api/v1/download/index/rebuild")
+
+        return await run_load(client, request, self.args.rebuilds, 1)
+
+    async def run(self) -> Dict:
+        self.prepare()
+        limits = httpx.Limits(max_connections=self.args.concurrency, max_keepalive_connections=self.args.concurrency)
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{self.args.port}", limits=limits, timeout=300
+        ) as client:
+            try:
+                await self.start(client)
+                for name in SCENARIOS:
+                    if name not in self.args.scenarios:
+                        continue
+                    result = await getattr(self, f"scenario_{name}")(client)
+                    if result is not None:
+                        self._record(name, result)
+                self.results["peak_rss_mb"] = read_peak_rss_mb(self.server.pid)
+            finally:
+                self.stop()
+
+        self.results["meta"] = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "params": {
+                key: value for key, value in vars(self.args).items()
+                if key not in ("data_dir", "baseline", "output", "save_baseline", "keep")
+            },
+        }
+        return self.results
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[Dict]:
+    """
+    与基线对比
+
+    Args:
+        results: 本次结果
+        baseline: 基线结果
+        tolerance: 允许的变化比例，超出时视为退化
+
+    Returns:
+        对比记录列表，每条包含 metric、baseline、current、change、regressed
+    """
+    pairs = [("startup_seconds", results.get("startup_seconds"), baseline.get("startup_seconds"), False),
+             ("peak_rss_mb", results.get("peak_rss_mb"), baseline.get("peak_rss_mb"), False)]
+    for name, current in results["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if old is None:
+            continue
+        for field, higher_is_better in COMPARED_FIELDS.items():
+            pairs.append((f"{name}.{field}", current.get(field), old.get(field), higher_is_better))
+
+    rows = []
+    for metric, current, old, higher_is_better in pairs:
+        if not current or not old:
+            continue
+        change = (current - old) / old
+        regressed = -change > tolerance if higher_is_better else change > tolerance
+        rows.append({
+            "metric": metric,
+            "baseline": old,
+            "current": current,
+            "change": round(change, 4),
+            "regressed": regressed,
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线基准测试")
+    parser.add_argument("--data-dir", type=Path, help="数据目录（指定后保留，合成专辑可以复用；默认使用临时目录）")
+    parser.add_argument("--keep", action="store_true", help="保留临时数据目录（含服务日志）")
+    parser.add_argument("--albums", type=int, default=10000, help="合成专辑数")
+    parser.add_argument("--chapters", type=int, default=1, help="合成专辑的章节数")
+    parser.add_argument("--pages", type=int, default=8, help="合成专辑每章的页数")
+    parser.add_argument("--requests", type=int, default=2000, help="每个接口场景的请求数")
+    parser.add_argument("--concurrency", type=int, default=16, help="并发请求数")
+    parser.add_argument("--download-albums", type=int, default=20, help="下载场景的专辑数")
+    parser.add_argument("--upstream-chapters", type=int, default=2, help="上游替身每个专辑的章节数")
+    parser.add_argument("--upstream-pages", type=int, default=10, help="上游替身每章的页数")
+    parser.add_argument("--latency-ms", type=float, default=50, help="上游平均响应延迟（毫秒）")
+    parser.add_argument("--jitter-ms", type=float, default=20, help="上游延迟的随机浮动范围（毫秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="上游返回503的比例")
+    parser.add_argument("--rebuilds", type=int, default=3, help="重建索引场景的次数")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"要运行的场景，可选 {','.join(SCENARIOS)}")
+    parser.add_argument("--port", type=int, default=0, help="API服务端口（默认自动分配）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="结果保存路径（JSON）")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE, help="基线文件")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果保存为基线")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="允许的变化比例，超出时视为退化")
+    args = parser.parse_args()
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"未知的场景: {', '.join(sorted(unknown))}")
+    if args.port == 0:
+        args.port = free_port()
+
+    results = asyncio.run(Benchmark(args).run())
+    print(f"启动 {results['startup_seconds']}s，API进程峰值内存 {results['peak_rss_mb']}MB")
+
+    if args.output:
+        args.output.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"已保存基线: {args.baseline}")
+        return
+    if not args.baseline.exists():
+        print("没有基线，使用 --save-baseline 保存本次结果作为基线")
+        return
+
+    baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+    rows = compare(results, baseline, args.tolerance)
+    print(f"\n与基线对比（{baseline.get('meta', {}).get('timestamp', '?')}，允许变化 ±{args.tolerance:.0%}）")
+    for row in rows:
+        mark = "  退化" if row["regressed"] else ""
+        print(f"  {row['metric']:<24} {row['baseline']:>10} → {row['current']:>10}  {row['change']:+.1%}{mark}")
+    if any(row["regressed"] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
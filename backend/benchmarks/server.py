@@ -0,0 +1,30 @@
+"""
+从上游替身下载的API服务（由 benchmarks.run 在子进程中启动）
+
+数据目录通过环境变量 DATA_DIR 指定，需要在导入app之前设置好。
+
+python -m benchmarks.server --upstream 127.0.0.1:8900 --port 8800
+"""
+import argparse
+
+import uvicorn
+
+from benchmarks.upstream import install
+
+
+def main():
+    parser = argparse.ArgumentParser(description="使用上游替身的API服务")
+    parser.add_argument("--upstream", required=True, help="上游替身的地址，如 127.0.0.1:8900")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    args = parser.parse_args()
+
+    from app.main import app
+    from app.download_service import download_service
+
+    install(download_service.option, args.upstream)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
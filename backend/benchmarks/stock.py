@@ -0,0 +1,95 @@
+"""
+合成的下载目录
+
+按下载目录的结构（专辑/章节/页）生成大量专辑，用于测量专辑索引、列表和图片接口。
+同一份JPEG以硬链接方式复用，一万个专辑只占用几张图片的磁盘空间（不支持硬链接时复制文件）。
+
+单独生成：python -m benchmarks.stock --albums 10000 --out /tmp/jm-bench/stock
+"""
+import argparse
+import errno
+import io
+import os
+import time
+from pathlib import Path
+from typing import List
+
+from benchmarks.upstream import make_page
+
+
+# 合成专辑的ID从这里开始，与上游替身的专辑ID（FIRST_ALBUM_ID起）不重叠
+FIRST_STOCK_ID = 100000
+
+
+def generate_stock(
+    stock_dir: Path,
+    albums: int = 10000,
+    chapters: int = 1,
+    pages: int = 8,
+    width: int = 400,
+    height: int = 600
+) -> List[str]:
+    """
+    生成合成专辑（已存在的专辑文件夹跳过）
+
+    Args:
+        stock_dir: 下载目录
+        albums: 专辑数
+        chapters: 每个专辑的章节数
+        pages: 每个章节的页数
+        width: 图片宽度
+        height: 图片高度
+
+    Returns:
+        全部合成专辑的ID
+    """
+    stock_dir.mkdir(parents=True, exist_ok=True)
+    source = stock_dir / ".bench-page.jpg"
+    if not source.exists():
+        buffer = io.BytesIO()
+        make_page(width, height).save(buffer, format="JPEG", quality=85)
+        source.write_bytes(buffer.getvalue())
+    data = None
+
+    album_ids = []
+    for i in range(albums):
+        album_id = str(FIRST_STOCK_ID + i)
+        album_ids.append(album_id)
+        album_dir = stock_dir / album_id
+        if album_dir.exists():
+            continue
+        for chapter in range(1, chapters + 1):
+            chapter_dir = album_dir / str(chapter)
+            chapter_dir.mkdir(parents=True)
+            for page in range(1, pages + 1):
+                target = chapter_dir / f"{page:05d}.jpg"
+                try:
+                    os.link(source, target)
+                except OSError as e:
+                    if data is None:
+                        data = source.read_bytes()
+                    if e.errno == errno.EMLINK:
+                        # 链接数达到文件系统上限（ext4为65000），换一份新的源文件
+                        source = stock_dir / f".bench-page-{album_id}.jpg"
+                        source.write_bytes(data)
+                        os.link(source, target)
+                    else:
+                        target.write_bytes(data)
+    return album_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成合成的下载目录")
+    parser.add_argument("--out", type=Path, required=True, help="下载目录")
+    parser.add_argument("--albums", type=int, default=10000)
+    parser.add_argument("--chapters", type=int, default=1)
+    parser.add_argument("--pages", type=int, default=8)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    album_ids = generate_stock(args.out, args.albums, args.chapters, args.pages)
+    print(f"已生成 {len(album_ids)} 个专辑，用时 {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
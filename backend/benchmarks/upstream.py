@@ -0,0 +1,309 @@
+"""
+上游站点的本地替身
+
+按ID生成专辑和章节信息，返回按jmcomic的分割算法打乱的JPEG图片（下载后会经过真实的解码流程），
+可以配置响应延迟和错误率。BenchClient 是对应的jmcomic客户端，install() 让下载服务改从替身下载。
+
+单独启动：python -m benchmarks.upstream --port 8900 --latency-ms 50 --error-rate 0.01
+"""
+import argparse
+import io
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+from urllib.parse import urlparse
+
+import jmcomic
+from jmcomic import AbstractJmClient, ExceptionTool, JmImageTool, JmModuleConfig, JmcomicText
+from PIL import Image, ImageDraw
+
+
+# 大于等于该值的图片需要解码（jmcomic按scramble_id判断）
+SCRAMBLE_ID = 220980
+# 章节ID = 专辑ID * PHOTO_ID_FACTOR + 章节序号，专辑ID从 FIRST_ALBUM_ID 开始，
+# 章节ID均大于421926，图片按最新的分割算法打乱
+PHOTO_ID_FACTOR = 100
+FIRST_ALBUM_ID = 500000
+
+
+def photo_id_of(album_id: int, index: int) -> str:
+    """专辑中第 index 个章节（从1开始）的ID"""
+    return str(album_id * PHOTO_ID_FACTOR + index)
+
+
+def album_id_of(photo_id: int) -> Tuple[int, int]:
+    """章节ID → (专辑ID, 章节序号)"""
+    return divmod(photo_id, PHOTO_ID_FACTOR)
+
+
+def scramble(image: Image.Image, num: int) -> Image.Image:
+    """
+    按jmcomic解码算法的逆过程打乱图片，解码后恢复原图
+
+    Args:
+        image: 原图
+        num: 分割数，0表示不打乱
+    """
+    if num == 0:
+        return image
+    w, h = image.size
+    result = Image.new("RGB", (w, h))
+    over = h % num
+    for i in range(num):
+        move = h // num
+        y_src = h - move * (i + 1) - over
+        y_dst = move * i
+        if i == 0:
+            move += over
+        else:
+            y_dst += over
+        result.paste(image.crop((0, y_dst, w, y_dst + move)), (0, y_src))
+    return result
+
+
+def make_page(width: int, height: int, seed: int = 0) -> Image.Image:
+    """生成一张合成的漫画页：渐变背景、分格和噪点，JPEG体积接近真实页面"""
+    rng = random.Random(seed)
+    image = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        x1 = x0 + rng.randrange(20, max(21, width // 3))
+        y1 = y0 + rng.randrange(20, max(21, height // 4))
+        fill = tuple(rng.randrange(256) for _ in range(3))
+        draw.rectangle((x0, y0, x1, y1), fill=fill, outline=(0, 0, 0), width=3)
+    noise = Image.effect_noise((width, height), 40).convert("RGB")
+    return Image.blend(image, noise, 0.25)
+
+
+class FakeUpstream:
+    """上游替身的数据和行为：专辑结构、图片内容、延迟和错误率"""
+
+    def __init__(
+        self,
+        chapters: int = 2,
+        pages: int = 10,
+        width: int = 800,
+        height: int = 1200,
+        latency_ms: float = 50,
+        jitter_ms: float = 20,
+        error_rate: float = 0.0,
+        quality: int = 85
+    ):
+        """
+        Args:
+            chapters: 每个专辑的章节数（最多 PHOTO_ID_FACTOR - 1）
+            pages: 每个章节的页数
+            width: 图片宽度
+            height: 图片高度
+            latency_ms: 每个请求的平均延迟（毫秒）
+            jitter_ms: 延迟的随机浮动范围（毫秒）
+            error_rate: 返回503的请求比例
+            quality: 图片的JPEG质量
+        """
+        self.chapters = max(1, min(chapters, PHOTO_ID_FACTOR - 1))
+        self.pages = max(1, pages)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.quality = quality
+        self._page = make_page(width, height)
+        # 分割数只有少数几种取值，每种打乱结果编码一次后复用
+        self._images: Dict[int, bytes] = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    def album(self, album_id: int) -> Dict:
+        return {
+            "album_id": str(album_id),
+            "name": f"Bench {album_id}",
+            "scramble_id": SCRAMBLE_ID,
+            "page_count": self.chapters * self.pages,
+            "episodes": [
+                [photo_id_of(album_id, i), str(i), f"第{i}话"] for i in range(1, self.chapters + 1)
+            ],
+        }
+
+    def photo(self, photo_id: int) -> Dict:
+        album_id, index = album_id_of(photo_id)
+        if not 1 <= index <= self.chapters:
+            raise KeyError(photo_id)
+        return {
+            "photo_id": str(photo_id),
+            "name": f"第{index}话",
+            "series_id": str(album_id),
+            "sort": index,
+            "scramble_id": SCRAMBLE_ID,
+            "page_arr": [f"{page:05d}.jpg" for page in range(1, self.pages + 1)],
+        }
+
+    def image(self, path: str) -> bytes:
+        """返回图片URL路径对应的打乱后的JPEG"""
+        num = JmImageTool.get_num_by_url(SCRAMBLE_ID, path)
+        with self._lock:
+            data = self._images.get(num)
+        if data is None:
+            buffer = io.BytesIO()
+            scramble(self._page, num).save(buffer, format="JPEG", quality=self.quality)
+            data = buffer.getvalue()
+            with self._lock:
+                self._images[num] = data
+        return data
+
+    def begin_request(self) -> bool:
+        """模拟网络延迟，返回本次请求是否应当失败"""
+        delay = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+        failed = random.random() < self.error_rate
+        with self._lock:
+            self.requests += 1
+            if failed:
+                self.errors += 1
+        return not failed
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        upstream: FakeUpstream = self.server.upstream
+        if not upstream.begin_request():
+            self._send(503, b"service unavailable", "text/plain")
+            return
+        path = urlparse(self.path).path
+        parts = path.strip("/").split("/")
+        try:
+            if len(parts) == 2 and parts[0] == "album":
+                self._send_json(upstream.album(int(parts[1])))
+            elif len(parts) == 2 and parts[0] == "photo":
+                self._send_json(upstream.photo(int(parts[1])))
+            elif len(parts) == 4 and parts[:2] == ["media", "photos"]:
+                self._send(200, upstream.image(path), "image/jpeg")
+            else:
+                self._send(404, b"not found", "text/plain")
+        except (KeyError, ValueError):
+            self._send(404, b"not found", "text/plain")
+
+    def _send_json(self, data: Dict):
+        self._send(200, json.dumps(data, ensure_ascii=False).encode("utf-8"), "application/json")
+
+    def _send(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def create_server(upstream: FakeUpstream, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """创建上游替身的HTTP服务（port为0时自动分配端口）"""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.upstream = upstream
+    return server
+
+
+class BenchClient(AbstractJmClient):
+    """从上游替身获取专辑和章节信息的jmcomic客户端，图片下载和解码沿用jmcomic的实现"""
+
+    client_key = "bench"
+
+    def get_album_detail(self, album_id) -> jmcomic.JmAlbumDetail:
+        data = self._get_json(f"/album/{JmcomicText.parse_to_jm_id(album_id)}")
+        return JmModuleConfig.album_class()(
+            album_id=data["album_id"],
+            scramble_id=data["scramble_id"],
+            name=data["name"],
+            episode_list=[tuple(episode) for episode in data["episodes"]],
+            page_count=data["page_count"],
+            pub_date="",
+            update_date="",
+            likes="0",
+            views="0",
+            comment_count=0,
+            works=[],
+            actors=[],
+            authors=["bench"],
+            tags=[],
+        )
+
+    def get_photo_detail(self, photo_id, fetch_album=True, fetch_scramble_id=True) -> jmcomic.JmPhotoDetail:
+        data = self._get_json(f"/photo/{JmcomicText.parse_to_jm_id(photo_id)}")
+        photo = JmModuleConfig.photo_class()(
+            photo_id=data["photo_id"],
+            name=data["name"],
+            series_id=data["series_id"],
+            sort=data["sort"],
+            scramble_id=data["scramble_id"],
+            page_arr=data["page_arr"],
+            data_original_domain=self.domain_list[0],
+        )
+        if fetch_album:
+            photo.from_album = self.get_album_detail(photo.album_id)
+        return photo
+
+    def _get_json(self, path: str) -> Dict:
+        return self.get(path).json()
+
+    def raise_if_resp_should_retry(self, resp, is_image):
+        if not is_image and resp.status_code != 200:
+            ExceptionTool.raises(f"上游替身返回状态码 {resp.status_code}: {resp.url}")
+        return super().raise_if_resp_should_retry(resp, is_image)
+
+
+def install(option: jmcomic.JmOption, address: str):
+    """
+    让jmcomic从上游替身下载（注册客户端，改用HTTP访问）
+
+    Args:
+        option: 下载服务使用的jmcomic配置
+        address: 上游替身的地址，如 127.0.0.1:8900
+    """
+    JmModuleConfig.register_client(BenchClient)
+    JmModuleConfig.PROT = "http://"
+    option.client.impl = BenchClient.client_key
+    option.client.domain = [address]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="上游站点的本地替身")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--chapters", type=int, default=2, help="每个专辑的章节数")
+    parser.add_argument("--pages", type=int, default=10, help="每个章节的页数")
+    parser.add_argument("--width", type=int, default=800)
+    parser.add_argument("--height", type=int, default=1200)
+    parser.add_argument("--latency-ms", type=float, default=50, help="平均响应延迟（毫秒）")
+    parser.add_argument("--jitter-ms", type=float, default=20, help="延迟的随机浮动范围（毫秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回503的请求比例")
+    args = parser.parse_args()
+
+    upstream = FakeUpstream(
+        chapters=args.chapters,
+        pages=args.pages,
+        width=args.width,
+        height=args.height,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate
+    )
+    server = create_server(upstream, args.host, args.port)
+    print(f"上游替身已启动: {args.host}:{server.server_address[1]}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
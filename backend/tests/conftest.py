@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# 应用模块导入时按 DATA_DIR 创建数据目录和全局单例（专辑索引等），测试使用临时目录，不影响实际数据
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="jm-tests-")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,93 @@
+import pytest
+from PIL import Image
+from app import album_index as album_index_module
+from app.album_index import AlbumIndex
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    stock_dir, pdf_dir = tmp_path / "stock", tmp_path / "pdf"
+    stock_dir.mkdir()
+    pdf_dir.mkdir()
+    monkeypatch.setattr(album_index_module, "STOCK_DIR", stock_dir)
+    monkeypatch.setattr(album_index_module, "PDF_DIR", pdf_dir)
+    return AlbumIndex(tmp_path / "album_index.db")
+
+
+def make_folder(folder, pages=2):
+    folder.mkdir(parents=True)
+    for i in range(pages):
+        Image.new("RGB", (8, 8)).save(folder / f"{i + 1:05d}.jpg")
+
+
+def test_legacy_folder_is_found_by_alias(index):
+    stock_dir = album_index_module.STOCK_DIR
+    make_folder(stock_dir / "Title [123456]")
+    make_folder(stock_dir / "654321")
+    assert index.rebuild() == 2
+
+    album = index.get_album("123456")
+    assert album["album_id"] == "Title [123456]"
+    assert index.get_folder("123456") == stock_dir / "Title [123456]"
+    assert index.resolve_image("123456", "00001.jpg") == stock_dir / "Title [123456]" / "00001.jpg"
+    # 只匹配完整的数字段
+    assert index.get_album("12345") is None
+    assert index.get_album("654321")["album_id"] == "654321"
+
+
+def test_legacy_pdf_is_attached_to_aliased_folder(index):
+    """旧版按请求中的ID生成的PDF不会遮住别名指向的图片文件夹"""
+    stock_dir, pdf_dir = album_index_module.STOCK_DIR, album_index_module.PDF_DIR
+    make_folder(stock_dir / "Title [123456]")
+    (pdf_dir / "123456.pdf").write_bytes(b"%PDF-1.4\n")
+    assert index.rebuild() == 1
+
+    album = index.get_album("123456")
+    assert album["album_id"] == "Title [123456]"
+    assert album["has_pdf"] and album["page_count"] == 2
+    assert index.get_folder("123456") == stock_dir / "Title [123456]"
+    # PDF改为按登记的专辑ID命名
+    assert not (pdf_dir / "123456.pdf").exists()
+    assert (pdf_dir / "Title [123456].pdf").exists()
+    albums, _ = index.list_albums_page()
+    assert [a["album_id"] for a in albums] == ["Title [123456]"]
+
+
+def test_set_pdf_by_alias_does_not_create_pdf_only_row(index):
+    stock_dir, pdf_dir = album_index_module.STOCK_DIR, album_index_module.PDF_DIR
+    make_folder(stock_dir / "Title [123456]")
+    index.rebuild()
+    pdf_path = pdf_dir / "Title [123456].pdf"
+    pdf_path.write_bytes(b"%PDF-1.4\n")
+
+    index.set_pdf("123456", pdf_path)
+    assert index.count_albums() == 1
+    assert index.get_album("123456")["has_pdf"]
+    assert index.get_folder("123456") is not None
+
+    index.set_pdf("123456", None)
+    assert index.count_albums() == 1
+    assert not index.get_album("123456")["has_pdf"]
+
+
+def test_pdf_only_row_does_not_shadow_alias(index):
+    """已存在的只有PDF的登记（修复前生成的）也不影响按别名查找文件夹"""
+    stock_dir = album_index_module.STOCK_DIR
+    make_folder(stock_dir / "Title [123456]")
+    index.rebuild()
+    with index._lock, index._conn:
+        index._conn.execute(
+            "INSERT INTO albums (album_id, folder, name, has_pdf) VALUES ('123456', '', '', 1)"
+        )
+    assert index.get_album("123456")["album_id"] == "Title [123456]"
+    assert index.get_folder("123456") == stock_dir / "Title [123456]"
+
+
+
+def test_access_by_alias_updates_aliased_folder(index):
+    make_folder(album_index_module.STOCK_DIR / "Title [123456]")
+    index.rebuild()
+    index.touch("123456")
+    index.flush_access()
+    row = index._conn.execute("SELECT last_access FROM albums WHERE album_id = 'Title [123456]'").fetchone()
+    assert row["last_access"] is not None
@@ -0,0 +1,110 @@
+import asyncio
+import io
+import os
+import zipfile
+import pytest
+from app import archive
+from app.archive import AlbumArchive
+
+
+def make_album(folder, pages):
+    """按 {相对路径: 内容} 创建专辑文件夹，返回专辑索引格式的图片列表"""
+    images = []
+    for path, data in pages.items():
+        file_path = folder / path
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_bytes(data)
+        images.append({"path": path, "blob": None})
+    return images
+
+
+def read_range(album_archive, start, length):
+    async def collect():
+        return b"".join([chunk async for chunk in album_archive.iter_range(start, length)])
+    return asyncio.run(collect())
+
+
+@pytest.fixture
+def pages():
+    return {
+        "1/00001.jpg": os.urandom(1000),
+        "1/00002.jpg": os.urandom(10),
+        "2/00001.png": b"",
+        "2/00002.jpg": os.urandom(3000),
+    }
+
+
+def test_round_trip(tmp_path, pages):
+    images = make_album(tmp_path, pages)
+    album_archive = AlbumArchive(tmp_path, images)
+    album_archive.prepare()
+    data = read_range(album_archive, 0, album_archive.size)
+    assert len(data) == album_archive.size
+
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == list(pages)
+        for name, content in pages.items():
+            info = zf.getinfo(name)
+            assert info.compress_type == zipfile.ZIP_STORED
+            assert zf.read(name) == content
+
+
+def test_flat_names(tmp_path, pages):
+    images = make_album(tmp_path, pages)
+    album_archive = AlbumArchive(tmp_path, images, flat_names=True)
+    album_archive.prepare()
+    with zipfile.ZipFile(io.BytesIO(read_range(album_archive, 0, album_archive.size))) as zf:
+        assert zf.namelist() == ["001.jpg", "002.jpg", "003.png", "004.jpg"]
+        assert zf.read("004.jpg") == pages["2/00002.jpg"]
+
+
+def test_non_ascii_names(tmp_path):
+    pages = {"第1话/001.jpg": b"abc"}
+    album_archive = AlbumArchive(tmp_path, make_album(tmp_path, pages))
+    album_archive.prepare()
+    with zipfile.ZipFile(io.BytesIO(read_range(album_archive, 0, album_archive.size))) as zf:
+        assert zf.read("第1话/001.jpg") == b"abc"
+
+
+def test_ranges_concatenate_to_full_archive(tmp_path, pages):
+    album_archive = AlbumArchive(tmp_path, make_album(tmp_path, pages))
+    album_archive.prepare()
+    full = read_range(album_archive, 0, album_archive.size)
+    # 任意位置切分（包括落在文件头、文件内容和中央目录中）后拼接的结果与整体相同
+    for step in (37, 500, 1024, 4096):
+        parts = [
+            read_range(album_archive, start, min(step, album_archive.size - start))
+            for start in range(0, album_archive.size, step)
+        ]
+        assert b"".join(parts) == full
+    assert read_range(album_archive, 1500, 100) == full[1500:1600]
+
+
+def test_etag_changes_with_content(tmp_path, pages):
+    images = make_album(tmp_path, pages)
+    first = AlbumArchive(tmp_path, images)
+    first.prepare()
+    (tmp_path / "1/00002.jpg").write_bytes(b"changed")
+    second = AlbumArchive(tmp_path, images)
+    second.prepare()
+    assert first.etag != second.etag
+
+
+def test_zip64_end_records(tmp_path, pages, monkeypatch):
+    # 文件数超过ZIP限制时使用ZIP64结束记录，降低阈值避免生成六万多个文件
+    monkeypatch.setattr(archive, "ZIP64_COUNT_LIMIT", 2)
+    album_archive = AlbumArchive(tmp_path, make_album(tmp_path, pages))
+    album_archive.prepare()
+    data = read_range(album_archive, 0, album_archive.size)
+    assert b"PK\x06\x06" in data and b"PK\x06\x07" in data
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == list(pages)
+
+
+def test_missing_file(tmp_path, pages):
+    images = make_album(tmp_path, pages)
+    (tmp_path / "1/00002.jpg").unlink()
+    with pytest.raises(FileNotFoundError):
+        AlbumArchive(tmp_path, images).prepare()
@@ -0,0 +1,103 @@
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from app.http_cache import RangeNotSatisfiable, parse_range, range_response
+
+
+DATA = bytes(range(100))
+ETAG = '"data-v1"'
+
+
+async def iter_data(start: int, length: int):
+    # 分成小块，验证拼接后的内容
+    for offset in range(start, start + length, 7):
+        yield DATA[offset:min(offset + 7, start + length)]
+
+
+app = FastAPI()
+
+
+@app.api_route("/data", methods=["GET", "HEAD"])
+async def get_data(request: Request):
+    return range_response(request, len(DATA), {"ETag": ETAG}, "application/octet-stream", iter_data)
+
+
+@app.get("/empty")
+async def get_empty(request: Request):
+    return range_response(request, 0, {"ETag": ETAG}, "application/octet-stream", iter_data)
+
+
+client = TestClient(app)
+
+
+def get(headers=None, path="/data"):
+    return client.get(path, headers=headers or {})
+
+
+def test_full_content_without_range():
+    resp = get()
+    assert resp.status_code == 200
+    assert resp.content == DATA
+    assert resp.headers["content-length"] == "100"
+    assert resp.headers["accept-ranges"] == "bytes"
+
+
+@pytest.mark.parametrize("header, start, end", [
+    ("bytes=0-9", 0, 9),
+    ("bytes=10-", 10, 99),
+    ("bytes=90-1000", 90, 99),  # 结束位置超出时截断到文件末尾
+    ("bytes=-5", 95, 99),  # 后缀范围：最后5个字节
+    ("bytes=-1000", 0, 99),  # 后缀长度超过文件大小时返回整个文件
+    ("bytes=99-99", 99, 99),
+])
+def test_partial_content(header, start, end):
+    resp = get({"Range": header})
+    assert resp.status_code == 206
+    assert resp.content == DATA[start:end + 1]
+    assert resp.headers["content-range"] == f"bytes {start}-{end}/100"
+    assert resp.headers["content-length"] == str(end - start + 1)
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=150-200", "bytes=-0", "bytes=20-10"])
+def test_range_not_satisfiable(header):
+    resp = get({"Range": header})
+    assert resp.status_code == 416
+    assert resp.headers["content-range"] == "bytes */100"
+
+
+@pytest.mark.parametrize("header", ["bytes=0-1,5-6", "items=0-5", "bytes=a-b"])
+def test_unsupported_range_returns_full_content(header):
+    resp = get({"Range": header})
+    assert resp.status_code == 200
+    assert resp.content == DATA
+
+
+def test_if_range():
+    resp = get({"Range": "bytes=0-9", "If-Range": ETAG})
+    assert resp.status_code == 206
+    assert resp.content == DATA[:10]
+    # 内容已变化时忽略Range，返回完整内容
+    resp = get({"Range": "bytes=0-9", "If-Range": '"data-v0"'})
+    assert resp.status_code == 200
+    assert resp.content == DATA
+
+
+def test_head_has_length_without_body():
+    resp = client.head("/data", headers={"Range": "bytes=-10"})
+    assert resp.status_code == 206
+    assert resp.headers["content-length"] == "10"
+    assert resp.content == b""
+
+
+def test_empty_content_ignores_range():
+    resp = get({"Range": "bytes=0-"}, path="/empty")
+    assert resp.status_code == 200
+    assert resp.content == b""
+
+
+def test_parse_range():
+    assert parse_range("bytes=-5", 3) == (0, 2)
+    assert parse_range("bytes=2-", 3) == (2, 2)
+    assert parse_range("bytes=0-1,2-3", 10) is None
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range("bytes=3-", 3)
@@ -0,0 +1,63 @@
+import asyncio
+import threading
+import uuid
+import pytest
+from app.models import TaskStatus
+from app.scheduler import DownloadScheduler
+from app.task_store import TaskStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = TaskStore(tmp_path / "tasks.db", flush_interval=0.05, archive_file=tmp_path / "tasks_archive.db")
+    yield store
+    store.close()
+
+
+def new_task(album_id: str) -> dict:
+    return {
+        "task_id": str(uuid.uuid4()),
+        "album_id": album_id,
+        "status": TaskStatus.PENDING.value,
+        "progress": 0.0,
+        "priority": 0,
+        "updated_at": "2024-01-01T00:00:00"
+    }
+
+
+def test_task_submitted_during_empty_claim_is_not_missed(store):
+    """队列为空的领取过程中提交的任务立即被领取，不等到下一次轮询"""
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        ran = asyncio.Event()
+
+        async def runner(task):
+            ran.set()
+
+        scheduler = DownloadScheduler(
+            store, runner, concurrency=1, lease_seconds=60, heartbeat_interval=60, poll_interval=30
+        )
+        claim = store.claim
+        first_claim = threading.Event()
+
+        def racing_claim(*args):
+            task = claim(*args)
+            if not first_claim.is_set():
+                first_claim.set()
+                # 领取已查到队列为空、尚未返回时，本进程提交了新任务
+                submitted = asyncio.run_coroutine_threadsafe(submit(), loop)
+                submitted.result(timeout=5)
+            return task
+
+        async def submit():
+            store.create_or_join(new_task("1"))
+            scheduler.notify()
+
+        store.claim = racing_claim
+        scheduler.start()
+        try:
+            await asyncio.wait_for(ran.wait(), timeout=5)
+        finally:
+            scheduler.stop()
+
+    asyncio.run(scenario())
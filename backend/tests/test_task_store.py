@@ -0,0 +1,104 @@
+import time
+import uuid
+import pytest
+from app.models import TaskStatus
+from app.task_store import TaskStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = TaskStore(tmp_path / "tasks.db", flush_interval=0.05, archive_file=tmp_path / "tasks_archive.db")
+    yield store
+    store.close()
+
+
+def new_task(album_id: str, priority: int = 0) -> dict:
+    return {
+        "task_id": str(uuid.uuid4()),
+        "album_id": album_id,
+        "status": TaskStatus.PENDING.value,
+        "progress": 0.0,
+        "priority": priority,
+        "updated_at": "2024-01-01T00:00:00"
+    }
+
+
+def test_create_joins_active_task_and_raises_priority(store):
+    first, created = store.create_or_join(new_task("100"))
+    assert created
+    joined, created = store.create_or_join(new_task("100", priority=5))
+    assert not created
+    assert joined["task_id"] == first["task_id"]
+    assert joined["priority"] == 5
+    # 不会降低优先级
+    joined, _ = store.create_or_join(new_task("100", priority=1))
+    assert joined["priority"] == 5
+
+
+def test_claim_order_by_priority_then_fifo(store):
+    low_a, _ = store.create_or_join(new_task("1"))
+    high, _ = store.create_or_join(new_task("2", priority=5))
+    low_b, _ = store.create_or_join(new_task("3"))
+    assert low_b["queue_position"] == 3
+
+    claimed = [store.claim("worker-a", lease_seconds=60)["task_id"] for _ in range(3)]
+    assert claimed == [high["task_id"], low_a["task_id"], low_b["task_id"]]
+    assert store.claim("worker-a", lease_seconds=60) is None
+    assert store.get(high["task_id"])["status"] == TaskStatus.DOWNLOADING.value
+
+
+def test_leased_task_is_not_claimed_twice(store):
+    task, _ = store.create_or_join(new_task("1"))
+    assert store.claim("worker-a", lease_seconds=60)["task_id"] == task["task_id"]
+    assert store.claim("worker-b", lease_seconds=60) is None
+    assert store.lease_owners() == {"worker-a"}
+
+
+def test_expired_lease_is_reclaimed(store):
+    task, _ = store.create_or_join(new_task("1"))
+    store.claim("worker-a", lease_seconds=0.05)
+    time.sleep(0.1)
+
+    reclaimed = store.claim("worker-b", lease_seconds=60)
+    assert reclaimed["task_id"] == task["task_id"]
+    # 原进程续约时发现任务已被接管
+    lost, _ = store.heartbeat("worker-a", [task["task_id"]], lease_seconds=60)
+    assert lost == {task["task_id"]}
+    lost, _ = store.heartbeat("worker-b", [task["task_id"]], lease_seconds=60)
+    assert lost == set()
+
+
+def test_heartbeat_keeps_lease(store):
+    task, _ = store.create_or_join(new_task("1"))
+    store.claim("worker-a", lease_seconds=0.2)
+    for _ in range(3):
+        time.sleep(0.1)
+        store.heartbeat("worker-a", [task["task_id"]], lease_seconds=0.2)
+    assert store.claim("worker-b", lease_seconds=60) is None
+
+
+def test_expire_leases_of_dead_worker(store):
+    task, _ = store.create_or_join(new_task("1"))
+    store.claim("worker-a", lease_seconds=60)
+    assert store.expire_leases(["worker-a"]) == 1
+    assert store.claim("worker-b", lease_seconds=60)["task_id"] == task["task_id"]
+
+
+def test_released_task_is_not_reclaimed(store):
+    task, _ = store.create_or_join(new_task("1"))
+    claimed = store.claim("worker-a", lease_seconds=60)
+    claimed["status"] = TaskStatus.COMPLETED.value
+    store.put(task["task_id"], claimed)
+    store.release(task["task_id"], "worker-a")
+    assert store.get(task["task_id"])["status"] == TaskStatus.COMPLETED.value
+    assert store.claim("worker-b", lease_seconds=60) is None
+
+
+def test_cancel_requested_with_expired_lease_is_finished_on_claim(store):
+    task, _ = store.create_or_join(new_task("1"))
+    store.claim("worker-a", lease_seconds=0.05)
+    store.request_cancel(task["task_id"])
+    time.sleep(0.1)
+
+    assert store.claim("worker-b", lease_seconds=60) is None
+    assert store.get(task["task_id"])["status"] == TaskStatus.CANCELLED.value
@@ -1,46 +1,109 @@
 import { useState, useEffect, useRef } from 'react';
 import apiService from '../services/api';
 
+const isFinished = (statusData) =>
+  ['completed', 'failed', 'cancelled'].includes(statusData.status);
+
+// 推送不可用时，所有任务共用一个轮询：每2秒批量查询一次有变化的任务
+const pollWatchers = new Map();
+let pollTimer = null;
+let pollAsOf = null;
+
+const pollAll = async () => {
+  const taskIds = [...pollWatchers.keys()];
+  if (taskIds.length === 0) return;
+  try {
+    const data = await apiService.getBulkStatus(taskIds, pollAsOf);
+    pollAsOf = data.as_of;
+    data.tasks.forEach((statusData) => {
+      pollWatchers.get(statusData.task_id)?.onStatus(statusData);
+    });
+    data.missing.forEach((taskId) => {
+      pollWatchers.get(taskId)?.onError(new Error('任务不存在'));
+    });
+  } catch (err) {
+    pollWatchers.forEach((watcher) => watcher.onError(err));
+  }
+};
+
+const watchByPolling = (taskId, watcher) => {
+  pollWatchers.set(taskId, watcher);
+  // 新加入的任务需要完整状态，从头查询一次
+  pollAsOf = null;
+  if (!pollTimer) {
+    pollTimer = setInterval(pollAll, 2000);
+  }
+  pollAll();
+  return () => {
+    pollWatchers.delete(taskId);
+    if (pollWatchers.size === 0 && pollTimer) {
+      clearInterval(pollTimer);
+      pollTimer = null;
+    }
+  };
+};
+
 export const useDownload = (taskId) => {
   const [status, setStatus] = useState(null);
   const [error, setError] = useState(null);
-  const intervalRef = useRef(null);
+  const pollRef = useRef(null);
+  const streamRef = useRef(null);
 
   useEffect(() => {
     if (!taskId) return;
 
-    const pollStatus = async () => {
-      try {
-        const statusData = await apiService.getDownloadStatus(taskId);
-        setStatus(statusData);
-        setError(null);
+    const stopPolling = () => {
+      if (pollRef.current) {
+        pollRef.current();
+        pollRef.current = null;
+      }
+    };
 
-        // 如果任务完成或失败，停止轮询
-        if (statusData.status === 'completed' || statusData.status === 'failed') {
-          if (intervalRef.current) {
-            clearInterval(intervalRef.current);
-            intervalRef.current = null;
-          }
-        }
-      } catch (err) {
-        setError(err.message);
-        if (intervalRef.current) {
-          clearInterval(intervalRef.current);
-          intervalRef.current = null;
-        }
+    const stopStream = () => {
+      if (streamRef.current) {
+        streamRef.current.close();
+        streamRef.current = null;
       }
     };
 
-    // 立即查询一次
-    pollStatus();
+    // 推送不可用时回退为批量轮询
+    const startPolling = () => {
+      if (pollRef.current) return;
+      pollRef.current = watchByPolling(taskId, {
+        onStatus: (statusData) => {
+          setStatus(statusData);
+          setError(null);
+          // 如果任务完成、失败或已取消，停止轮询
+          if (isFinished(statusData)) {
+            stopPolling();
+          }
+        },
+        onError: (err) => {
+          setError(err.message);
+          stopPolling();
+        },
+      });
+    };
 
-    // 然后每2秒轮询一次
-    intervalRef.current = setInterval(pollStatus, 2000);
+    // 优先使用服务端推送
+    streamRef.current = apiService.streamDownloadStatus([taskId], {
+      onStatus: (statusData) => {
+        setStatus(statusData);
+        setError(null);
+        if (isFinished(statusData)) {
+          stopStream();
+        }
+      },
+      onError: (err) => {
+        console.log('状态推送不可用，改为轮询:', err.message);
+        stopStream();
+        startPolling();
+      },
+    });
 
     return () => {
-      if (intervalRef.current) {
-        clearInterval(intervalRef.current);
-      }
+      stopStream();
+      stopPolling();
     };
   }, [taskId]);
 
@@ -69,6 +132,21 @@ export const useStartDownload = () => {
     }
   };
 
-  return { startDownload, loading, error, taskId };
+  const startBatchDownload = async (albumIds) => {
+    setLoading(true);
+    setError(null);
+    setTaskId(null);
+
+    try {
+      return await apiService.startBatchDownload(albumIds);
+    } catch (err) {
+      setError(err.message);
+      throw err;
+    } finally {
+      setLoading(false);
+    }
+  };
+
+  return { startDownload, startBatchDownload, loading, error, taskId };
 };
 
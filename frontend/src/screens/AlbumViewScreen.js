@@ -13,6 +13,8 @@ import {
 import ImageViewing from 'react-native-image-viewing';
 import apiService from '../services/api';
 
+const THUMBNAIL_WIDTH = 320;
+
 export default function AlbumViewScreen({ route, navigation }) {
   const { albumId } = route.params;
   const [imagesInfo, setImagesInfo] = useState(null);
@@ -20,6 +22,7 @@ export default function AlbumViewScreen({ route, navigation }) {
   const [viewingIndex, setViewingIndex] = useState(-1);
   const [viewingImages, setViewingImages] = useState([]);
   const [hasPDF, setHasPDF] = useState(false);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   useEffect(() => {
     loadImages();
@@ -55,6 +58,27 @@ export default function AlbumViewScreen({ route, navigation }) {
     }
   };
 
+  // 滚动到底部时加载下一页图片
+  const loadMoreImages = async () => {
+    if (!imagesInfo?.next_cursor || loadingMore) return;
+    try {
+      setLoadingMore(true);
+      const info = await apiService.getImagesInfo(albumId, imagesInfo.next_cursor);
+      setImagesInfo((prev) => ({
+        ...info,
+        images: [...prev.images, ...info.images],
+      }));
+      setViewingImages((prev) => [
+        ...prev,
+        ...info.images.map((img) => apiService.getImageUrl(albumId, img.path)),
+      ]);
+    } catch (error) {
+      console.error('加载更多图片失败:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleViewPDF = () => {
     navigation.navigate('PDFView', { albumId });
   };
@@ -64,7 +88,11 @@ export default function AlbumViewScreen({ route, navigation }) {
   };
 
   const renderImage = ({ item, index }) => {
-    const imageUrl = apiService.getImageUrl(albumId, item.path);
+    // 网格中只需要缩略图，原图留给查看器
+    const imageUrl = apiService.getImageUrl(albumId, item.path, {
+      width: THUMBNAIL_WIDTH,
+      format: 'webp',
+    });
     return (
       <TouchableOpacity
         style={styles.imageContainer}
@@ -119,6 +147,8 @@ export default function AlbumViewScreen({ route, navigation }) {
         keyExtractor={(item, index) => `image-${index}`}
         numColumns={2}
         contentContainerStyle={styles.list}
+        onEndReached={loadMoreImages}
+        onEndReachedThreshold={0.5}
       />
 
       {viewingIndex >= 0 && (
@@ -85,6 +85,15 @@ export default function DownloadScreen() {
 
 function TaskItem({ task, onRemove }) {
   const { status, error } = useDownload(task.task_id);
+  const isFinished = ['completed', 'failed', 'cancelled'].includes(status?.status);
+
+  const cancelTask = async () => {
+    try {
+      await apiService.cancelDownload(task.task_id);
+    } catch (err) {
+      console.error('取消任务失败:', err);
+    }
+  };
 
   const getStatusText = () => {
     if (!status) return '查询中...';
@@ -97,6 +106,8 @@ function TaskItem({ task, onRemove }) {
         return '已完成';
       case 'failed':
         return '失败';
+      case 'cancelled':
+        return '已取消';
       default:
         return '未知';
     }
@@ -113,6 +124,8 @@ function TaskItem({ task, onRemove }) {
         return '#4CAF50';
       case 'failed':
         return '#F44336';
+      case 'cancelled':
+        return '#9E9E9E';
       default:
         return '#999';
     }
@@ -145,6 +158,10 @@ function TaskItem({ task, onRemove }) {
             </View>
           )}
 
+          {status.status === 'pending' && status.queue_position && (
+            <Text style={styles.message}>排队中，第 {status.queue_position} 位</Text>
+          )}
+
           {status.message && (
             <Text style={styles.message}>{status.message}</Text>
           )}
@@ -158,10 +175,29 @@ function TaskItem({ task, onRemove }) {
               {status.current_image} / {status.total_images} 张图片
             </Text>
           )}
+
+          {status.pdf_status && status.pdf_status !== 'completed' && (
+            <Text style={styles.imageInfo}>
+              {status.pdf_status === 'failed' ? 'PDF生成失败，打开时将重试' : 'PDF生成中，可先浏览图片'}
+            </Text>
+          )}
+
+          {status.status === 'downloading' && status.bytes_per_second != null && (
+            <Text style={styles.imageInfo}>
+              {formatSpeed(status.bytes_per_second)}
+              {status.eta_seconds != null && `，剩余约 ${formatDuration(status.eta_seconds)}`}
+            </Text>
+          )}
         </>
       )}
 
-      {(status?.status === 'completed' || status?.status === 'failed') && (
+      {status && !isFinished && (
+        <TouchableOpacity style={styles.removeButton} onPress={cancelTask}>
+          <Text style={styles.removeButtonText}>取消</Text>
+        </TouchableOpacity>
+      )}
+
+      {isFinished && (
         <TouchableOpacity style={styles.removeButton} onPress={onRemove}>
           <Text style={styles.removeButtonText}>移除</Text>
         </TouchableOpacity>
@@ -170,6 +206,20 @@ function TaskItem({ task, onRemove }) {
   );
 }
 
+const formatSpeed = (bytesPerSecond) => {
+  if (bytesPerSecond >= 1024 * 1024) {
+    return `${(bytesPerSecond / 1024 / 1024).toFixed(1)} MB/s`;
+  }
+  return `${Math.round(bytesPerSecond / 1024)} KB/s`;
+};
+
+const formatDuration = (seconds) => {
+  if (seconds >= 60) {
+    return `${Math.floor(seconds / 60)} 分 ${Math.round(seconds % 60)} 秒`;
+  }
+  return `${Math.round(seconds)} 秒`;
+};
+
 // 导出函数以便从其他页面添加任务
 export const addActiveTask = async (task) => {
   try {
@@ -17,7 +17,7 @@ import apiService from '../services/api';
 export default function HomeScreen({ navigation }) {
   const [albumId, setAlbumId] = useState('');
   const { isConnected } = useApi();
-  const { startDownload, loading } = useStartDownload();
+  const { startDownload, startBatchDownload, loading } = useStartDownload();
 
   const handleDownload = async () => {
     if (!albumId.trim()) {
@@ -30,13 +30,23 @@ export default function HomeScreen({ navigation }) {
       return;
     }
 
+    // 支持一次输入多个ID（用空格或逗号分隔）
+    const albumIds = albumId.split(/[\s,，]+/).filter(Boolean);
+
     try {
-      const response = await startDownload(albumId.trim());
-      // 将任务添加到下载列表
-      await addActiveTask({
-        task_id: response.task_id,
-        album_id: albumId.trim(),
-      });
+      if (albumIds.length > 1) {
+        const response = await startBatchDownload(albumIds);
+        for (const task of response.tasks) {
+          await addActiveTask({ task_id: task.task_id, album_id: task.album_id });
+        }
+      } else {
+        const response = await startDownload(albumIds[0]);
+        // 将任务添加到下载列表
+        await addActiveTask({
+          task_id: response.task_id,
+          album_id: albumIds[0],
+        });
+      }
       Alert.alert('成功', '下载任务已启动', [
         {
           text: '确定',
@@ -66,8 +76,8 @@ export default function HomeScreen({ navigation }) {
           style={styles.input}
           value={albumId}
           onChangeText={setAlbumId}
-          placeholder="请输入专辑ID，例如: 350234"
-          keyboardType="numeric"
+          placeholder="请输入专辑ID，多个用空格或逗号分隔"
+          keyboardType="numbers-and-punctuation"
           editable={!loading}
         />
       </View>
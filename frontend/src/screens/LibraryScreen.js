@@ -16,6 +16,8 @@ export default function LibraryScreen({ navigation }) {
   const [albums, setAlbums] = useState([]);
   const [loading, setLoading] = useState(true);
   const [refreshing, setRefreshing] = useState(false);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const { isConnected } = useApi();
 
   useEffect(() => {
@@ -29,6 +31,7 @@ export default function LibraryScreen({ navigation }) {
       setLoading(true);
       const response = await apiService.getDownloadList();
       setAlbums(response.albums || []);
+      setNextCursor(response.next_cursor || null);
     } catch (error) {
       console.error('加载专辑列表失败:', error);
       Alert.alert('错误', '加载专辑列表失败');
@@ -37,6 +40,21 @@ export default function LibraryScreen({ navigation }) {
     }
   };
 
+  // 滚动到底部时加载下一页
+  const loadMoreAlbums = async () => {
+    if (!nextCursor || loadingMore) return;
+    try {
+      setLoadingMore(true);
+      const response = await apiService.getDownloadList(nextCursor);
+      setAlbums((prev) => [...prev, ...(response.albums || [])]);
+      setNextCursor(response.next_cursor || null);
+    } catch (error) {
+      console.error('加载更多专辑失败:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const onRefresh = async () => {
     setRefreshing(true);
     await loadAlbums();
@@ -127,6 +145,9 @@ export default function LibraryScreen({ navigation }) {
       renderItem={renderAlbum}
       keyExtractor={(item) => item.album_id}
       contentContainerStyle={styles.list}
+      onEndReached={loadMoreAlbums}
+      onEndReachedThreshold={0.5}
+      ListFooterComponent={loadingMore ? <ActivityIndicator style={styles.footer} /> : null}
       refreshControl={
         <RefreshControl refreshing={refreshing} onRefresh={onRefresh} />
       }
@@ -135,6 +156,9 @@ export default function LibraryScreen({ navigation }) {
 }
 
 const styles = StyleSheet.create({
+  footer: {
+    paddingVertical: 16,
+  },
   loadingContainer: {
     flex: 1,
     justifyContent: 'center',
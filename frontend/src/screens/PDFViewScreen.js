@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import {
   View,
   StyleSheet,
@@ -10,8 +10,11 @@ import {
 } from 'react-native';
 import * as Sharing from 'expo-sharing';
 import * as FileSystem from 'expo-file-system';
+import AsyncStorage from '@react-native-async-storage/async-storage';
 import apiService from '../services/api';
 
+const PDF_ETAG_KEY_PREFIX = '@pdf_etag_';
+
 // 尝试导入react-native-pdf，如果不可用则使用备用方案
 let Pdf = null;
 try {
@@ -29,6 +32,53 @@ export default function PDFViewScreen({ route, navigation }) {
   const [pdfAvailable, setPdfAvailable] = useState(Pdf !== null);
 
   const pdfUrl = apiService.getPDFUrl(albumId);
+  // 下载中断时保存的续传数据，下次从断点处继续（服务端支持Range）
+  const resumeDataRef = useRef(null);
+
+  // 下载PDF到本地，本地已有且未变化时不重复下载
+  const downloadPDF = async () => {
+    const fileUri = FileSystem.documentDirectory + `${albumId}.pdf`;
+    const etagKey = `${PDF_ETAG_KEY_PREFIX}${albumId}`;
+    const [info, savedEtag] = await Promise.all([
+      FileSystem.getInfoAsync(fileUri),
+      AsyncStorage.getItem(etagKey),
+    ]);
+
+    if (info.exists && savedEtag && !resumeDataRef.current) {
+      const response = await fetch(pdfUrl, {
+        method: 'HEAD',
+        headers: { 'If-None-Match': savedEtag },
+      });
+      if (response.status === 304) {
+        return fileUri;
+      }
+    }
+
+    const resumable = FileSystem.createDownloadResumable(
+      pdfUrl,
+      fileUri,
+      {},
+      undefined,
+      resumeDataRef.current
+    );
+    try {
+      const result = resumeDataRef.current
+        ? await resumable.resumeAsync()
+        : await resumable.downloadAsync();
+      resumeDataRef.current = null;
+      if (!result || (result.status !== 200 && result.status !== 206)) {
+        return null;
+      }
+      const etag = result.headers?.ETag || result.headers?.etag;
+      if (etag) {
+        await AsyncStorage.setItem(etagKey, etag);
+      }
+      return result.uri;
+    } catch (err) {
+      resumeDataRef.current = resumable.savable().resumeData;
+      throw err;
+    }
+  };
 
   useEffect(() => {
     // 如果PDF查看器不可用，提示用户使用分享功能
@@ -51,12 +101,11 @@ export default function PDFViewScreen({ route, navigation }) {
         return;
       }
 
-      // 下载PDF到本地临时文件
-      const fileUri = FileSystem.documentDirectory + `${albumId}.pdf`;
-      const downloadResult = await FileSystem.downloadAsync(pdfUrl, fileUri);
+      // 下载PDF到本地文件
+      const localUri = await downloadPDF();
 
-      if (downloadResult.status === 200) {
-        await Sharing.shareAsync(downloadResult.uri, {
+      if (localUri) {
+        await Sharing.shareAsync(localUri, {
           mimeType: 'application/pdf',
           dialogTitle: `分享 ${albumId}.pdf`,
         });
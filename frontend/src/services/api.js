@@ -67,6 +67,36 @@ class ApiService {
     }
   }
 
+  async startBatchDownload(albumIds, priority = 0) {
+    try {
+      const response = await this.getAxiosInstance().post('/api/v1/download/albums', {
+        album_ids: albumIds,
+        priority,
+      });
+      return response.data;
+    } catch (error) {
+      console.error('批量下载失败:', error);
+      throw new Error(error.response?.data?.detail || '批量下载失败');
+    }
+  }
+
+  /**
+   * 批量查询任务状态
+   * changedSince 传入上次响应的 as_of 时，只返回之后有变化的任务
+   */
+  async getBulkStatus(taskIds, changedSince = null) {
+    try {
+      const response = await this.getAxiosInstance().post('/api/v1/download/status', {
+        task_ids: taskIds,
+        changed_since: changedSince,
+      });
+      return response.data;
+    } catch (error) {
+      console.error('批量获取下载状态失败:', error);
+      throw new Error(error.response?.data?.detail || '批量获取下载状态失败');
+    }
+  }
+
   async getDownloadStatus(taskId) {
     try {
       const response = await this.getAxiosInstance().get(`/api/v1/download/status/${taskId}`);
@@ -77,9 +107,100 @@ class ApiService {
     }
   }
 
-  async getDownloadList() {
+  async cancelDownload(taskId) {
     try {
-      const response = await this.getAxiosInstance().get('/api/v1/download/list');
+      const response = await this.getAxiosInstance().post(`/api/v1/download/cancel/${taskId}`);
+      return response.data;
+    } catch (error) {
+      console.error('取消下载失败:', error);
+      throw new Error(error.response?.data?.detail || '取消下载失败');
+    }
+  }
+
+  /**
+   * 订阅任务状态推送（Server-Sent Events）
+   * React Native 没有内置 EventSource，这里用 XMLHttpRequest 增量读取事件流，
+   * 断线后带上最后收到的事件ID重连续传。
+   * 返回的对象调用 close() 即可停止订阅。
+   */
+  streamDownloadStatus(taskIds, { onStatus, onError }) {
+    let xhr = null;
+    let closed = false;
+    let lastEventId = null;
+    let retryDelay = 3000;
+    let reconnectTimer = null;
+    let received = false;
+
+    const connect = () => {
+      const params = [`task_ids=${encodeURIComponent(taskIds.join(','))}`];
+      if (lastEventId !== null) {
+        params.push(`last_event_id=${lastEventId}`);
+      }
+      xhr = new XMLHttpRequest();
+      xhr.open('GET', `${this.baseURL}/api/v1/download/events?${params.join('&')}`);
+      xhr.setRequestHeader('Accept', 'text/event-stream');
+
+      let offset = 0;
+      let buffer = '';
+      const consume = () => {
+        buffer += xhr.responseText.slice(offset);
+        offset = xhr.responseText.length;
+        const blocks = buffer.split('\n\n');
+        buffer = blocks.pop();
+        blocks.forEach((block) => {
+          let data = null;
+          block.split('\n').forEach((line) => {
+            if (line.startsWith('id:')) {
+              lastEventId = parseInt(line.slice(3).trim(), 10);
+            } else if (line.startsWith('retry:')) {
+              retryDelay = parseInt(line.slice(6).trim(), 10);
+            } else if (line.startsWith('data:')) {
+              data = line.slice(5).trim();
+            }
+          });
+          if (data) {
+            received = true;
+            onStatus(JSON.parse(data));
+          }
+        });
+      };
+
+      xhr.onprogress = consume;
+      xhr.onreadystatechange = () => {
+        if (closed || xhr.readyState !== 4) return;
+        consume();
+        // 从未收到过事件说明服务端不支持推送，交给调用方回退
+        if (xhr.status !== 200 || !received) {
+          onError(new Error('状态推送不可用'));
+          return;
+        }
+        reconnectTimer = setTimeout(connect, retryDelay);
+      };
+      xhr.onerror = () => {
+        if (closed) return;
+        onError(new Error('状态推送连接失败'));
+      };
+      xhr.send();
+    };
+
+    connect();
+
+    return {
+      close: () => {
+        closed = true;
+        clearTimeout(reconnectTimer);
+        if (xhr) {
+          xhr.abort();
+        }
+      },
+    };
+  }
+
+  async getDownloadList(cursor = null, limit = 50) {
+    try {
+      const params = { limit };
+      if (cursor) params.cursor = cursor;
+      const response = await this.getAxiosInstance().get('/api/v1/download/list', { params });
       return response.data;
     } catch (error) {
       console.error('获取下载列表失败:', error);
@@ -91,9 +212,19 @@ class ApiService {
     return `${this.baseURL}/api/v1/download/result/${albumId}`;
   }
 
-  async getImagesInfo(albumId) {
+  /**
+   * 获取专辑打包下载URL
+   * format: 'cbz'（按页码命名）或 'zip'（保留章节目录）
+   */
+  getArchiveUrl(albumId, format = 'cbz') {
+    return `${this.baseURL}/api/v1/download/archive/${albumId}?fmt=${format}`;
+  }
+
+  async getImagesInfo(albumId, cursor = null, limit = 200) {
     try {
-      const response = await this.getAxiosInstance().get(`/api/v1/download/images/${albumId}`);
+      const params = { limit };
+      if (cursor) params.cursor = cursor;
+      const response = await this.getAxiosInstance().get(`/api/v1/download/images/${albumId}`, { params });
       return response.data;
     } catch (error) {
       console.error('获取图片信息失败:', error);
@@ -101,9 +232,18 @@ class ApiService {
     }
   }
 
-  getImageUrl(albumId, imagePath) {
+  /**
+   * 获取图片URL
+   * options: { width, quality, format } 指定时由服务端缩放/转码，例如缩略图可用 { width: 320, format: 'webp' }
+   */
+  getImageUrl(albumId, imagePath, options = {}) {
     const encodedPath = encodeURIComponent(imagePath);
-    return `${this.baseURL}/api/v1/download/image/${albumId}/${encodedPath}`;
+    const params = [];
+    if (options.width) params.push(`w=${options.width}`);
+    if (options.quality) params.push(`q=${options.quality}`);
+    if (options.format) params.push(`fmt=${options.format}`);
+    const query = params.length ? `?${params.join('&')}` : '';
+    return `${this.baseURL}/api/v1/download/image/${albumId}/${encodedPath}${query}`;
   }
 
   async checkHealth(url = null) {